@@ -0,0 +1,111 @@
+# circuit_breaker.py
+from __future__ import print_function
+import logging
+import threading
+import time
+
+
+class CircuitBreaker(object):
+    """由實際請求結果被動追蹤連線狀態的斷路器
+
+    closed: 正常送出, 連續失敗達 failure_threshold 次後轉為 open。
+    open: 拒絕送出; 背景 probe 成功或超過 reset_timeout 後轉為 half_open。
+    half_open: 只放行一個試探請求, 成功轉回 closed, 失敗再轉為 open。
+
+    probe 只在 open 狀態時於背景執行緒中執行。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=60,
+                 probe=None, probe_interval=10, name="circuit"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.probe_interval = probe_interval
+        self.name = name
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def is_available(self):
+        """是否可能放行請求 (不佔用 half_open 的試探名額)"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN:
+                return not self._trial_in_flight
+            return time.time() - self._opened_at >= self.reset_timeout
+
+    def allow_request(self):
+        """請求送出前呼叫; 回傳 False 表示斷路中, 不應送出"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.time() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logging.info("%s closed, connection restored", self.name)
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                    self._state == self.CLOSED and
+                    self._failures >= self.failure_threshold):
+                self._open()
+
+    def _open(self):
+        """轉為 open 並啟動背景 probe; 呼叫時須持有 _lock"""
+        if self._state != self.OPEN:
+            logging.warning("%s open after %d failures", self.name, self._failures)
+        self._state = self.OPEN
+        self._opened_at = time.time()
+        self._trial_in_flight = False
+        if self.probe is not None and (
+                self._probe_thread is None or not self._probe_thread.is_alive()):
+            self._probe_thread = threading.Thread(target=self._probe_loop)
+            self._probe_thread.daemon = True
+            self._probe_thread.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval)
+            with self._lock:
+                if self._state != self.OPEN:
+                    return
+            try:
+                reachable = self.probe()
+            except Exception as e:
+                logging.debug("%s probe error: %s", self.name, str(e))
+                reachable = False
+            if reachable:
+                with self._lock:
+                    if self._state == self.OPEN:
+                        logging.info("%s probe succeeded, half-open", self.name)
+                        self._state = self.HALF_OPEN
+                        self._trial_in_flight = False
+                    return
@@ -16,4 +16,38 @@ class ERPConfig:
     }
 
     # 測量數據配置
-    DEFAULT_DEVICE_NAME = "ZYGO"
\ No newline at end of file
+    DEFAULT_DEVICE_NAME = "ZYGO"
+
+    # 批次上傳: 單一 composite request 的操作數與大小上限
+    BATCH_MAX_OPERATIONS = 1000
+    BATCH_MAX_BYTES = 512 * 1024
+
+    # 精簡模式: 各 MeasuredData 共用的屬性只在 Measure 上建立一次
+    # (需要 ERP 的 MeasureAttribute 表有 Measure_ID 欄位)
+    COMPACT_PAYLOAD = False
+
+    # 斷路器: 連續失敗次數、open 後自動試探的秒數、背景探測間隔與逾時
+    CIRCUIT_FAILURE_THRESHOLD = 3
+    CIRCUIT_RESET_TIMEOUT = 60
+    CIRCUIT_PROBE_INTERVAL = 10
+    CIRCUIT_PROBE_TIMEOUT = 3
+
+    # ERP HTTP client: 連線/讀取逾時(秒), 是否以 gzip 壓縮請求, log 中請求內容的最大字元數
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 30
+    GZIP_REQUESTS = False
+    LOG_BODY_LIMIT = 2000
+
+    # outbox 去重: 設定為 ERP Measure 表上具 unique 約束的欄位名稱後, 每筆 Measure
+    # 會帶上 outbox 的 idempotency key, 回應遺失時可以安全重送; 重送被 ERP 以
+    # 下列訊息拒絕時視為先前已送達。未設定時回應遺失的項目不自動重送, 需人工確認。
+    IDEMPOTENCY_COLUMN = None
+    DUPLICATE_ERROR_MARKERS = ("duplicate key", "unique constraint")
+
+
+class RetentionConfig:
+    # 量測歷史保留: 是否啟用背景保留工作, 保留天數, 歸檔目錄 (相對於資料庫所在目錄)
+    # 預設停用: 啟用後超過 MAX_AGE_DAYS 的量測會移出資料庫 (寫入歸檔檔案), 需自行開啟
+    ENABLED = False
+    MAX_AGE_DAYS = 180
+    ARCHIVE_DIR = 'archive'
@@ -1,10 +1,11 @@
 # database_manager.py
 from __future__ import print_function
-import sqlite3
 import json
 from datetime import datetime
 import os
 
+from db_connection import ConnectionManager, get_connection
+
 
 class DatabaseManager(object):
     def __init__(self, db_path="mx_measurement.db"):
@@ -13,7 +14,7 @@ class DatabaseManager(object):
 
     def init_db(self):
         """初始化數據庫表"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
 
             # Measure表 - 存储测量基本信息
@@ -46,6 +47,44 @@ class DatabaseManager(object):
                          FOREIGN KEY (measured_data_id) REFERENCES measured_data(id))''')
 
             conn.commit()
+            ConnectionManager.ensure_indexes(conn)
+
+    @staticmethod
+    def insert_measure(conn, measure, measured_data):
+        """以 executemany 寫入一筆 measure 及其 measured_data / measure_attributes
+
+        measure: (sample_name, position_name, group_name, operator,
+                  appx_filename, slide_id, sample_number)
+        measured_data: [(data_name, data_value, identity_path, attributes), ...]
+        尚未在交易中時以 BEGIN IMMEDIATE 開始交易, 由呼叫者 commit。回傳 measure_id。
+        """
+        c = conn.cursor()
+        if not conn.in_transaction:
+            c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            INSERT INTO measures
+            (sample_name, position_name, group_name, operator, appx_filename,
+             slide_id, sample_number)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, measure)
+        measure_id = c.lastrowid
+
+        c.executemany("""
+            INSERT INTO measured_data (measure_id, data_name, data_value, identity_path)
+            VALUES (?, ?, ?, ?)
+        """, [(measure_id, name, value, path) for name, value, path, _ in measured_data])
+
+        # executemany 不提供各列的 lastrowid, 依插入順序取回 id
+        c.execute("SELECT id FROM measured_data WHERE measure_id = ? ORDER BY id",
+                  (measure_id,))
+        data_ids = [row[0] for row in c.fetchall()]
+        c.executemany("""
+            INSERT INTO measure_attributes (measured_data_id, attribute_name, attribute_value)
+            VALUES (?, ?, ?)
+        """, [(data_id, name, str(value))
+              for data_id, (_, _, _, attributes) in zip(data_ids, measured_data)
+              for name, value in attributes.items()])
+        return measure_id
 
     def save_settings(self, sample_name, parameter_name, position_name):
         """保存設置"""
@@ -56,7 +95,7 @@ class DatabaseManager(object):
             "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
 
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
                       ("current_settings", json.dumps(settings)))
@@ -64,7 +103,7 @@ class DatabaseManager(object):
 
     def get_settings(self):
         """獲取當前設置"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("SELECT value FROM settings WHERE key=?", ("current_settings",))
             row = c.fetchone()
@@ -74,7 +113,7 @@ class DatabaseManager(object):
 
     def save_measurement(self, sample_name, parameter_name, position_name,
                          measurement_data, datx_path=None, report_path=None):
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("""
                 INSERT INTO measurements 
@@ -97,7 +136,7 @@ class DatabaseManager(object):
 
     def update_erp_upload_status(self, measurement_id, status):
         """更新ERP上傳狀態"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("""
                 UPDATE measurements 
@@ -108,7 +147,7 @@ class DatabaseManager(object):
 
     def get_unuploaded_measurements(self):
         """獲取未上傳到ERP的測量數據"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("""
                 SELECT * FROM measurements 
@@ -120,7 +159,7 @@ class DatabaseManager(object):
     def get_measurements(self, limit=100, sample_name=None,
                          parameter_name=None, position_name=None):
         """獲取測量記錄"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             query = "SELECT * FROM measurements WHERE 1=1"
             params = []
@@ -0,0 +1,183 @@
+# db_connection.py
+from __future__ import print_function
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+
+
+class ConnectionManager(object):
+    """共用的 SQLite 連線管理
+
+    每個執行緒對每個資料庫只開一次連線並重複使用 (sqlite3 連線不能跨執行緒)。
+    新連線會啟用 WAL 與調整後的 synchronous; 每個資料庫第一次開啟時補建
+    外鍵欄位的索引。
+
+    用法與 sqlite3.connect 相同:
+        with get_connection(db_path) as conn:
+            conn.execute(...)
+    with 區塊結束時 commit (例外時 rollback), 但不會關閉連線。
+    """
+
+    JOURNAL_MODE = 'WAL'
+    # WAL 下 NORMAL 不會損毀資料庫, 只有斷電時可能遺失最後幾筆 commit
+    SYNCHRONOUS = 'NORMAL'
+    BUSY_TIMEOUT = 5000         # 其他連線寫入中時等待的毫秒數
+
+    # (索引名稱, 表, 欄位); 表不存在時略過
+    INDEXES = [
+        ('idx_measured_data_measure_id', 'measured_data', 'measure_id'),
+        ('idx_measure_attributes_measured_data_id', 'measure_attributes', 'measured_data_id'),
+        # 歷史查詢的篩選欄位
+        ('idx_measures_created_at', 'measures', 'created_at'),
+        ('idx_measures_sample_name', 'measures', 'sample_name'),
+        ('idx_measures_slide_id', 'measures', 'slide_id'),
+    ]
+
+    _local = threading.local()
+    _lock = threading.Lock()
+    _prepared = set()
+
+    @staticmethod
+    def _key(db_path):
+        return os.path.abspath(db_path)
+
+    @classmethod
+    def get_connection(cls, db_path):
+        """取得目前執行緒對 db_path 的連線, 第一次呼叫時建立"""
+        key = cls._key(db_path)
+        connections = cls._local.__dict__.setdefault('connections', {})
+        conn = connections.get(key)
+        if conn is None:
+            conn = cls._open(db_path)
+            connections[key] = conn
+            cls._prepare(key, conn)
+        return conn
+
+    @classmethod
+    def _open(cls, db_path):
+        conn = sqlite3.connect(db_path, timeout=cls.BUSY_TIMEOUT / 1000.0)
+        conn.execute("PRAGMA busy_timeout = %d" % cls.BUSY_TIMEOUT)
+        try:
+            conn.execute("PRAGMA journal_mode = %s" % cls.JOURNAL_MODE)
+        except sqlite3.OperationalError as e:
+            # 其他程序持有舊模式的鎖時維持原模式, 下次開啟再切換
+            logging.warning("Cannot set journal_mode on %s: %s", db_path, str(e))
+        conn.execute("PRAGMA synchronous = %s" % cls.SYNCHRONOUS)
+        return conn
+
+    @classmethod
+    def _prepare(cls, key, conn):
+        """每個資料庫在本程序中只建立一次索引"""
+        with cls._lock:
+            if key in cls._prepared:
+                return
+            cls._prepared.add(key)
+        cls.ensure_indexes(conn)
+
+    @classmethod
+    def ensure_indexes(cls, conn):
+        """建立缺少的外鍵欄位索引"""
+        tables = set(row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        with conn:
+            for name, table, column in cls.INDEXES:
+                if table in tables:
+                    conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)"
+                                 % (name, table, column))
+
+    @classmethod
+    def close(cls, db_path=None):
+        """關閉目前執行緒的連線 (db_path 為 None 時關閉全部)"""
+        connections = cls._local.__dict__.get('connections', {})
+        keys = list(connections) if db_path is None else [cls._key(db_path)]
+        for key in keys:
+            conn = connections.pop(key, None)
+            if conn is not None:
+                conn.close()
+
+
+def get_connection(db_path):
+    return ConnectionManager.get_connection(db_path)
+
+
+class GroupCommitWriter(object):
+    """Group commit: 把同時送來的多個寫入合併成一個交易, 只 commit 一次
+
+    寫入函式 func(conn) 由專用執行緒依序執行; 每個寫入包在 SAVEPOINT 中,
+    單一寫入失敗只回滾自己, 不影響同一批的其他寫入。
+    寫入執行緒的連線使用 synchronous=FULL, 每次 commit 都 fsync, 合併的寫入
+    共用一次 fsync。佇列空時立即 commit, 不等待時間窗; 只有在上一次 commit
+    期間排入的寫入會被合併, 因此單一執行緒寫入不會增加延遲。
+    """
+
+    SYNCHRONOUS = 'FULL'
+
+    def __init__(self, db_path, max_batch=100):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def submit(self, func):
+        """排入一個寫入, 回傳 concurrent.futures.Future (結果為 func 的回傳值)"""
+        future = Future()
+        self._queue.put((func, future))
+        return future
+
+    def _run(self):
+        get_connection(self.db_path).execute("PRAGMA synchronous = %s" % self.SYNCHRONOUS)
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job]
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            self._commit(batch)
+        ConnectionManager.close(self.db_path)
+
+    def _commit(self, batch):
+        conn = get_connection(self.db_path)
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for func, future in batch:
+                conn.execute("SAVEPOINT group_commit_job")
+                try:
+                    results.append((future, func(conn), None))
+                    conn.execute("RELEASE group_commit_job")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO group_commit_job")
+                    conn.execute("RELEASE group_commit_job")
+                    results.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            logging.error("Group commit of %d writes failed: %s", len(batch), str(e))
+            if conn.in_transaction:
+                conn.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def stop(self, timeout=None):
+        """送出已排入的寫入後停止寫入執行緒"""
+        self._queue.put(None)
+        self._worker.join(timeout)
@@ -1,10 +1,11 @@
 # database_manager.py
 from __future__ import print_function
-import sqlite3
 import json
 from datetime import datetime
 import os
 
+from db_connection import get_connection
+
 
 class DatabaseManager(object):
     def __init__(self, db_path="mx_measurement.db"):
@@ -13,7 +14,7 @@ class DatabaseManager(object):
 
     def init_db(self):
         """初始化數據庫表"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             # 設置表
             c.execute('''CREATE TABLE IF NOT EXISTS settings
@@ -40,7 +41,7 @@ class DatabaseManager(object):
             "last_updated": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
 
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
                       ("current_settings", json.dumps(settings)))
@@ -48,7 +49,7 @@ class DatabaseManager(object):
 
     def get_settings(self):
         """獲取當前設置"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("SELECT value FROM settings WHERE key=?", ("current_settings",))
             row = c.fetchone()
@@ -59,7 +60,7 @@ class DatabaseManager(object):
     def save_measurement(self, sample_name, parameter_name, position_name,
                          measurement_data, datx_path=None, report_path=None):
         """保存測量數據"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("""
                 INSERT INTO measurements 
@@ -80,7 +81,7 @@ class DatabaseManager(object):
 
     def update_erp_upload_status(self, measurement_id, status):
         """更新ERP上傳狀態"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("""
                 UPDATE measurements 
@@ -91,7 +92,7 @@ class DatabaseManager(object):
 
     def get_unuploaded_measurements(self):
         """獲取未上傳到ERP的測量數據"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             c.execute("""
                 SELECT * FROM measurements 
@@ -103,7 +104,7 @@ class DatabaseManager(object):
     def get_measurements(self, limit=100, sample_name=None,
                          parameter_name=None, position_name=None):
         """獲取測量記錄"""
-        with sqlite3.connect(self.db_path) as conn:
+        with get_connection(self.db_path) as conn:
             c = conn.cursor()
             query = "SELECT * FROM measurements WHERE 1=1"
             params = []
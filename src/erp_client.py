@@ -0,0 +1,134 @@
+# erp_client.py
+from __future__ import print_function
+import gzip
+import select
+import socket
+import threading
+import time
+from http import client as http_client
+from urllib.parse import urlparse
+
+
+class _TimeoutMixin(object):
+    """連線時使用 connect_timeout, 連上後改用 read_timeout"""
+
+    read_timeout = None
+
+    def connect(self):
+        super(_TimeoutMixin, self).connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.settimeout(self.read_timeout)
+
+
+class _HTTPConnection(_TimeoutMixin, http_client.HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_TimeoutMixin, http_client.HTTPSConnection):
+    pass
+
+
+class ResponseLostError(OSError):
+    """請求已完整送出, 但沒有收到回應 (逾時或連線中斷); ERP 可能已處理該請求"""
+
+
+class ERPClient(object):
+    """保持連線的 ADInterface HTTP client
+
+    連線在請求之間保留重用, 多執行緒各自取用不同連線。重用前會檢查閒置過久
+    或已被伺服器關閉的連線並重新建立; 請求送出後不會自動重送, 避免 ERP
+    重複建立資料。
+    """
+
+    def __init__(self, url, connect_timeout=5, read_timeout=30,
+                 gzip_requests=False, max_idle_time=15, max_connections=2):
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path or '/'
+        if parsed.query:
+            self.path += '?' + parsed.query
+        self.connection_class = _HTTPSConnection if parsed.scheme == 'https' \
+            else _HTTPConnection
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.gzip_requests = gzip_requests
+        self.max_idle_time = max_idle_time
+        self.max_connections = max_connections
+        self._idle = []     # [(connection, last_used), ...]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _is_dropped(conn):
+        """閒置連線可讀代表伺服器已關閉 (EOF) 或狀態異常"""
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+            return bool(readable)
+        except (OSError, ValueError):
+            return True
+
+    def _acquire(self):
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if now - last_used <= self.max_idle_time and not self._is_dropped(conn):
+                return conn
+            conn.close()
+        conn = self.connection_class(self.host, self.port,
+                                     timeout=self.connect_timeout)
+        conn.read_timeout = self.read_timeout
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._idle) < self.max_connections:
+                self._idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def post(self, body, content_type='application/json'):
+        """送出 POST 並讀取完整回應, 回傳 (status, reason, body bytes)
+
+        送出前的網路錯誤會以 OSError / http.client.HTTPException 拋出;
+        送出後才逾時或斷線則拋出 ResponseLostError。
+        """
+        headers = {'Content-Type': content_type,
+                   'Accept-Encoding': 'gzip'}
+        if self.gzip_requests:
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+
+        conn = self._acquire()
+        try:
+            conn.request('POST', self.path, body, headers)
+        except Exception:
+            conn.close()
+            raise
+        try:
+            resp = conn.getresponse()
+            data = resp.read()
+        except (OSError, http_client.HTTPException) as e:
+            conn.close()
+            raise ResponseLostError(str(e) or e.__class__.__name__)
+        except Exception:
+            conn.close()
+            raise
+        if resp.getheader('Content-Encoding', '').lower() == 'gzip':
+            data = gzip.decompress(data)
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return resp.status, resp.reason, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
@@ -0,0 +1,463 @@
+# erp_outbox.py
+from __future__ import print_function
+import json
+import logging
+import threading
+import time
+import uuid
+
+from db_connection import get_connection
+from config import ERPConfig
+from erp_util import ERPAPIUtil, ERPError
+
+
+class ERPOutbox(object):
+    """SQLite 持久化的 ERP 上傳佇列
+
+    每個 composite request 先寫入 erp_outbox 表再送出, 由背景執行緒依序送出。
+    失敗依 ERPError.kind 處理:
+      transient: 指數退避重試, 佇列頭失敗時不會跳過, 保持上傳順序。
+      rejected: ERP 拒絕, 重送也不會成功, 直接標記為 failed, 不阻擋後續項目。
+      unknown: 請求已送出但結果不明。設定 ERPConfig.IDEMPOTENCY_COLUMN 時 key
+        會隨 Measure 送出, ERP 可去除重複, 照常重試; 否則標記為 unconfirmed,
+        不自動重送 (避免 ERP 重複建立資料), 確認後以 requeue() 重新排入。
+    failed / unconfirmed 項目可用命令列列出並重新排入:
+        python erp_outbox.py list [db_path]
+        python erp_outbox.py requeue <key> [<key> ...] [--db db_path]
+    """
+
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    UNCONFIRMED = 'unconfirmed'
+
+    BASE_RETRY_DELAY = 2        # 第一次重試等待秒數
+    MAX_RETRY_DELAY = 300       # 退避上限(秒)
+    MAX_ATTEMPTS = 20           # 超過後標記為 failed, 不再阻擋後續項目
+    STALE_CLAIM_TIME = 600      # 'sending' 狀態超過此秒數視為中斷, 重新排入
+    BATCH_SIZE = 20             # 積壓時一次最多合併送出的筆數
+    CIRCUIT_WAIT = 1            # 斷路中重新檢查的間隔(秒)
+
+    def __init__(self, db_path="measurements.db", send_func=None,
+                 on_result=None, batch_size=None, circuit=None):
+        self.db_path = db_path
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.send_func = send_func or ERPAPIUtil.send_to_erp
+        # 預設的 send_func 共用 ERPAPIUtil 的斷路器
+        if circuit is None and send_func is None:
+            circuit = ERPAPIUtil.circuit
+        self.circuit = circuit
+        self.on_result = on_result
+        self.last_error = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._worker = None
+        self.initialize_database()
+
+    def initialize_database(self):
+        """建立 outbox 表"""
+        with get_connection(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""
+                CREATE TABLE IF NOT EXISTS erp_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    claimed_at REAL,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    sent_at TIMESTAMP
+                )
+            """)
+            c.execute("""
+                CREATE INDEX IF NOT EXISTS idx_erp_outbox_status
+                ON erp_outbox (status, id)
+            """)
+            conn.commit()
+
+    def enqueue(self, request_data, idempotency_key=None):
+        """寫入一筆 composite request, 回傳 idempotency key
+
+        相同 key 只會寫入一次, 重複呼叫不會造成重複上傳。
+        """
+        if request_data is None:
+            raise ValueError("request_data is None")
+        key = idempotency_key or uuid.uuid4().hex
+        if ERPConfig.IDEMPOTENCY_COLUMN:
+            # 複製後再加上 key, 不修改呼叫者的 request_data
+            request_data = ERPAPIUtil.add_idempotency_key(
+                json.loads(json.dumps(request_data)), key)
+        payload = json.dumps(request_data, separators=(',', ':'))
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                INSERT OR IGNORE INTO erp_outbox (idempotency_key, payload)
+                VALUES (?, ?)
+            """, (key, payload))
+            conn.commit()
+        self._wakeup.set()
+        return key
+
+    def pending_count(self):
+        """尚未送出的筆數"""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute("""
+                SELECT COUNT(*) FROM erp_outbox WHERE status IN (?, ?)
+            """, (self.PENDING, self.SENDING)).fetchone()
+            return row[0]
+
+    def is_sent(self, idempotency_key):
+        """該筆是否已成功上傳"""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute("""
+                SELECT status FROM erp_outbox WHERE idempotency_key = ?
+            """, (idempotency_key,)).fetchone()
+            return row is not None and row[0] == self.SENT
+
+    def _claim_next(self, limit=1):
+        """取出佇列頭連續到期的待送項目 (最多 limit 筆) 並標記為 sending
+
+        只有佇列頭到了重試時間才會取出, 避免亂序。回傳
+        ([(id, key, payload, attempts), ...], next_attempt_at);
+        沒有可送項目時列表為空, next_attempt_at 為下次可嘗試的時間或 None。
+        """
+        now = time.time()
+        with get_connection(self.db_path) as conn:
+            c = conn.cursor()
+            # 其他程序中斷時留下的 sending 項目重新排入
+            c.execute("""
+                UPDATE erp_outbox SET status = ?, claimed_at = NULL
+                WHERE status = ? AND claimed_at < ?
+            """, (self.PENDING, self.SENDING, now - self.STALE_CLAIM_TIME))
+            c.execute("""
+                SELECT id, idempotency_key, payload, attempts, next_attempt_at, status
+                FROM erp_outbox
+                WHERE status IN (?, ?)
+                ORDER BY id LIMIT ?
+            """, (self.PENDING, self.SENDING, limit))
+            rows = c.fetchall()
+            if not rows:
+                conn.commit()
+                return [], None
+            if rows[0][4] > now:
+                conn.commit()
+                return [], rows[0][4]
+
+            items = []
+            for item_id, key, payload, attempts, next_attempt_at, status in rows:
+                if status != self.PENDING or next_attempt_at > now:
+                    break
+                c.execute("""
+                    UPDATE erp_outbox SET status = ?, claimed_at = ?
+                    WHERE id = ? AND status = ?
+                """, (self.SENDING, now, item_id, self.PENDING))
+                if c.rowcount != 1:
+                    break
+                items.append((item_id, key, payload, attempts))
+            conn.commit()
+            if not items:
+                # 另一個程序正在送佇列頭
+                return [], now + self.BASE_RETRY_DELAY
+            return items, None
+
+    def _claim_key(self, idempotency_key):
+        """只在指定項目是到期的佇列頭時取出它, 回傳 [(id, key, payload, attempts)] 或 []"""
+        now = time.time()
+        with get_connection(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT id, idempotency_key, payload, attempts, next_attempt_at, status
+                FROM erp_outbox
+                WHERE status IN (?, ?)
+                ORDER BY id LIMIT 1
+            """, (self.PENDING, self.SENDING))
+            row = c.fetchone()
+            if row is None or row[1] != idempotency_key or \
+                    row[5] != self.PENDING or row[4] > now:
+                return []
+            c.execute("""
+                UPDATE erp_outbox SET status = ?, claimed_at = ?
+                WHERE id = ? AND status = ?
+            """, (self.SENDING, now, row[0], self.PENDING))
+            if c.rowcount != 1:
+                return []
+            return [row[:4]]
+
+    def _release(self, item_ids):
+        """把未送出的已取出項目放回佇列, 不計入重試次數"""
+        if not item_ids:
+            return
+        with get_connection(self.db_path) as conn:
+            conn.executemany("""
+                UPDATE erp_outbox SET status = ?, claimed_at = NULL
+                WHERE id = ? AND status = ?
+            """, [(self.PENDING, item_id, self.SENDING) for item_id in item_ids])
+            conn.commit()
+
+    def _mark_sent(self, item_id):
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                UPDATE erp_outbox
+                SET status = ?, attempts = attempts + 1, last_error = NULL,
+                    sent_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, (self.SENT, item_id))
+            conn.commit()
+
+    def _mark_failed(self, item_id, attempts, error, status=None):
+        """記錄失敗; status 為 None 時依重試次數退避, 否則直接設為該狀態"""
+        attempts += 1
+        if status is None and attempts >= self.MAX_ATTEMPTS:
+            status = self.FAILED
+        if status is not None:
+            next_attempt_at = 0
+        else:
+            status = self.PENDING
+            delay = min(self.BASE_RETRY_DELAY * (2 ** (attempts - 1)),
+                        self.MAX_RETRY_DELAY)
+            next_attempt_at = time.time() + delay
+        with get_connection(self.db_path) as conn:
+            conn.execute("""
+                UPDATE erp_outbox
+                SET status = ?, attempts = ?, next_attempt_at = ?,
+                    claimed_at = NULL, last_error = ?
+                WHERE id = ?
+            """, (status, attempts, next_attempt_at, str(error), item_id))
+            conn.commit()
+        return status
+
+    def list_items(self, statuses=(FAILED, UNCONFIRMED)):
+        """列出指定狀態的項目 (預設為需要人工處理的 failed / unconfirmed)
+
+        回傳 [{'key', 'status', 'attempts', 'last_error', 'created_at'}, ...], 依排入順序。
+        """
+        with get_connection(self.db_path) as conn:
+            rows = conn.execute("""
+                SELECT idempotency_key, status, attempts, last_error, created_at
+                FROM erp_outbox WHERE status IN ({0})
+                ORDER BY id
+            """.format(', '.join('?' * len(statuses))), tuple(statuses)).fetchall()
+        return [dict(zip(('key', 'status', 'attempts', 'last_error', 'created_at'), row))
+                for row in rows]
+
+    def requeue(self, idempotency_key):
+        """把 failed / unconfirmed 項目重新排入佇列 (確認 ERP 沒有該筆資料後使用)"""
+        with get_connection(self.db_path) as conn:
+            c = conn.execute("""
+                UPDATE erp_outbox
+                SET status = ?, next_attempt_at = 0, claimed_at = NULL
+                WHERE idempotency_key = ? AND status IN (?, ?)
+            """, (self.PENDING, idempotency_key, self.FAILED, self.UNCONFIRMED))
+            conn.commit()
+        if c.rowcount:
+            self._wakeup.set()
+        return c.rowcount == 1
+
+    @staticmethod
+    def _error_kind(error):
+        # 自訂 send_func 回傳一般字串時視為可重試
+        return getattr(error, 'kind', ERPError.TRANSIENT)
+
+    @staticmethod
+    def _idempotent():
+        return bool(ERPConfig.IDEMPOTENCY_COLUMN)
+
+    def _send(self, payload):
+        try:
+            return self.send_func(payload)
+        except Exception as e:
+            return False, str(e)
+
+    def _merge(self, items):
+        """把多筆 composite request 合併成一筆, 回傳 (request_data, 合併的項目)
+
+        依 ERPConfig 的操作數與大小上限只合併佇列前段; 無法解析的內容不合併。
+        """
+        try:
+            groups = [json.loads(payload)["CompositeRequest"]["operations"]["operation"]
+                      for _, _, payload, _ in items]
+        except (ValueError, KeyError, TypeError):
+            return json.loads(items[0][2]), items[:1]
+        request_data, indexes = ERPAPIUtil.pack_operation_groups(groups)[0]
+        return request_data, items[:len(indexes)]
+
+    def process_next(self):
+        """送出佇列頭; 有積壓時合併多筆成一個 composite request
+
+        回傳佇列頭的 (sent, error, next_attempt_at): sent 為 None 表示沒有可送的項目。
+        """
+        # 斷路中不取出項目, 也不消耗重試次數
+        if self.circuit is not None and not self.circuit.is_available():
+            return None, None, time.time() + self.CIRCUIT_WAIT
+
+        items, next_attempt_at = self._claim_next(self.batch_size)
+        if not items:
+            return None, None, next_attempt_at
+        return self._process(items)
+
+    def send_item(self, idempotency_key):
+        """只送出指定項目一次, 且只在它是到期的佇列頭時送出
+
+        回傳 (sent, error); sent 為 None 表示沒有送出 (前面還有項目、尚未到期
+        或斷路中), 留給背景執行緒依序處理。
+        """
+        if self.circuit is not None and not self.circuit.is_available():
+            return None, None
+        items = self._claim_key(idempotency_key)
+        if not items:
+            return None, None
+        sent, error, _ = self._process(items)
+        return sent, error
+
+    def _process(self, items):
+        """送出已取出的項目並記錄結果, 回傳佇列頭的 (sent, error, next_attempt_at)"""
+        if len(items) == 1:
+            success, error = self._send(json.loads(items[0][2]))
+            results = [(items[0], success, error)]
+        else:
+            request_data, batch = self._merge(items)
+            self._release([item[0] for item in items[len(batch):]])
+            success, error = self._send(request_data)
+            kind = self._error_kind(error)
+            if success or len(batch) == 1:
+                results = [(item, success, error) for item in batch]
+            elif kind == ERPError.REJECTED:
+                # ERP 整批回滾, 只單獨重送佇列頭以找出被拒絕的項目
+                logging.warning("ERP outbox batch of %d rejected, resending head alone: %s",
+                                len(batch), error)
+                self._release([item[0] for item in batch[1:]])
+                success, error = self._send(json.loads(batch[0][2]))
+                results = [(batch[0], success, error)]
+            elif kind == ERPError.UNKNOWN and not self._idempotent():
+                # 整批可能已經寫入 ERP, 不拆開重送
+                results = [(item, success, error) for item in batch]
+            else:
+                # 其餘項目放回佇列, 佇列頭依退避時間重試
+                self._release([item[0] for item in batch[1:]])
+                results = [(batch[0], success, error)]
+
+        if not results[0][1] and results[0][2] == ERPAPIUtil.CIRCUIT_OPEN_ERROR:
+            self._release([item[0] for item, _, _ in results])
+            return None, None, time.time() + self.CIRCUIT_WAIT
+
+        for (item_id, key, _, attempts), success, error in results:
+            self._record_result(item_id, key, attempts, success, error)
+        _, head_success, head_error = results[0]
+        return head_success, head_error, None
+
+    def _is_duplicate(self, attempts, error):
+        """重送時 ERP 以 unique 約束拒絕, 表示先前的請求已經寫入"""
+        if not self._idempotent() or attempts == 0:
+            return False
+        message = str(error).lower()
+        return any(marker in message for marker in ERPConfig.DUPLICATE_ERROR_MARKERS)
+
+    def _record_result(self, item_id, key, attempts, success, error):
+        kind = self._error_kind(error)
+        if not success and kind == ERPError.REJECTED and self._is_duplicate(attempts, error):
+            logging.info("ERP outbox item %s already exists in ERP: %s", key, error)
+            success, error = True, None
+
+        if success:
+            self._mark_sent(item_id)
+            self.last_error = None
+            logging.info("ERP outbox item %s uploaded", key)
+        elif kind == ERPError.REJECTED:
+            self._mark_failed(item_id, attempts, error, self.FAILED)
+            self.last_error = error
+            logging.error("ERP outbox item %s rejected by ERP, not retrying: %s", key, error)
+        elif kind == ERPError.UNKNOWN and not self._idempotent():
+            self._mark_failed(item_id, attempts, error, self.UNCONFIRMED)
+            self.last_error = error
+            logging.error("ERP outbox item %s result unknown, not resending to avoid "
+                          "duplicates; check ERP and requeue if missing: %s", key, error)
+        else:
+            status = self._mark_failed(item_id, attempts, error)
+            self.last_error = error
+            if status == self.FAILED:
+                logging.error("ERP outbox item %s failed after %d attempts: %s",
+                              key, attempts + 1, error)
+            else:
+                logging.warning("ERP outbox item %s upload failed, will retry: %s",
+                                key, error)
+
+        if self.on_result is not None:
+            try:
+                self.on_result(key, success, error)
+            except Exception as e:
+                logging.error("Error in outbox result callback: %s", str(e))
+
+    def drain(self, timeout=None):
+        """在目前執行緒送出所有到期項目, 直到佇列清空、遇到失敗或逾時
+
+        回傳最後一筆的 (success, error); 沒有項目時回傳 (True, None)。
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        result = (True, None)
+        while deadline is None or time.time() < deadline:
+            sent, error, _ = self.process_next()
+            if sent is None:
+                break
+            result = (sent, error)
+            if not sent:
+                break
+        return result
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                sent, _, next_attempt_at = self.process_next()
+                if sent is not None:
+                    # 失敗時下一輪會取得佇列頭的重試時間
+                    continue
+                if next_attempt_at is not None:
+                    wait = max(0.0, next_attempt_at - time.time())
+                else:
+                    wait = self.MAX_RETRY_DELAY
+                self._wakeup.wait(wait)
+                self._wakeup.clear()
+            except Exception as e:
+                logging.error("Error in ERP outbox worker: %s", str(e))
+                self._stop.wait(self.BASE_RETRY_DELAY)
+
+    def start(self):
+        """啟動背景上傳執行緒"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+        logging.info("ERP outbox worker started")
+
+    def stop(self, timeout=None):
+        """停止背景上傳執行緒, 未送出的項目保留在資料庫中"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+
+if __name__ == '__main__':
+    import sys
+    args = sys.argv[1:]
+    db_path = "measurements.db"
+    if '--db' in args:
+        index = args.index('--db')
+        db_path = args[index + 1]
+        del args[index:index + 2]
+    if args[:1] == ['list']:
+        outbox = ERPOutbox(args[1] if len(args) > 1 else db_path)
+        for item in outbox.list_items():
+            print("{key}\t{status}\t{attempts}\t{created_at}\t{last_error}".format(**item))
+    elif args[:1] == ['requeue'] and len(args) > 1:
+        outbox = ERPOutbox(db_path)
+        for key in args[1:]:
+            print("{0}: {1}".format(key, "requeued" if outbox.requeue(key) else "not found"))
+    else:
+        print("Usage: python erp_outbox.py list [db_path]\n"
+              "       python erp_outbox.py requeue <key> [<key> ...] [--db db_path]")
+        sys.exit(1)
@@ -1,172 +1,437 @@
 # erp_util.py
 from __future__ import print_function
 import json
-import sys
-if sys.version_info[0] >= 3:
-    from urllib.request import Request, urlopen
-    from urllib.error import HTTPError, URLError
-else:
-    from urllib2 import Request, urlopen, HTTPError, URLError
+import socket
+import threading
+import time
+from http import client as http_client
+from urllib.parse import urlparse
+from circuit_breaker import CircuitBreaker
 from config import ERPConfig
+from db_connection import get_connection
+from erp_client import ERPClient, ResponseLostError
 from zygo import mx
-import sqlite3
 import logging
 
+def _probe_erp():
+    """Cheap connectivity probe: open a TCP connection to the ERP host"""
+    url = urlparse(ERPConfig.API_URL)
+    port = url.port or (443 if url.scheme == 'https' else 80)
+    try:
+        socket.create_connection((url.hostname, port),
+                                 timeout=ERPConfig.CIRCUIT_PROBE_TIMEOUT).close()
+        return True
+    except (OSError, socket.error):
+        return False
+
+
+class ERPError(str):
+    """send_to_erp 回傳的錯誤訊息, kind 標示是否可以重送"""
+
+    TRANSIENT = 'transient'     # 請求沒有被 ERP 處理 (連線失敗、5xx、斷路中), 可以重送
+    REJECTED = 'rejected'       # ERP 拒絕並回滾 (4xx、IsError), 重送也不會成功
+    UNKNOWN = 'unknown'         # 請求已送出但結果不明, ERP 可能已建立資料
+
+    def __new__(cls, message, kind):
+        error = str.__new__(cls, message)
+        error.kind = kind
+        return error
+
+
 class ERPAPIUtil:
+    CIRCUIT_OPEN_ERROR = "ERP connection unavailable (circuit open)"
+
+    # 所有 ERP 請求共用, 只在斷路時於背景探測連線
+    circuit = CircuitBreaker(
+        failure_threshold=ERPConfig.CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=ERPConfig.CIRCUIT_RESET_TIMEOUT,
+        probe=_probe_erp,
+        probe_interval=ERPConfig.CIRCUIT_PROBE_INTERVAL,
+        name="ERP circuit")
+
+    _client = None
+    _client_lock = threading.Lock()
+
     @staticmethod
     def get_attribute_columns():
         try:
-            conn = sqlite3.connect('measurements.db')
-            cursor = conn.cursor()
+            cursor = get_connection('measurements.db').cursor()
             cursor.execute("""
                 SELECT DISTINCT param_name 
                 FROM measurement_params
                 ORDER BY param_name
             """)
-            columns = [row[0] for row in cursor.fetchall()]
-            conn.close()
-            return columns
+            return [row[0] for row in cursor.fetchall()]
         except Exception as e:
             logging.error("Error getting attribute columns: %s", str(e))
             return []
 
+    @staticmethod
+    def get_client():
+        """Shared keep-alive ERP client, created on first use"""
+        with ERPAPIUtil._client_lock:
+            if ERPAPIUtil._client is None or ERPAPIUtil._client.url != ERPConfig.API_URL:
+                ERPAPIUtil._client = ERPClient(
+                    ERPConfig.API_URL,
+                    connect_timeout=ERPConfig.CONNECT_TIMEOUT,
+                    read_timeout=ERPConfig.READ_TIMEOUT,
+                    gzip_requests=ERPConfig.GZIP_REQUESTS)
+            return ERPAPIUtil._client
+
+    @staticmethod
+    def _truncate(text):
+        limit = ERPConfig.LOG_BODY_LIMIT
+        if len(text) <= limit:
+            return text
+        return "{0}... ({1} bytes)".format(text[:limit], len(text))
+
     @staticmethod
     def send_to_erp(data):
+        """送出 composite request, 回傳 (success, error)
+
+        error 為 ERPError, 其 kind 表示失敗是否可以重送。
+        """
         try:
-            data_string = json.dumps(data, indent=2).encode('utf-8')
-            logging.info("Sending request to ERP: %s", data_string.decode('utf-8'))
+            data_string = json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+            # 依先前實際請求的結果判斷連線, 斷路中直接返回
+            if not ERPAPIUtil.circuit.allow_request():
+                return False, ERPError(ERPAPIUtil.CIRCUIT_OPEN_ERROR, ERPError.TRANSIENT)
 
-            req = Request(ERPConfig.API_URL)
-            req.add_header('Content-Type', 'application/json')
+            try:
+                operations = len(data["CompositeRequest"]["operations"]["operation"])
+            except (KeyError, TypeError):
+                operations = 0
+            logging.debug("Sending request to ERP: %s",
+                          ERPAPIUtil._truncate(data_string.decode('utf-8')))
 
+            start = time.time()
             try:
-                response = urlopen(req, data_string)
-                response_body = response.read()
-                if sys.version_info[0] >= 3:
-                    response_body = response_body.decode('utf-8')
-                logging.info("ERP Response: %s", response_body)
-
-                # Check for error in XML response
-                if 'IsError="true"' in response_body:
-                    error_start = response_body.find("<_0:Error>") + 10
-                    error_end = response_body.find("</_0:Error>")
-                    if error_start > 9 and error_end > 0:
-                        error_message = response_body[error_start:error_end]
-                        return False, error_message
-
-                # Check for success (presence of Record IDs without IsRolledBack="true")
-                if 'RecordID=' in response_body and 'IsRolledBack="true"' not in response_body:
-                    return True, None
-
-                return False, "Unexpected response format"
-
-            except HTTPError as e:
-                error_body = e.read()
-                if sys.version_info[0] >= 3:
-                    error_body = error_body.decode('utf-8')
-                logging.error("HTTP Error: %s - %s", e.code, error_body)
-                return False, "HTTP {0}: {1}".format(e.code, error_body)
-            except URLError as e:
-                logging.error("URL Error: %s", str(e))
-                return False, str(e)
+                status, _, response_body = ERPAPIUtil.get_client().post(data_string)
+            except ResponseLostError as e:
+                logging.error("ERP response lost after request was sent: %s", str(e))
+                ERPAPIUtil.circuit.record_failure()
+                return False, ERPError(str(e), ERPError.UNKNOWN)
+            except (OSError, http_client.HTTPException) as e:
+                logging.error("ERP connection error: %s", str(e))
+                ERPAPIUtil.circuit.record_failure()
+                return False, ERPError(str(e) or e.__class__.__name__, ERPError.TRANSIENT)
+            except Exception:
+                ERPAPIUtil.circuit.record_failure()
+                raise
+            elapsed = time.time() - start
+            response_body = response_body.decode('utf-8', 'replace')
+
+            if status >= 400:
+                logging.error("HTTP Error: %s - %s", status,
+                              ERPAPIUtil._truncate(response_body))
+                if status >= 500:
+                    ERPAPIUtil.circuit.record_failure()
+                else:
+                    ERPAPIUtil.circuit.record_success()
+                if status == 504:
+                    # gateway 逾時時 ERP 可能仍完成了處理
+                    kind = ERPError.UNKNOWN
+                elif status >= 500 or status in (408, 429):
+                    kind = ERPError.TRANSIENT
+                else:
+                    kind = ERPError.REJECTED
+                return False, ERPError("HTTP {0}: {1}".format(status, response_body), kind)
+
+            ERPAPIUtil.circuit.record_success()
+            logging.info("ERP request: %d operations, %d bytes, HTTP %s in %.0f ms",
+                         operations, len(data_string), status, elapsed * 1000)
+            logging.debug("ERP Response: %s", ERPAPIUtil._truncate(response_body))
+
+            # Check for error in XML response
+            if 'IsError="true"' in response_body:
+                error_start = response_body.find("<_0:Error>") + 10
+                error_end = response_body.find("</_0:Error>")
+                if error_start > 9 and error_end > 0:
+                    error_message = response_body[error_start:error_end]
+                    return False, ERPError(error_message, ERPError.REJECTED)
+
+            # Check for success (presence of Record IDs without IsRolledBack="true")
+            if 'RecordID=' in response_body and 'IsRolledBack="true"' not in response_body:
+                return True, None
+            if 'IsRolledBack="true"' in response_body:
+                return False, ERPError("Request rolled back by ERP", ERPError.REJECTED)
+
+            return False, ERPError("Unexpected response format", ERPError.UNKNOWN)
 
         except Exception as e:
+            # 無法確定請求是否已被 ERP 處理, 不能當成被拒絕而放棄
             logging.error("Error sending to ERP: %s", str(e))
-            return False, str(e)
+            return False, ERPError(str(e), ERPError.UNKNOWN)
 
     @staticmethod
-    def create_measure_request(sample_name, position_name, group_name, operator,
-                      appx_filename, slide_id, sample_number, measurement_data_list):
-        """Create measurement data request - all operations in one request"""
+    def add_idempotency_key(request_data, key, column=None):
+        """把 idempotency key 寫入 request 中每筆 Measure 的 column 欄位
+
+        一個 request 有多筆 Measure 時依序加上 -1, -2 ... 後綴。column 未設定
+        (ERPConfig.IDEMPOTENCY_COLUMN 為 None) 時不修改 request。
+        """
+        column = column or ERPConfig.IDEMPOTENCY_COLUMN
+        if not column:
+            return request_data
+        measures = [op for op in request_data["CompositeRequest"]["operations"]["operation"]
+                    if op.get("ModelCRUD", {}).get("TableName") == "Measure"]
+        for index, operation in enumerate(measures):
+            value = key if len(measures) == 1 else "{0}-{1}".format(key, index + 1)
+            fields = operation["ModelCRUD"]["DataRow"]["field"]
+            fields[:] = [f for f in fields if f.get("@column") != column]
+            fields.append({"@column": column, "val": value})
+        return request_data
+
+    @staticmethod
+    def _get_appx_filename():
         try:
-            # 获取 measure 基本信息
-            measure_data = measurement_data_list[0] if measurement_data_list else {}
-            try:
-                appx_filename = mx.get_application_path() or "Unknown.appx"
-            except:
-                appx_filename = "Unknown.appx"
-
-            request_data = {
-                "CompositeRequest": {
-                    "ADLoginRequest": ERPConfig.LOGIN_INFO,
-                    "serviceType": "setMeasureDataSet",
-                    "operations": {
-                        "operation": []
-                    }
+            return mx.get_application_path() or "Unknown.appx"
+        except:
+            return "Unknown.appx"
+
+    @staticmethod
+    def create_composite_request(operations):
+        """Wrap a list of operations in a setMeasureDataSet CompositeRequest"""
+        return {
+            "CompositeRequest": {
+                "ADLoginRequest": ERPConfig.LOGIN_INFO,
+                "serviceType": "setMeasureDataSet",
+                "operations": {
+                    "operation": operations
                 }
             }
+        }
 
-            # 1. 首先创建 Measure 记录
-            measure_operation = {
-                "TargetPort": "createData",
-                "ModelCRUD": {
-                    "serviceType": "setMeasure",
-                    "TableName": "Measure",
-                    "RecordID": 0,
-                    "Action": "Create",
-                    "DataRow": {
-                        "field": [
-                            {"@column": "APPXFileName", "val": appx_filename},
-                            {"@column": "GroupName", "val": group_name},
-                            {"@column": "SampleName", "val": sample_name},
-                            {"@column": "PositionName", "val": position_name},
-                            {"@column": "operator", "val": operator},
-                            {"@column": "SlideID", "val": slide_id}  # 使用組合後的ID
-                        ]
-                    }
+    @staticmethod
+    def create_measure_operations(sample_name, position_name, group_name, operator,
+                                  appx_filename, slide_id, sample_number, measurement_data_list,
+                                  compact=None):
+        """Create the operations for one Measure record and its data
+
+        The Measure operation comes first, followed by each MeasuredData and
+        its attributes, so the @Measure.Measure_id and
+        @MeasuredData.MeasuredData_ID references resolve to this group even
+        when several groups are packed into one composite request.
+
+        In compact mode (ERPConfig.COMPACT_PAYLOAD) attributes with the same
+        value on every MeasuredData row are created once, linked to the
+        Measure, instead of once per MeasuredData row.
+        """
+        if compact is None:
+            compact = ERPConfig.COMPACT_PAYLOAD
+        shared_attributes = ERPAPIUtil._shared_attributes(measurement_data_list) \
+            if compact else {}
+        operations = []
+
+        # 1. 首先创建 Measure 记录
+        measure_operation = {
+            "TargetPort": "createData",
+            "ModelCRUD": {
+                "serviceType": "setMeasure",
+                "TableName": "Measure",
+                "RecordID": 0,
+                "Action": "Create",
+                "DataRow": {
+                    "field": [
+                        {"@column": "APPXFileName", "val": appx_filename},
+                        {"@column": "GroupName", "val": group_name},
+                        {"@column": "SampleName", "val": sample_name},
+                        {"@column": "PositionName", "val": position_name},
+                        {"@column": "operator", "val": operator},
+                        {"@column": "SlideID", "val": slide_id}  # 使用組合後的ID
+                    ]
                 }
             }
-            request_data["CompositeRequest"]["operations"]["operation"].append(measure_operation)
-
-            # 2. 添加所有的 MeasuredData 记录
-            for data in measurement_data_list:
-                if 'field_name' in data and 'value' in data:
-                    # 添加测量数据
-                    measured_data_operation = {
-                        "TargetPort": "createData",
-                        "ModelCRUD": {
-                            "serviceType": "setMeasureData",
-                            "TableName": "MeasuredData",
-                            "RecordID": 0,
-                            "Action": "Create",
-                            "DataRow": {
-                                "field": [
-                                    {"@column": "DataName", "val": data['field_name']},
-                                    {"@column": "DataValue", "val": "{:.6f}".format(data['value'])},
-                                    {"@column": "Measure_ID", "val": "@Measure.Measure_id"},
-                                    {"@column": "Name", "val": data['field_name']}
-                                ]
-                            }
+        }
+        operations.append(measure_operation)
+
+        # 2. 添加所有的 MeasuredData 记录
+        for data in measurement_data_list:
+            if 'field_name' in data and 'value' in data:
+                # 添加测量数据
+                measured_data_operation = {
+                    "TargetPort": "createData",
+                    "ModelCRUD": {
+                        "serviceType": "setMeasureData",
+                        "TableName": "MeasuredData",
+                        "RecordID": 0,
+                        "Action": "Create",
+                        "DataRow": {
+                            "field": [
+                                {"@column": "DataName", "val": data['field_name']},
+                                {"@column": "DataValue", "val": "{:.6f}".format(data['value'])},
+                                {"@column": "Measure_ID", "val": "@Measure.Measure_id"},
+                                {"@column": "Name", "val": data['field_name']}
+                            ]
                         }
                     }
-                    request_data["CompositeRequest"]["operations"]["operation"].append(measured_data_operation)
-
-                    # 3. 对每个 MeasuredData 添加其 Attributes
-                    for attr_name, attr_value in data.get('attributes', {}).items():
-                        attribute_operation = {
-                            "TargetPort": "createData",
-                            "ModelCRUD": {
-                                "serviceType": "setMeasureAttribute",
-                                "TableName": "MeasureAttribute",
-                                "RecordID": 0,
-                                "Action": "Create",
-                                "DataRow": {
-                                    "field": [
-                                        {"@column": "AttributeName", "val": attr_name},
-                                        {"@column": "AttributeValue", "val": str(attr_value)},
-                                        {"@column": "MeasuredData_ID", "val": "@MeasuredData.MeasuredData_ID"}
-                                    ]
-                                }
-                            }
-                        }
-                        request_data["CompositeRequest"]["operations"]["operation"].append(attribute_operation)
+                }
+                operations.append(measured_data_operation)
 
-            return request_data
+                # 3. 对每个 MeasuredData 添加其 Attributes
+                for attr_name, attr_value in data.get('attributes', {}).items():
+                    if attr_name in shared_attributes:
+                        continue
+                    operations.append(ERPAPIUtil._attribute_operation(
+                        attr_name, attr_value,
+                        "MeasuredData_ID", "@MeasuredData.MeasuredData_ID"))
+
+        # 4. 共用的 Attributes 只建立一次, 掛在 Measure 上
+        for attr_name, attr_value in shared_attributes.items():
+            operations.append(ERPAPIUtil._attribute_operation(
+                attr_name, attr_value, "Measure_ID", "@Measure.Measure_id"))
+
+        return operations
+
+    @staticmethod
+    def _attribute_operation(attr_name, attr_value, parent_column, parent_ref):
+        return {
+            "TargetPort": "createData",
+            "ModelCRUD": {
+                "serviceType": "setMeasureAttribute",
+                "TableName": "MeasureAttribute",
+                "RecordID": 0,
+                "Action": "Create",
+                "DataRow": {
+                    "field": [
+                        {"@column": "AttributeName", "val": attr_name},
+                        {"@column": "AttributeValue", "val": str(attr_value)},
+                        {"@column": parent_column, "val": parent_ref}
+                    ]
+                }
+            }
+        }
+
+    @staticmethod
+    def _shared_attributes(measurement_data_list):
+        """Attributes present with the same value on every MeasuredData row"""
+        rows = [data.get('attributes', {}) for data in measurement_data_list
+                if 'field_name' in data and 'value' in data]
+        if not rows:
+            return {}
+        shared = {}
+        for attr_name, attr_value in rows[0].items():
+            value = str(attr_value)
+            if all(attr_name in attrs and str(attrs[attr_name]) == value
+                   for attrs in rows[1:]):
+                shared[attr_name] = attr_value
+        return shared
+
+    @staticmethod
+    def create_measure_request(sample_name, position_name, group_name, operator,
+                      appx_filename, slide_id, sample_number, measurement_data_list):
+        """Create measurement data request - all operations in one request"""
+        try:
+            # 获取 measure 基本信息
+            appx_filename = ERPAPIUtil._get_appx_filename()
+            operations = ERPAPIUtil.create_measure_operations(
+                sample_name, position_name, group_name, operator,
+                appx_filename, slide_id, sample_number, measurement_data_list
+            )
+            return ERPAPIUtil.create_composite_request(operations)
 
         except Exception as e:
             logging.error("Error creating measure request: %s", str(e))
             return None
 
+    @staticmethod
+    def pack_operation_groups(operation_groups, max_operations=None, max_bytes=None):
+        """Pack operation groups into as few composite requests as the limits allow
+
+        Groups are kept whole and in order. A group larger than the limits on
+        its own is sent in a request by itself.
+
+        Returns a list of (request_data, group_indexes) tuples.
+        """
+        if max_operations is None:
+            max_operations = ERPConfig.BATCH_MAX_OPERATIONS
+        if max_bytes is None:
+            max_bytes = ERPConfig.BATCH_MAX_BYTES
+
+        batches = []
+        current, indexes = [], []
+        current_bytes = 0
+        for index, operations in enumerate(operation_groups):
+            group_bytes = len(json.dumps(operations, separators=(',', ':')))
+            if current and (len(current) + len(operations) > max_operations or
+                            current_bytes + group_bytes > max_bytes):
+                batches.append((ERPAPIUtil.create_composite_request(current), indexes))
+                current, indexes = [], []
+                current_bytes = 0
+            current = current + operations
+            indexes.append(index)
+            current_bytes += group_bytes
+        if current:
+            batches.append((ERPAPIUtil.create_composite_request(current), indexes))
+        return batches
+
+    @staticmethod
+    def create_batch_requests(measurements, max_operations=None, max_bytes=None):
+        """Create composite requests holding several Measure records each
+
+        Each item of measurements is a dict with the keyword arguments of
+        upload_measurement. Returns a list of (request_data, measurement_indexes).
+        """
+        appx_filename = ERPAPIUtil._get_appx_filename()
+        operation_groups = [
+            ERPAPIUtil.create_measure_operations(
+                m.get('sample_name', ''),
+                m.get('position_name', ''),
+                m.get('group_name', ''),
+                m.get('operator', 'Unknown'),
+                appx_filename,
+                m.get('slide_id', ''),
+                m.get('sample_number', ''),
+                m.get('measurement_data_list', [])
+            )
+            for m in measurements
+        ]
+        return ERPAPIUtil.pack_operation_groups(operation_groups, max_operations, max_bytes)
+
+    @staticmethod
+    def upload_measurements(measurements, max_operations=None, max_bytes=None):
+        """Upload several measurements with as few ERP calls as possible
+
+        A composite request is applied as one transaction, so when the ERP
+        rejects a batch its measurements are resent one by one to find out
+        which of them the ERP rejects. Batches that failed for other reasons
+        are not resent.
+
+        Returns a list of (success, error) in the order of measurements.
+        """
+        results = [(False, "Not sent")] * len(measurements)
+        try:
+            batches = ERPAPIUtil.create_batch_requests(
+                measurements, max_operations, max_bytes)
+        except Exception as e:
+            logging.error("Error creating batch requests: %s", str(e))
+            return [(False, str(e))] * len(measurements)
+
+        for request_data, indexes in batches:
+            success, error = ERPAPIUtil.send_to_erp(request_data)
+            # 只有 ERP 明確拒絕 (整批回滾) 時才逐筆重送, 結果不明時重送可能重複建立
+            if success or len(indexes) == 1 or \
+                    getattr(error, 'kind', None) != ERPError.REJECTED:
+                for index in indexes:
+                    results[index] = (success, error)
+                continue
+            logging.warning("Batch of %d measurements failed, retrying individually: %s",
+                            len(indexes), error)
+            for index in indexes:
+                m = measurements[index]
+                results[index] = ERPAPIUtil.upload_measurement(
+                    m.get('sample_name', ''),
+                    m.get('position_name', ''),
+                    m.get('group_name', ''),
+                    m.get('operator', 'Unknown'),
+                    m.get('appx_filename', 'Unknown.appx'),
+                    m.get('slide_id', ''),
+                    m.get('sample_number', ''),
+                    m.get('measurement_data_list', [])
+                )
+        return results
+
     @staticmethod
     def upload_measurement(sample_name, position_name, group_name, operator,
                       appx_filename, slide_id, sample_number, measurement_data_list):
@@ -178,4 +443,5 @@ class ERPAPIUtil:
             )
             return ERPAPIUtil.send_to_erp(request_data)
         except Exception as e:
-            return False, str(e)
\ No newline at end of file
+            return False, str(e)
+
@@ -0,0 +1,207 @@
+# measurement_export.py
+from __future__ import print_function
+import csv
+import logging
+import os
+import re
+
+from measurement_history import MeasurementHistory
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+    pq = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class MeasurementExporter(object):
+    """把量測歷史匯出為寬表的欄式檔案, 供 SPC 分析使用
+
+    每筆 measure 一列: 基本欄位之外, 每個 data_name 一欄 (數值), 每個屬性一欄
+    "<data_name>.<屬性名>" (字串)。輸出依日期與 group_name 分區:
+        output_dir/date=2024-01-05/group_name=G1/part-00000.parquet
+
+    經由 MeasurementHistory 逐頁讀取, 各分區的列暫存在記憶體中, 某分區滿
+    chunk_rows 列或全部暫存超過 max_buffered_rows 列時寫出 part 檔, 記憶體用量
+    與資料庫大小無關。各 part 檔的欄位只包含該檔出現過的 data_name 與屬性,
+    讀取端需以欄位名稱合併 (如 pyarrow.dataset 的 schema 合併)。
+
+    格式: 'parquet' (需要 pyarrow), 'npz' (需要 numpy; 數值欄為 float64, 缺值
+    為 NaN, 其他欄為字串), 'csv' (無額外依賴)。未指定時使用可用的第一種。
+    """
+
+    FORMATS = ('parquet', 'npz', 'csv')
+    CHUNK_ROWS = 10000          # 每個 part 檔的最多列數
+    MAX_BUFFERED_ROWS = 50000   # 所有分區暫存列數的上限
+
+    BASE_COLUMNS = ['id', 'sample_name', 'position_name', 'group_name', 'operator',
+                    'appx_filename', 'slide_id', 'sample_number', 'created_at']
+
+    def __init__(self, db_path="measurements.db", output_dir="export", fmt=None,
+                 chunk_rows=None, max_buffered_rows=None):
+        self.db_path = db_path
+        self.output_dir = output_dir
+        self.fmt = fmt or self.available_format()
+        if self.fmt not in self.FORMATS:
+            raise ValueError("Unknown export format: {0}".format(self.fmt))
+        if self.fmt == 'parquet' and pyarrow is None:
+            raise ValueError("Parquet export requires pyarrow")
+        if self.fmt == 'npz' and np is None:
+            raise ValueError("npz export requires numpy")
+        self.chunk_rows = chunk_rows or self.CHUNK_ROWS
+        self.max_buffered_rows = max(max_buffered_rows or self.MAX_BUFFERED_ROWS,
+                                     self.chunk_rows)
+        self.history = MeasurementHistory(db_path)
+        self._next_part = {}
+
+    @staticmethod
+    def available_format():
+        if pyarrow is not None:
+            return 'parquet'
+        if np is not None:
+            return 'npz'
+        return 'csv'
+
+    @staticmethod
+    def _row(measure):
+        """measure dict 轉為一列; 回傳 (row, 數值欄位名稱)"""
+        row = dict((column, measure[column]) for column in MeasurementExporter.BASE_COLUMNS)
+        values = []
+        for data in measure['data']:
+            row[data['name']] = data['value']
+            values.append(data['name'])
+            for name, value in data['attributes'].items():
+                row['{0}.{1}'.format(data['name'], name)] = value
+        return row, values
+
+    @staticmethod
+    def _partition_value(value):
+        value = re.sub(r'[\\/:*?"<>|=]', '_', value or '')
+        return value or '_'
+
+    def _partition(self, measure):
+        return (self._partition_value((measure['created_at'] or '')[:10]),
+                self._partition_value(measure['group_name']))
+
+    def _part_path(self, partition):
+        directory = os.path.join(self.output_dir, 'date=' + partition[0],
+                                 'group_name=' + partition[1])
+        if partition not in self._next_part:
+            # 接續目錄中已有的 part 編號, 重複匯出不會覆寫先前的檔案
+            existing = [int(m.group(1)) for m in
+                        (re.match(r'part-(\d+)\.', name) for name in
+                         (os.listdir(directory) if os.path.isdir(directory) else []))
+                        if m]
+            self._next_part[partition] = max(existing) + 1 if existing else 0
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        number = self._next_part[partition]
+        self._next_part[partition] = number + 1
+        return os.path.join(directory, 'part-{0:05d}.{1}'.format(number, self.fmt))
+
+    def _flush(self, partition, buffer):
+        rows, value_columns = buffer
+        extra = set()
+        for row in rows:
+            extra.update(row)
+        extra.difference_update(self.BASE_COLUMNS)
+        columns = self.BASE_COLUMNS + sorted(extra)
+        path = self._part_path(partition)
+        getattr(self, '_write_' + self.fmt)(path, columns, value_columns, rows)
+        logging.debug("Exported %d measures to %s", len(rows), path)
+        return path
+
+    @staticmethod
+    def _write_parquet(path, columns, value_columns, rows):
+        fields = []
+        for column in columns:
+            if column == 'id':
+                dtype = pyarrow.int64()
+            elif column in value_columns:
+                dtype = pyarrow.float64()
+            else:
+                dtype = pyarrow.string()
+            fields.append(pyarrow.field(column, dtype))
+        data = {}
+        for field in fields:
+            values = [row.get(field.name) for row in rows]
+            if field.type == pyarrow.string():
+                # 屬性值不一定是字串, 與 npz 一樣轉為文字
+                values = [None if value is None else str(value) for value in values]
+            data[field.name] = values
+        table = pyarrow.Table.from_pydict(data, schema=pyarrow.schema(fields))
+        pq.write_table(table, path, compression='zstd')
+
+    @staticmethod
+    def _write_npz(path, columns, value_columns, rows):
+        arrays = {}
+        for column in columns:
+            if column == 'id':
+                arrays[column] = np.array([row['id'] for row in rows], dtype=np.int64)
+            elif column in value_columns:
+                arrays[column] = np.array([row.get(column, np.nan) for row in rows],
+                                          dtype=np.float64)
+            else:
+                arrays[column] = np.array([row.get(column) or '' for row in rows],
+                                          dtype=np.str_)
+        np.savez_compressed(path, **arrays)
+
+    @staticmethod
+    def _write_csv(path, columns, value_columns, rows):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, restval='')
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def export(self, sample_name=None, group_name=None, slide_id=None,
+               operator=None, start_time=None, end_time=None):
+        """匯出符合條件的量測, 回傳 {'measures', 'files', 'partitions'}"""
+        buffers = {}
+        buffered = 0
+        count = 0
+        files = []
+        partitions = set()
+        for measure in self.history.iter_measurements(
+                sample_name, group_name, slide_id, operator, start_time, end_time,
+                page_size=min(self.chunk_rows, MeasurementHistory.PAGE_SIZE)):
+            partition = self._partition(measure)
+            partitions.add(partition)
+            row, values = self._row(measure)
+            rows, value_columns = buffers.setdefault(partition, ([], set()))
+            rows.append(row)
+            value_columns.update(values)
+            buffered += 1
+            count += 1
+            if len(rows) >= self.chunk_rows:
+                files.append(self._flush(partition, buffers.pop(partition)))
+                buffered -= len(rows)
+            elif buffered >= self.max_buffered_rows:
+                for key in sorted(buffers):
+                    files.append(self._flush(key, buffers[key]))
+                buffers.clear()
+                buffered = 0
+
+        for key in sorted(buffers):
+            files.append(self._flush(key, buffers[key]))
+        logging.info("Exported %d measures in %d files (%s) to %s",
+                     count, len(files), self.fmt, self.output_dir)
+        return {'measures': count, 'files': files, 'partitions': len(partitions)}
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print("Usage: python measurement_export.py <output_dir> [db_path] [parquet|npz|csv]")
+        sys.exit(1)
+    exporter = MeasurementExporter(sys.argv[2] if len(sys.argv) > 2 else "measurements.db",
+                                   sys.argv[1], sys.argv[3] if len(sys.argv) > 3 else None)
+    report = exporter.export()
+    print("{0} measures, {1} files, {2} partitions".format(
+        report['measures'], len(report['files']), report['partitions']))
@@ -0,0 +1,146 @@
+# measurement_history.py
+from __future__ import print_function
+from datetime import datetime
+
+from db_connection import get_connection
+
+
+class MeasurementHistory(object):
+    """讀取本地量測歷史 (measures / measured_data / measure_attributes)
+
+    以 id 做 keyset 分頁: 每頁只查 id 大於 (或小於) 上一頁最後 id 的列,
+    不使用 OFFSET, 翻到多後面的頁都一樣快。iter_measurements 逐頁讀取並逐筆
+    yield, 不會把整段歷史載入記憶體, 也不會在 yield 之間持有讀取交易。
+
+    時間篩選比對 measures.created_at, 其值為 SQLite CURRENT_TIMESTAMP (UTC)。
+    """
+
+    PAGE_SIZE = 500
+
+    FILTER_COLUMNS = ['sample_name', 'group_name', 'slide_id', 'operator']
+
+    def __init__(self, db_path="measurements.db"):
+        self.db_path = db_path
+
+    @staticmethod
+    def _format_time(value):
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        return value
+
+    def _where(self, filters, start_time, end_time, after_id, newest_first):
+        """組合 WHERE 條件; filters 的值可以是單一值或值的列表"""
+        clauses = []
+        params = []
+        for column in self.FILTER_COLUMNS:
+            value = filters.get(column)
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                values = list(value)
+                clauses.append("%s IN (%s)" % (column, ", ".join("?" * len(values))))
+                params.extend(values)
+            else:
+                clauses.append("%s = ?" % column)
+                params.append(value)
+        if start_time is not None:
+            clauses.append("created_at >= ?")
+            params.append(self._format_time(start_time))
+        if end_time is not None:
+            clauses.append("created_at < ?")
+            params.append(self._format_time(end_time))
+        if after_id is not None:
+            clauses.append("id < ?" if newest_first else "id > ?")
+            params.append(after_id)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query_page(self, sample_name=None, group_name=None, slide_id=None,
+                   operator=None, start_time=None, end_time=None,
+                   after_id=None, limit=None, newest_first=False):
+        """讀取一頁量測, 回傳 (measurements, next_after_id)
+
+        after_id 傳入上一頁回傳的 next_after_id 取得下一頁; next_after_id 為
+        None 表示沒有更多資料。每筆量測為 dict, data 欄位是該次量測的
+        [{name, value, path, attributes}, ...]。
+        """
+        limit = limit or self.PAGE_SIZE
+        filters = {'sample_name': sample_name, 'group_name': group_name,
+                   'slide_id': slide_id, 'operator': operator}
+        where, params = self._where(filters, start_time, end_time, after_id, newest_first)
+
+        with get_connection(self.db_path) as conn:
+            c = conn.cursor()
+            c.execute("""
+                SELECT id, sample_name, position_name, group_name, operator,
+                       appx_filename, slide_id, sample_number, created_at
+                FROM measures%s
+                ORDER BY id %s
+                LIMIT ?
+            """ % (where, "DESC" if newest_first else "ASC"), params + [limit])
+            measures = [{
+                'id': row[0],
+                'sample_name': row[1],
+                'position_name': row[2],
+                'group_name': row[3],
+                'operator': row[4],
+                'appx_filename': row[5],
+                'slide_id': row[6],
+                'sample_number': row[7],
+                'created_at': row[8],
+                'data': []
+            } for row in c.fetchall()]
+            if not measures:
+                return [], None
+
+            self._load_data(c, measures)
+
+        next_after_id = measures[-1]['id'] if len(measures) == limit else None
+        return measures, next_after_id
+
+    @staticmethod
+    def _load_data(c, measures):
+        """一次查詢本頁所有 measured_data 與 attributes"""
+        by_id = dict((measure['id'], measure) for measure in measures)
+        placeholders = ", ".join("?" * len(by_id))
+        c.execute("""
+            SELECT d.measure_id, d.id, d.data_name, d.data_value, d.identity_path,
+                   a.attribute_name, a.attribute_value
+            FROM measured_data d
+            LEFT JOIN measure_attributes a ON a.measured_data_id = d.id
+            WHERE d.measure_id IN (%s)
+            ORDER BY d.id, a.id
+        """ % placeholders, list(by_id))
+
+        last_data_id = None
+        data = None
+        for measure_id, data_id, name, value, path, attr_name, attr_value in c.fetchall():
+            if data_id != last_data_id:
+                data = {'name': name, 'value': value, 'path': path, 'attributes': {}}
+                by_id[measure_id]['data'].append(data)
+                last_data_id = data_id
+            if attr_name is not None:
+                data['attributes'][attr_name] = attr_value
+
+    def iter_measurements(self, sample_name=None, group_name=None, slide_id=None,
+                          operator=None, start_time=None, end_time=None,
+                          page_size=None, newest_first=False):
+        """逐筆 yield 符合條件的量測, 每次只在記憶體中保留一頁"""
+        after_id = None
+        while True:
+            measures, after_id = self.query_page(
+                sample_name, group_name, slide_id, operator, start_time, end_time,
+                after_id, page_size, newest_first)
+            for measure in measures:
+                yield measure
+            if after_id is None:
+                return
+
+    def count(self, sample_name=None, group_name=None, slide_id=None,
+              operator=None, start_time=None, end_time=None):
+        """符合條件的量測筆數"""
+        filters = {'sample_name': sample_name, 'group_name': group_name,
+                   'slide_id': slide_id, 'operator': operator}
+        where, params = self._where(filters, start_time, end_time, None, False)
+        with get_connection(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM measures" + where,
+                                params).fetchone()[0]
@@ -2,14 +2,6 @@
 from __future__ import print_function
 import sys
 
-if sys.version_info[0] >= 3:
-    from urllib.request import Request, urlopen
-    from urllib.error import HTTPError, URLError
-    from urllib.parse import urlencode
-else:
-    from urllib2 import Request, urlopen, HTTPError, URLError
-    from urllib import urlencode
-
 from MeasurementUI import start_ui, MeasurementUI
 
 # 添加zygo模組路徑
@@ -22,10 +14,14 @@ if zygo_path not in sys.path:
 from zygo import ui, mx, connectionmanager
 from zygo.ui import show_dialog, DialogMode
 from zygo.units import Units
+import math
 import time
 from settings_manager import SettingsManager
 import threading
 from erp_util import ERPAPIUtil
+from erp_outbox import ERPOutbox
+from config import RetentionConfig
+from retention import RetentionJob
 import logging
 
 logging.basicConfig(
@@ -35,16 +31,50 @@ logging.basicConfig(
 )
 
 class MeasurementMonitor:
-    def __init__(self):
+    # 用来侦测新量测的 Mx 属性, 任一值改变就立即做完整结果读取.
+    # ("System", "Load", "Data Filename") 出自 Samples/mx_intermediate.py, 但只在
+    # 载入/储存资料时改变, 现场量测不一定会变; ("Measurement", "Attributes",
+    # "Timestamp") 尚未在机台 Mx 上确认. Mx 不认得的路径会在第一次读取失败时
+    # 记录警告并移出监看列表, 可用 change_signal_paths 参数改为实测有效的路径.
+    CHANGE_SIGNAL_PATHS = [
+        ("System", "Load", "Data Filename"),
+        ("Measurement", "Attributes", "Timestamp"),
+    ]
+    MIN_POLL_INTERVAL = 0.5     # 有变化时的轮询间隔(秒)
+    MAX_POLL_INTERVAL = 5       # 闲置时退避到的最长间隔(秒)
+    SIGNAL_SETTLE_TIME = 5      # 信号改变后持续读取结果的时间(秒), 等待分析完成
+    # 信号确认前, 信号未变时仍强制完整读取的间隔(秒), 维持原本 5 秒的读取节奏.
+    # 信号改变后读到新量测即视为确认, 之后闲置时只读取信号; 强制读取若读到信号
+    # 没有反映的新量测, 表示信号路径无效, 停用信号并改回每轮完整读取.
+    FULL_READ_INTERVAL = 5
+    SIGNAL_MAX_FAILURES = 3     # 信号连续读取失败几次后停用
+
+    def __init__(self, change_signal_paths=None):
         self.is_running = True
         self.measurement_lock = threading.Lock()
         self.db_lock = threading.Lock()
         self.last_data = None
         self.current_position = 0
         self.settings_manager = SettingsManager()  # 增加这行
+        self.outbox = ERPOutbox(self.settings_manager.db_path,
+                                on_result=self._on_upload_result)
+        self.retention = RetentionJob(self.settings_manager.db_path) \
+            if RetentionConfig.ENABLED else None
         self.new_data_available = False
         self.upload_error = False
         self.last_upload_error = False
+        self.change_signal_paths = list(
+            self.CHANGE_SIGNAL_PATHS if change_signal_paths is None
+            else change_signal_paths)
+        self.poll_interval = self.MIN_POLL_INTERVAL
+        self._last_signal = None
+        self._signal_available = False
+        self._read_deadline = 0
+        self._last_full_read = 0
+        self._read_reason = None
+        self._signal_verified = False
+        self._signal_failures = 0
+        self._signal_probed = False
 
     def _get_next_position(self):
         """获取下一个点位编号"""
@@ -85,15 +115,6 @@ class MeasurementMonitor:
             
         return True
 
-    def check_network(self):
-        try:
-            response = urlopen("https://erp.topgiga.com.tw/", timeout=5)
-            return True
-        except (HTTPError, URLError):
-            return False
-        except Exception as e:
-            logging.error("Network check error: %s" % str(e))
-            return False
     def connect_to_zygo(self):
         try:
             self.uid = connectionmanager.connect(host='localhost', port=8733)
@@ -143,39 +164,38 @@ class MeasurementMonitor:
         collected_fields = set()
         has_changes = False
 
+        field_paths = []
         for field in settings.get('measurement_fields', []):
-            try:
-                field_name = field['name']
-                cleaned_path = [
-                    segment.strip().strip('"').strip("'")
-                    for segment in field['path'].split(',')
-                ]
-                path = tuple(cleaned_path)
-
-                # 获取测量值
-                value = mx.get_result_number(path, Units.MicroMeters)
-                logging.debug(f"Field {field_name} at path {path}: {value}")
-
-                if value is not None:
-                    # 创建测量数据记录
-                    measurement_data = {
-                        'field_name': field_name,
-                        'value': value,
-                        'attributes': sop_params.copy(),
-                        'operator': base_data['operator']
-                    }
-
-                    # 检查数据变化
-                    if (self.last_data is None or
-                            field_name not in self.last_data or
-                            abs(self.last_data.get(field_name, 0) - value) > 1e-6):
-                        has_changes = True
-
-                    measurement_results.append(measurement_data)
-                    collected_fields.add(field_name)
-
-            except Exception as e:
-                logging.error(f"Error getting field {field_name}: {str(e)}")
+            cleaned_path = [
+                segment.strip().strip('"').strip("'")
+                for segment in field['path'].split(',')
+            ]
+            field_paths.append((field['name'], tuple(cleaned_path)))
+
+        # 一次 GetBulkResultValues 取得所有字段
+        values = self._read_field_values(field_paths)
+
+        for field_name, path in field_paths:
+            value = values.get(field_name)
+            logging.debug(f"Field {field_name} at path {path}: {value}")
+
+            if value is not None:
+                # 创建测量数据记录
+                measurement_data = {
+                    'field_name': field_name,
+                    'value': value,
+                    'attributes': sop_params.copy(),
+                    'operator': base_data['operator']
+                }
+
+                # 检查数据变化
+                if (self.last_data is None or
+                        field_name not in self.last_data or
+                        abs(self.last_data.get(field_name, 0) - value) > 1e-6):
+                    has_changes = True
+
+                measurement_results.append(measurement_data)
+                collected_fields.add(field_name)
 
         # 检查是否收集到所有字段
         if collected_fields != required_fields:
@@ -196,6 +216,156 @@ class MeasurementMonitor:
         logging.debug("No changes or incomplete data")
         return None
 
+    def _read_field_values(self, field_paths):
+        """Read all field results from Mx in one bulk request.
+
+        Returns a dict of field name to float for every field with a valid
+        value; missing or invalid fields are logged and left out. Falls back
+        to one get_result_number call per field if the bulk request fails.
+        """
+        if not field_paths:
+            return {}
+        paths_and_units = [(path, Units.MicroMeters) for _, path in field_paths]
+        try:
+            raw_values = mx.get_bulk_result_values(paths_and_units)
+            if len(raw_values) != len(field_paths):
+                raise ValueError("expected {0} values, got {1}".format(
+                    len(field_paths), len(raw_values)))
+        except Exception as e:
+            logging.warning("Bulk result read failed, reading fields one by one: %s", str(e))
+            return self._read_field_values_single(field_paths)
+
+        values = {}
+        for (field_name, path), raw in zip(field_paths, raw_values):
+            value = self._field_value(field_name, path, raw)
+            if value is not None:
+                values[field_name] = value
+        return values
+
+    def _read_field_values_single(self, field_paths):
+        """Read field results from Mx with one request per field."""
+        values = {}
+        for field_name, path in field_paths:
+            try:
+                raw = mx.get_result_number(path, Units.MicroMeters)
+            except Exception as e:
+                logging.error(f"Error getting field {field_name}: {str(e)}")
+                continue
+            value = self._field_value(field_name, path, raw)
+            if value is not None:
+                values[field_name] = value
+        return values
+
+    @staticmethod
+    def _field_value(field_name, path, raw):
+        """Convert a result read from Mx to float; None if missing or invalid."""
+        try:
+            value = float(raw)
+        except (TypeError, ValueError):
+            logging.error(f"Invalid value for field {field_name} at path {path}: {raw!r}")
+            return None
+        if math.isnan(value) or math.isinf(value):
+            logging.error(f"No valid data for field {field_name} at path {path}")
+            return None
+        return value
+
+    def _read_change_signal(self):
+        """Read the Mx change-signal attributes in one bulk request.
+
+        Returns a tuple of the attribute values, or None if no signal is
+        available, in which case the caller should fall back to polling.
+        After the first failed read each path is probed once and paths Mx
+        does not recognise are dropped from the watch list; the signal is
+        disabled after SIGNAL_MAX_FAILURES consecutive failed reads.
+        """
+        if not self.change_signal_paths:
+            return None
+        try:
+            signal = tuple(mx.get_bulk_attribute_values(
+                [(path, None) for path in self.change_signal_paths]))
+            self._signal_failures = 0
+            return signal
+        except Exception as e:
+            logging.debug("Change signal read failed: %s", str(e))
+
+        self._signal_failures += 1
+        if not self._signal_probed:
+            self._signal_probed = True
+            valid = []
+            for path in self.change_signal_paths:
+                try:
+                    mx.get_attribute_string(path)
+                    valid.append(path)
+                except Exception as e:
+                    logging.warning("Change signal path %s unavailable: %s", path, str(e))
+            # 全部失败多半是连线问题, 保留原列表下次再试
+            if valid and valid != self.change_signal_paths:
+                self.change_signal_paths = valid
+                self._signal_failures = 0
+        if self._signal_failures >= self.SIGNAL_MAX_FAILURES:
+            self._disable_change_signal(
+                "{0} consecutive read failures".format(self._signal_failures))
+        return None
+
+    def _disable_change_signal(self, reason):
+        """Stop reading the change signal and read results every cycle."""
+        logging.warning("Change signal disabled (%s), reading results every cycle", reason)
+        self.change_signal_paths = []
+        self._signal_available = False
+
+    def _should_read_results(self):
+        """Return True when a full result read is due this cycle.
+
+        A read is due when the change signal differs from the last cycle,
+        while the signal is settling after a change, or when no signal is
+        available. Until the signal is verified a read is also forced every
+        FULL_READ_INTERVAL seconds; once verified, an idle cycle only reads
+        the signal.
+        """
+        now = time.time()
+        signal = self._read_change_signal()
+        self._signal_available = signal is not None
+        if signal is None:
+            self._read_reason = 'poll'
+            return True
+
+        if signal != self._last_signal:
+            if self._last_signal is None:
+                self._read_reason = 'initial'
+            else:
+                logging.info("Measurement change detected: %s", str(signal))
+                self._read_reason = 'signal'
+            self._last_signal = signal
+            self._read_deadline = now + self.SIGNAL_SETTLE_TIME
+        elif now < self._read_deadline:
+            pass  # 信号稳定前沿用这次改变的读取原因
+        elif self._signal_verified or \
+                now - self._last_full_read < self.FULL_READ_INTERVAL:
+            return False
+        else:
+            self._read_reason = 'forced'
+
+        self._last_full_read = now
+        return True
+
+    def _check_change_signal(self):
+        """Verify or disable the change signal after new results were read."""
+        if self._read_reason == 'signal' and not self._signal_verified:
+            self._signal_verified = True
+            logging.info("Change signal verified, idle cycles only read the signal")
+        elif self._read_reason == 'forced':
+            self._disable_change_signal("a new measurement did not change it")
+
+    def _update_poll_interval(self, active):
+        """Reset the poll interval after activity, back off while idle."""
+        if not self._signal_available:
+            self.poll_interval = self.MAX_POLL_INTERVAL
+        elif active:
+            self.poll_interval = self.MIN_POLL_INTERVAL
+        else:
+            self.poll_interval = min(self.poll_interval * 2,
+                                     self.MAX_POLL_INTERVAL)
+
     def monitoring_thread(self):
         last_settings = None
         important_fields = ["sample_name", "group_name", "slide_id", "sample_number"]
@@ -220,9 +390,21 @@ class MeasurementMonitor:
                             important_settings_changed = True
                             break
 
+                # 只有 Mx 信号改变时才做完整结果读取
+                read_due = self._should_read_results()
+
                 with self.measurement_lock:
-                    data = self.get_measurement_data(settings)
+                    data = self.get_measurement_data(settings) if read_due else None
                     if data is not None:
+                        self._check_change_signal()
+                        # 已取得新数据, 不必再等待信号稳定
+                        self._read_deadline = 0
+                        # 量测结果写入历史表 (与目前设置分开保存)
+                        self.settings_manager.save_measurement(
+                            data[0],
+                            settings.get("appx_filename", "Unknown.appx"),
+                            data[1],
+                            settings.get("measurement_fields", []))
                         # 处理有新数据的情况
                         next_pos = self._get_next_position()
                         settings['position_name'] = next_pos
@@ -260,30 +442,27 @@ class MeasurementMonitor:
 
                 # 更新上一次的设置
                 last_settings = dict(settings)
-                time.sleep(5)
+                self._update_poll_interval(
+                    time.time() < self._read_deadline or data is not None
+                    or important_settings_changed)
+                time.sleep(self.poll_interval)
 
             except Exception as e:
                 logging.error("Error in monitoring thread: %s" % str(e))
                 time.sleep(5)
     def upload_to_erp(self, data, settings):
-        if not self.check_network():
-            self.upload_error = True
-            self.new_data_available = True
-            return False, "Network connection failed"
-        """上傳所有測量點的數據"""
+        """將所有測量點的數據寫入 ERP outbox, 由背景執行緒上傳"""
         base_data, measurements = data
 
-
         # 組合完整的測量數據
         measurement_data_list = []
         for measurement in measurements:
             measurement_data_list.append(measurement)
 
         # 记录发送的数据用于调试
-        logging.info("Uploading measurement data: %s", str(measurement_data_list))
+        logging.info("Queueing measurement data: %s", str(measurement_data_list))
 
-        # 上傳所有測量點
-        success, error = ERPAPIUtil.upload_measurement(
+        request_data = ERPAPIUtil.create_measure_request(
             base_data["sample_name"],
             base_data["position_name"],
             base_data["group_name"],
@@ -293,12 +472,28 @@ class MeasurementMonitor:
             base_data["sample_number"],
             measurement_data_list
         )
+        if request_data is None:
+            return False, "Failed to create measure request"
+
+        # 同一筆量測只會排入一次
+        key = "{0}-{1}-{2}".format(
+            base_data["slide_id"], base_data["position_name"], base_data["timestamp"])
+        try:
+            self.outbox.enqueue(request_data, key)
+        except Exception as e:
+            logging.error("Failed to queue measurements: %s", str(e))
+            return False, str(e)
+        return True, None
 
+    def _on_upload_result(self, key, success, error):
+        """outbox 上傳結果回呼, 更新 UI 顯示的上傳狀態"""
         if success:
             logging.info("Successfully uploaded all measurements")
         else:
             logging.error("Failed to upload measurements: %s", error)
-        return success, error
+        self.upload_error = not success
+        self.last_upload_error = not success
+        self.new_data_available = True
 
     def start(self):
         # 在启动时重置点位
@@ -306,10 +501,16 @@ class MeasurementMonitor:
         self.monitor_thread = threading.Thread(target=self.monitoring_thread)
         self.monitor_thread.daemon = True
         self.monitor_thread.start()
+        self.outbox.start()
+        if self.retention is not None:
+            self.retention.start()
         logging.info("Monitoring started")
 
     def stop(self):
         self.is_running = False
+        self.outbox.stop(timeout=5)
+        if self.retention is not None:
+            self.retention.stop(timeout=5)
         if hasattr(self, 'uid'):
             connectionmanager.terminate()
         logging.info("Monitoring stopped")
@@ -3,7 +3,6 @@ OCR Handler for Python 3.4.3
 Compatible with Python 3.4.3 syntax requirements
 """
 import os
-import sqlite3
 
 from PIL import ImageGrab
 import pytesseract
@@ -12,7 +11,9 @@ import numpy as np
 import tkinter as tk
 from tkinter import ttk, messagebox
 from database_manager import DatabaseManager
+from db_connection import get_connection
 from erp_util import ERPAPIUtil
+from erp_outbox import ERPOutbox
 from settings_manager import SettingsManager
 import threading
 import logging
@@ -148,6 +149,7 @@ class SliceDataManager(object):
         self.db_manager = DatabaseManager()
         self.slice_data_lock = threading.Lock()
         self.settings_manager = SettingsManager()
+        self.outbox = ERPOutbox(self.settings_manager.db_path)
         self.last_data_name = self.load_last_data_name()
 
     def load_last_data_name(self):
@@ -189,16 +191,9 @@ class SliceDataManager(object):
                     sop_params[key] = value
 
             with self.slice_data_lock:
-                with sqlite3.connect(self.db_manager.db_path) as conn:
-                    c = conn.cursor()
-
-                    # 1. 插入 measures 表記錄
-                    c.execute("""
-                        INSERT INTO measures 
-                        (sample_name, position_name, group_name, operator, appx_filename, 
-                         slide_id, sample_number)
-                        VALUES (?, ?, ?, ?, ?, ?, ?)
-                    """, (
+                # measures / measured_data / SOP 參數在同一個交易中以 executemany 寫入
+                with get_connection(self.db_manager.db_path) as conn:
+                    DatabaseManager.insert_measure(conn, (
                         settings.get('sample_name', ''),
                         settings.get('position_name', ''),
                         settings.get('group_name', ''),
@@ -206,33 +201,7 @@ class SliceDataManager(object):
                         settings.get('appx_filename', 'Unknown.appx'),
                         settings.get('slide_id', ''),
                         settings.get('sample_number', '')
-                    ))
-
-                    measure_id = c.lastrowid
-
-                    # 2. 插入 measured_data 表記錄
-                    c.execute("""
-                        INSERT INTO measured_data 
-                        (measure_id, data_name, data_value, identity_path)
-                        VALUES (?, ?, ?, ?)
-                    """, (
-                        measure_id,
-                        data_name,
-                        float(data_value),
-                        "OCR_GENERATED"
-                    ))
-
-                    measured_data_id = c.lastrowid
-
-                    # 3. 插入 SOP 參數到 measure_attributes 表
-                    for param_name, param_value in sop_params.items():
-                        c.execute("""
-                            INSERT INTO measure_attributes
-                            (measured_data_id, attribute_name, attribute_value)
-                            VALUES (?, ?, ?)
-                        """, (measured_data_id, param_name, str(param_value)))
-
-                    conn.commit()
+                    ), [(data_name, float(data_value), "OCR_GENERATED", sop_params)])
 
                 # 構建用於 ERP 上傳的數據結構
                 measured_data = {
@@ -242,8 +211,7 @@ class SliceDataManager(object):
                     'operator': settings.get('operator', 'Unknown')
                 }
 
-                # 上傳到 ERP
-                success, error = ERPAPIUtil.upload_measurement(
+                request_data = ERPAPIUtil.create_measure_request(
                     settings.get('sample_name', ''),
                     settings.get('position_name', ''),
                     settings.get('group_name', ''),
@@ -253,10 +221,17 @@ class SliceDataManager(object):
                     settings.get('sample_number', ''),
                     [measured_data]
                 )
+                if request_data is None:
+                    logging.error("Failed to create slice data request")
+                    return False
 
+                # 先寫入 outbox; 是佇列頭時直接送出這一筆, 否則 (或失敗時)
+                # 由監控程式的背景執行緒依序上傳
+                key = self.outbox.enqueue(request_data)
+                success, error = self.outbox.send_item(key)
                 if not success:
-                    logging.error("Failed to upload slice data to ERP: {0}".format(error))
-                    return False
+                    logging.warning("Slice data queued for upload: {0}".format(
+                        error or "waiting for earlier items"))
 
                 self.save_last_data_name(data_name)
                 return True
@@ -85,7 +85,7 @@ class PSSettingsUI(SettingsUI):
             print("Error: Repeat tree not available")
             return
 
-        measure_id = self.settings_manager.get_latest_measure_id()
+        measure_id = self.settings_manager.get_current_settings_id()
         print(f"Loading patterns for measure_id: {measure_id}")
 
         if measure_id:
@@ -461,8 +461,8 @@ class PSSettingsUI(SettingsUI):
             )
 
             if success:
-                # 获取最新的measure_id
-                measure_id = self.settings_manager.get_latest_measure_id()
+                # 获取目前设置的id
+                measure_id = self.settings_manager.get_current_settings_id()
                 if measure_id:
                     # 保存重复模式
                     patterns = {
@@ -0,0 +1,224 @@
+# retention.py
+from __future__ import print_function
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from config import RetentionConfig
+from db_connection import get_connection
+from measurement_history import MeasurementHistory
+
+
+class RetentionJob(object):
+    """量測歷史的保留與壓縮工作
+
+    超過 max_age_days 的 measures (連同 measured_data / measure_attributes)
+    依建立月份追加到 archive_dir 下的 measures-YYYY-MM.jsonl.gz, 寫入並 fsync
+    後才分批刪除, 每批一個短交易, 不會長時間持有寫入鎖。刪除後以
+    incremental_vacuum 分段歸還空間 (需先以 enable_incremental_vacuum 切換),
+    並清除已上傳超過保留期的 erp_outbox 項目。
+
+    若在歸檔與刪除之間中斷, 該批下次會再歸檔一次 (至少一次, 不會遺失)。
+    """
+
+    BATCH_SIZE = 500            # 每批歸檔/刪除的 measures 筆數
+    BATCH_PAUSE = 0.1           # 批次之間讓出寫入鎖的秒數
+    VACUUM_PAGES = 2000         # 每次 incremental_vacuum 歸還的頁數
+    RUN_INTERVAL = 24 * 3600    # 背景執行間隔(秒)
+    AUTO_VACUUM_INCREMENTAL = 2
+
+    def __init__(self, db_path="measurements.db", archive_dir=None,
+                 max_age_days=None, batch_size=None):
+        self.db_path = db_path
+        self.archive_dir = archive_dir or os.path.join(
+            os.path.dirname(os.path.abspath(db_path)), RetentionConfig.ARCHIVE_DIR)
+        self.max_age_days = RetentionConfig.MAX_AGE_DAYS if max_age_days is None \
+            else max_age_days
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.history = MeasurementHistory(db_path)
+        self.last_report = None
+        self._stop = threading.Event()
+        self._worker = None
+
+    def _file_size(self):
+        return sum(os.path.getsize(path) for path in
+                   (self.db_path, self.db_path + '-wal') if os.path.exists(path))
+
+    def _archive_path(self, month):
+        return os.path.join(self.archive_dir, 'measures-{0}.jsonl.gz'.format(month))
+
+    def _archive(self, measures):
+        """依月份把 measures 追加到壓縮檔 (每次追加一個 gzip member) 並 fsync"""
+        by_month = {}
+        for measure in measures:
+            month = (measure['created_at'] or '')[:7] or 'unknown'
+            by_month.setdefault(month, []).append(measure)
+
+        for month, items in by_month.items():
+            with open(self._archive_path(month), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                    for measure in items:
+                        f.write(json.dumps(measure, ensure_ascii=False).encode('utf-8'))
+                        f.write(b'\n')
+                raw.flush()
+                os.fsync(raw.fileno())
+
+    def _delete(self, measure_ids):
+        placeholders = ", ".join("?" * len(measure_ids))
+        with get_connection(self.db_path) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("""
+                DELETE FROM measure_attributes WHERE measured_data_id IN
+                (SELECT id FROM measured_data WHERE measure_id IN (%s))
+            """ % placeholders, measure_ids)
+            conn.execute("DELETE FROM measured_data WHERE measure_id IN (%s)"
+                         % placeholders, measure_ids)
+            conn.execute("DELETE FROM measures WHERE id IN (%s)"
+                         % placeholders, measure_ids)
+
+    def _purge_outbox(self, cutoff):
+        """刪除已上傳且超過保留期的 outbox 項目"""
+        deleted = 0
+        while not self._stop.is_set():
+            with get_connection(self.db_path) as conn:
+                tables = conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'erp_outbox'"
+                ).fetchone()
+                if not tables:
+                    return 0
+                c = conn.execute("""
+                    DELETE FROM erp_outbox WHERE id IN
+                    (SELECT id FROM erp_outbox WHERE status = 'sent' AND sent_at < ?
+                     LIMIT ?)
+                """, (cutoff, self.batch_size))
+                deleted += c.rowcount
+            if c.rowcount < self.batch_size:
+                break
+            time.sleep(self.BATCH_PAUSE)
+        return deleted
+
+    def _auto_vacuum_mode(self):
+        return get_connection(self.db_path).execute("PRAGMA auto_vacuum").fetchone()[0]
+
+    def enable_incremental_vacuum(self):
+        """把資料庫切換為 auto_vacuum=INCREMENTAL
+
+        需要一次完整 VACUUM, 會在整個檔案重寫期間持有獨佔鎖; 只能在維護時段
+        或監控程式啟動前執行 (python retention.py --enable-incremental-vacuum),
+        保留工作本身不會呼叫。
+        """
+        conn = get_connection(self.db_path)
+        if self._auto_vacuum_mode() == self.AUTO_VACUUM_INCREMENTAL:
+            return False
+        start = time.time()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logging.info("Enabled incremental auto_vacuum on %s in %.1f s",
+                     self.db_path, time.time() - start)
+        return True
+
+    def _vacuum(self):
+        """分段執行 incremental_vacuum, 回傳是否有壓縮
+
+        資料庫尚未啟用 incremental auto_vacuum 時不壓縮 (刪除釋出的頁會被
+        之後的寫入重用), 只記錄提示。
+        """
+        conn = get_connection(self.db_path)
+        if self._auto_vacuum_mode() != self.AUTO_VACUUM_INCREMENTAL:
+            logging.info("Skipping compaction of %s: auto_vacuum is not INCREMENTAL, "
+                         "run enable_incremental_vacuum() in a maintenance window",
+                         self.db_path)
+            return False
+        while not self._stop.is_set():
+            if conn.execute("PRAGMA freelist_count").fetchone()[0] == 0:
+                break
+            # 每歸還一頁回傳一列, 需讀完結果才會執行完
+            conn.execute("PRAGMA incremental_vacuum(%d)" % self.VACUUM_PAGES).fetchall()
+            time.sleep(self.BATCH_PAUSE)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return True
+
+    def run_once(self):
+        """執行一次保留工作, 回傳報告 dict 並記錄到 log"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.max_age_days)
+                  ).strftime('%Y-%m-%d %H:%M:%S')
+        report = {'cutoff': cutoff, 'size_before': self._file_size(),
+                  'archived': 0, 'outbox_purged': 0}
+        if not os.path.isdir(self.archive_dir):
+            os.makedirs(self.archive_dir)
+
+        start = time.time()
+        while not self._stop.is_set():
+            measures, _ = self.history.query_page(end_time=cutoff, limit=self.batch_size)
+            if not measures:
+                break
+            self._archive(measures)
+            self._delete([measure['id'] for measure in measures])
+            report['archived'] += len(measures)
+            time.sleep(self.BATCH_PAUSE)
+        report['archive_seconds'] = time.time() - start
+
+        start = time.time()
+        report['outbox_purged'] = self._purge_outbox(cutoff)
+        report['purge_seconds'] = time.time() - start
+
+        start = time.time()
+        report['compacted'] = self._vacuum()
+        report['vacuum_seconds'] = time.time() - start
+        report['size_after'] = self._file_size()
+
+        logging.info(
+            "Retention: archived %d measures older than %s, purged %d outbox items, "
+            "size %.1f MB -> %.1f MB (archive %.1f s, purge %.1f s, vacuum %.1f s)",
+            report['archived'], cutoff, report['outbox_purged'],
+            report['size_before'] / 1e6, report['size_after'] / 1e6,
+            report['archive_seconds'], report['purge_seconds'], report['vacuum_seconds'])
+        self.last_report = report
+        return report
+
+    @staticmethod
+    def iter_archive(path):
+        """逐筆讀回歸檔檔案中的 measures"""
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error("Error in retention job: %s", str(e))
+            self._stop.wait(self.RUN_INTERVAL)
+
+    def start(self):
+        """啟動背景保留工作執行緒"""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stop.clear()
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+        logging.info("Retention job started (max age %d days)", self.max_age_days)
+
+    def stop(self, timeout=None):
+        """停止背景執行緒; 進行中的批次完成後結束"""
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+
+if __name__ == '__main__':
+    import sys
+    logging.basicConfig(level=logging.INFO)
+    job = RetentionJob(sys.argv[2] if len(sys.argv) > 2 else "measurements.db")
+    if len(sys.argv) > 1 and sys.argv[1] == '--enable-incremental-vacuum':
+        job.enable_incremental_vacuum()
+    else:
+        print(job.run_once())
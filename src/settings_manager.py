@@ -4,6 +4,7 @@ import os
 import json
 import sqlite3
 import sys
+import threading
 from datetime import datetime
 from logging import fatal
 from tkinter import messagebox
@@ -14,17 +15,37 @@ if zygo_path not in sys.path:
     sys.path.append(zygo_path)
 from zygo import mx
 
+from database_manager import DatabaseManager
+from db_connection import ConnectionManager, GroupCommitWriter, get_connection
+
 
 class SettingsManager(object):
-    def __init__(self, db_path="measurements.db"):
+    DEFAULT_STATION = "default"
+    # PRAGMA user_version; 1: 設置保存在 current_settings, measures 只有量測歷史
+    SCHEMA_VERSION = 1
+    # 舊版的設置快照: 沒有任何非 0 量測值的 measure
+    _SNAPSHOT_IDS = """
+        SELECT m.id FROM measures m WHERE NOT EXISTS
+            (SELECT 1 FROM measured_data d
+             WHERE d.measure_id = m.id AND d.data_value != 0)
+    """
+
+    def __init__(self, db_path="measurements.db", station=None, group_commit=False):
         self.db_path = db_path
+        self.station = station or self.DEFAULT_STATION
+        self._writer = GroupCommitWriter(db_path) \
+            if group_commit else None
+        self._cache_lock = threading.Lock()
+        self._version_conn = None
+        self._settings_cache = None
+        self._settings_cache_version = None
         self.initialize_database()
         self.load_current_settings()
 
     def initialize_database(self):
         """初始化資料庫"""
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            self.conn = get_connection(self.db_path)
             self.cursor = self.conn.cursor()
 
             # 创建 Measure 表
@@ -84,7 +105,27 @@ class SettingsManager(object):
                     )
                """)
 
+            # 目前設置表, 每個 station 一列, 原地更新; measures 等表只保存量測歷史
+            self.cursor.execute("""
+                CREATE TABLE IF NOT EXISTS current_settings (
+                    id INTEGER PRIMARY KEY,
+                    station TEXT NOT NULL UNIQUE,
+                    sample_name TEXT NOT NULL,
+                    position_name TEXT NOT NULL,
+                    group_name TEXT NOT NULL,
+                    operator TEXT NOT NULL,
+                    appx_filename TEXT NOT NULL,
+                    slide_id TEXT,
+                    sample_number TEXT,
+                    measurement_fields TEXT NOT NULL DEFAULT '[]',  -- JSON array of {name, path}
+                    attributes TEXT NOT NULL DEFAULT '{}',          -- JSON object of SOP params
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
             self.conn.commit()
+            ConnectionManager.ensure_indexes(self.conn)
+            self.migrate_settings()
             print("Database initialized successfully")
 
 
@@ -147,72 +188,167 @@ class SettingsManager(object):
             print("Error getting operators: {0}".format(str(e)))
             return []
 
+    def _data_version(self):
+        """SQLite data_version, 其他連線 (含其他程序) 寫入後會改變
+
+        data_version 不反映同一連線自己的寫入, 因此使用獨立連線而非共用連線。
+        """
+        with self._cache_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            return self._version_conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def invalidate_settings_cache(self):
+        """清除設置快取, 下次讀取會重新查詢資料庫"""
+        with self._cache_lock:
+            self._settings_cache = None
+            self._settings_cache_version = None
+
+    @staticmethod
+    def _copy_settings(settings):
+        if settings is None:
+            return None
+        copied = dict(settings)
+        copied["measurement_fields"] = [dict(f) for f in settings["measurement_fields"]]
+        return copied
+
     def load_current_settings(self):
-        """从数据库加载最新设置，过滤掉不需要在UI显示的字段"""
+        """从数据库加载最新设置，过滤掉不需要在UI显示的字段
+
+        結果會快取在記憶體中, 直到 save_settings / import_settings 或
+        其他連線寫入資料庫為止。
+        """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                c = conn.cursor()
+            version = self._data_version()
+            with self._cache_lock:
+                if self._settings_cache_version == version:
+                    return self._copy_settings(self._settings_cache)
 
-                # 获取最新的 measure 记录
-                c.execute("""
-                                SELECT id, sample_name, position_name, group_name, operator, slide_id, sample_number
-                                FROM measures 
-                                ORDER BY id DESC LIMIT 1
-                            """)
-
-                measure_row = c.fetchone()
-                if not measure_row:
-                    return None
-
-                measure_id, sample_name, position_name, group_name, operator, slide_id, sample_number = measure_row
-
-                # 构建基本设置
-                settings = {
-                    "sample_name": sample_name,
-                    "position_name": position_name,
-                    "group_name": group_name,
-                    "operator": operator,
-                    "slide_id": slide_id,  # 完整ID
-                    "sample_number": sample_number,  # 試片編號
-                    "measurement_fields": []
-                }
-
-                # 获取所有 measured_data
-                c.execute("""
-                    SELECT id, data_name, identity_path 
-                    FROM measured_data
-                    WHERE measure_id = ?
-                """, (measure_id,))
+            settings = self._query_current_settings()
+            with self._cache_lock:
+                self._settings_cache = settings
+                self._settings_cache_version = version
+            return self._copy_settings(settings)
 
-                for data_row in c.fetchall():
-                    data_id, data_name, identity_path = data_row
+        except Exception as e:
+            print("Error loading settings: %s", str(e))
+            return None
 
-                    # 获取该 measured_data 的所有 attributes
-                    c.execute("""
-                        SELECT attribute_name, attribute_value
-                        FROM measure_attributes
-                        WHERE measured_data_id = ?
-                    """, (data_id,))
-
-                    # 添加量测字段
-                    field = {
-                        "name": data_name,
-                        "path": identity_path
-                    }
-                    settings["measurement_fields"].append(field)
+    def _query_current_settings(self):
+        """讀取本 station 的目前設置"""
+        with get_connection(self.db_path) as conn:
+            row = conn.execute("""
+                SELECT sample_name, position_name, group_name, operator,
+                       slide_id, sample_number, measurement_fields, attributes
+                FROM current_settings WHERE station = ?
+            """, (self.station,)).fetchone()
 
-                    # 添加 attributes 到设置中
-                    # 过滤掉不需要显示的字段
-                    for attr_name, attr_value in c.fetchall():
-                        if attr_name not in ['appx_filename','slide_id']:  # 在这里过滤掉不需要显示的字段
-                            settings[attr_name] = attr_value
+        if row is None:
+            return None
 
-                return settings
+        # 构建基本设置
+        settings = {
+            "sample_name": row[0],
+            "position_name": row[1],
+            "group_name": row[2],
+            "operator": row[3],
+            "slide_id": row[4],  # 完整ID
+            "sample_number": row[5],  # 試片編號
+            "measurement_fields": json.loads(row[6])
+        }
 
-        except Exception as e:
-            print("Error loading settings: %s", str(e))
+        # 添加 attributes 到设置中
+        # 过滤掉不需要显示的字段
+        for attr_name, attr_value in json.loads(row[7]).items():
+            if attr_name not in ['appx_filename', 'slide_id']:
+                settings[attr_name] = attr_value
+
+        return settings
+
+    def _query_settings_snapshot(self, conn, measure_id):
+        """讀取舊版資料庫中一筆設置快照 measure (供 migrate_settings 使用)"""
+        rows = conn.execute("""
+            SELECT m.id, m.sample_name, m.position_name, m.group_name,
+                   m.operator, m.appx_filename, m.slide_id, m.sample_number,
+                   d.id, d.data_name, d.identity_path,
+                   a.attribute_name, a.attribute_value
+            FROM measures m
+            LEFT JOIN measured_data d ON d.measure_id = m.id
+            LEFT JOIN measure_attributes a ON a.measured_data_id = d.id
+            WHERE m.id = ?
+            ORDER BY d.id, a.id
+        """, (measure_id,)).fetchall()
+        if not rows:
             return None
 
+        fields = []
+        attributes = {}
+        last_data_id = None
+        for row in rows:
+            data_id, data_name, identity_path, attr_name, attr_value = row[8:]
+            if data_id is None:
+                continue
+            if data_id != last_data_id:
+                fields.append({"name": data_name, "path": identity_path})
+                last_data_id = data_id
+            if attr_name is not None:
+                attributes[attr_name] = attr_value
+        return rows[0][:8], fields, attributes
+
+    def migrate_settings(self):
+        """把舊版存在 measures 的設置快照搬到 current_settings 並刪除
+
+        舊版每次保存設置都在 measures 新增一列, measured_data 的值都是 0.0,
+        並不是量測歷史。最新的快照成為本 station 的目前設置 (沿用其 id, 原本以
+        measure_id 保存的 PS 重複模式可以繼續使用; 已有目前設置時保留), 所有
+        快照連同 measured_data / measure_attributes 一併刪除, 不會再出現在歷史、
+        匯出與封存中。有非 0 量測值的 measure 不視為快照。
+        完成後把 PRAGMA user_version 設為 SCHEMA_VERSION, 之後不再執行。
+        """
+        try:
+            with get_connection(self.db_path) as conn:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version >= self.SCHEMA_VERSION:
+                    return False
+                c = conn.cursor()
+                if not conn.in_transaction:
+                    c.execute("BEGIN IMMEDIATE")
+                c.execute("SELECT MAX(id) FROM measures WHERE id IN (%s)"
+                          % self._SNAPSHOT_IDS)
+                latest_id = c.fetchone()[0]
+                snapshot = None if latest_id is None else \
+                    self._query_settings_snapshot(conn, latest_id)
+                if snapshot is not None:
+                    measure, fields, attributes = snapshot
+                    c.execute("""
+                        INSERT OR IGNORE INTO current_settings
+                        (id, station, sample_name, position_name, group_name, operator,
+                         appx_filename, slide_id, sample_number,
+                         measurement_fields, attributes)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (measure[0], self.station) + tuple(measure[1:]) + (
+                        json.dumps(fields, ensure_ascii=False),
+                        json.dumps(attributes, ensure_ascii=False)))
+                    # 子表先刪; 快照的判斷不受 measured_data 刪除影響
+                    c.execute("""
+                        DELETE FROM measure_attributes WHERE measured_data_id IN
+                            (SELECT id FROM measured_data WHERE measure_id IN (%s))
+                    """ % self._SNAPSHOT_IDS)
+                    c.execute("DELETE FROM measured_data WHERE measure_id IN (%s)"
+                              % self._SNAPSHOT_IDS)
+                    c.execute("DELETE FROM measures WHERE id IN (%s)"
+                              % self._SNAPSHOT_IDS)
+                    removed = c.rowcount
+                c.execute("PRAGMA user_version = %d" % self.SCHEMA_VERSION)
+            if snapshot is None:
+                return False
+            print("Migrated settings of measure {0} to current_settings, "
+                  "removed {1} settings snapshots".format(measure[0], removed))
+            return True
+        except Exception as e:
+            print("Error migrating settings: {0}".format(str(e)))
+            return False
+
     # 在 settings_manager.py 中修改 import_settings 方法:
     def import_settings(self, file_path):
         """导入设置"""
@@ -253,7 +389,7 @@ class SettingsManager(object):
                 if key not in excluded_fields:
                     params[key] = value
 
-            # 調用 save_settings
+            # 調用 save_settings (會清除設置快取)
             return self.save_settings(
                 settings.get("sample_name", ""),
                 settings.get("position_name", ""),
@@ -269,59 +405,106 @@ class SettingsManager(object):
             print("Error importing settings: {0}".format(str(e)))
             return False
 
+    def _write(self, func):
+        """在交易中執行寫入 func(conn) 並回傳其結果
+
+        啟用 group commit 時交給寫入執行緒 (synchronous=FULL), 與其他執行緒
+        同時送來的寫入合併 commit。
+        """
+        if self._writer is not None:
+            return self._writer.submit(func).result()
+        with get_connection(self.db_path) as conn:
+            return func(conn)
+
     def save_settings(self, sample_name, position_name, group_name, operator,
                       appx_filename, slide_id, sample_number, params):
-        """保存设置到数据库"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                c = conn.cursor()
-
-                # 插入 Measure
+        """保存设置到数据库 (原地更新本 station 的目前設置)"""
+        measurement_fields = [
+            {"name": field["name"], "path": field["path"]}
+            for field in params.get("measurement_fields", [])
+        ]
+        # 只保存 SOP 參數, 與量測歷史一樣以字串保存; 基本欄位已有獨立的列
+        excluded_fields = [
+            "sample_name", "position_name", "group_name", "operator",
+            "appx_filename", "slide_id", "sample_number", "measurement_fields"
+        ]
+        attributes = dict((name, str(value)) for name, value in params.items()
+                          if name not in excluded_fields)
+        values = (
+            sample_name,
+            position_name,
+            group_name,
+            operator,
+            appx_filename,
+            slide_id,
+            sample_number,
+            json.dumps(measurement_fields, ensure_ascii=False),
+            json.dumps(attributes, ensure_ascii=False)
+        )
+
+        def write(conn):
+            c = conn.cursor()
+            if not conn.in_transaction:
+                c.execute("BEGIN IMMEDIATE")
+            c.execute("""
+                UPDATE current_settings
+                SET sample_name = ?, position_name = ?, group_name = ?,
+                    operator = ?, appx_filename = ?, slide_id = ?,
+                    sample_number = ?, measurement_fields = ?, attributes = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE station = ?
+            """, values + (self.station,))
+
+            if c.rowcount == 0:
+                # 新 id 避開舊 measure_id, 以免讀到其他設置的 PS 重複模式
                 c.execute("""
-                    INSERT INTO measures 
-                    (sample_name, position_name, group_name, operator, 
-                     appx_filename, slide_id, sample_number)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    sample_name,
-                    position_name,
-                    group_name,
-                    operator,
-                    appx_filename,
-                    slide_id,
-                    sample_number
-                ))
-
-                measure_id = c.lastrowid
-
-                # 插入 MeasuredData
-                for field in params.get("measurement_fields", []):
-                    c.execute("""
-                        INSERT INTO measured_data
-                        (measure_id, data_name, data_value, identity_path)
-                        VALUES (?, ?, ?, ?)
-                    """, (measure_id, field["name"], 0.0, field["path"]))
-
-                    measured_data_id = c.lastrowid
-
-                    # 只插入 SOP 參數
-                    for attr_name, attr_value in params.items():
-                        if attr_name != "measurement_fields":  # 移除過濾條件,只要不是measurement_fields都保存
-                            c.execute("""
-                                INSERT INTO measure_attributes
-                                (measured_data_id, attribute_name, attribute_value)
-                                VALUES (?, ?, ?)
-                            """, (measured_data_id, attr_name, str(attr_value)))
+                    SELECT MAX(COALESCE((SELECT MAX(id) FROM current_settings), 0),
+                               COALESCE((SELECT MAX(id) FROM measures), 0),
+                               COALESCE((SELECT MAX(measure_id) FROM ps_patterns), 0)) + 1
+                """)
+                settings_id = c.fetchone()[0]
+                c.execute("""
+                    INSERT INTO current_settings
+                    (id, station, sample_name, position_name, group_name, operator,
+                     appx_filename, slide_id, sample_number,
+                     measurement_fields, attributes)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, (settings_id, self.station) + values)
 
-                conn.commit()
-                return True
+        try:
+            self._write(write)
+            self.invalidate_settings_cache()
+            return True
 
         except Exception as e:
             print("Error saving settings:", str(e))
-            if 'conn' in locals():
-                conn.rollback()
             return False
 
+    def save_measurement(self, base_data, appx_filename, measurements, measurement_fields):
+        """把一次量測結果寫入歷史表 measures / measured_data / measure_attributes"""
+        paths = dict((field["name"], field["path"]) for field in measurement_fields)
+        try:
+            measure = (
+                base_data["sample_name"],
+                base_data["position_name"],
+                base_data["group_name"],
+                base_data["operator"],
+                appx_filename,
+                base_data["slide_id"],
+                base_data["sample_number"]
+            )
+            measured_data = [
+                (measurement["field_name"], float(measurement["value"]),
+                 paths.get(measurement["field_name"], ""), measurement.get("attributes", {}))
+                for measurement in measurements
+            ]
+            return self._write(
+                lambda conn: DatabaseManager.insert_measure(conn, measure, measured_data))
+
+        except Exception as e:
+            print("Error saving measurement:", str(e))
+            return None
+
     def export_settings(self, file_path):
         settings = {
             "sample_name": self.sample_name.get().strip(),
@@ -366,7 +549,7 @@ class SettingsManager(object):
                 'current_dom_index': patterns['current_dom_index']
             }
 
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 c = conn.cursor()
 
                 # 将patterns字典的内容转换为JSON字符串
@@ -395,7 +578,7 @@ class SettingsManager(object):
     def get_ps_patterns(self, measure_id):
         """获取PS重复模式设置"""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with get_connection(self.db_path) as conn:
                 c = conn.cursor()
 
                 c.execute("""
@@ -420,8 +603,20 @@ class SettingsManager(object):
             print(f"Error getting PS patterns: {str(e)}")
             return None
 
+    def get_current_settings_id(self):
+        """目前設置的 id, PS 重複模式以此 id 保存"""
+        try:
+            with get_connection(self.db_path) as conn:
+                row = conn.execute(
+                    "SELECT id FROM current_settings WHERE station = ?",
+                    (self.station,)).fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            print("Error getting current settings id:", str(e))
+            return None
+
     def get_latest_measure_id(self):
-        """获取最新的 measure_id"""
+        """获取最新的 measure_id (量測歷史)"""
         try:
             self.cursor.execute("SELECT MAX(id) FROM measures")
             result = self.cursor.fetchone()
@@ -432,9 +627,17 @@ class SettingsManager(object):
 
 
     def close(self):
-        """關閉數據庫連接"""
+        """關閉本物件自己開啟的寫入執行緒與連線"""
         try:
-            if hasattr(self, 'conn'):
-                self.conn.close()
+            if self._writer is not None:
+                self._writer.stop()
+                self._writer = None
+            if hasattr(self, 'cursor'):
+                # self.conn 是本執行緒的共用連線, outbox 等其他物件仍在使用, 不關閉
+                self.cursor.close()
+            with self._cache_lock:
+                if self._version_conn is not None:
+                    self._version_conn.close()
+                    self._version_conn = None
         except Exception as e:
             print("Error closing database: {0}".format(str(e)))
\ No newline at end of file
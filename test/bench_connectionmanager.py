@@ -0,0 +1,100 @@
+"""
+Benchmark zygo.connectionmanager.send_request against a local stub Mx server.
+
+Compares the previous transport (a new urllib request, and therefore a new TCP
+connection, per call) with the pooled keep-alive transport.
+
+Usage:
+    python test/bench_connectionmanager.py [requests] [threads]
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urllib_request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zygo import connectionmanager
+
+
+class StubMxHandler(BaseHTTPRequestHandler):
+    """Answers every POST as Mx would, with a '<Method>Result' payload."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        method = self.path.rstrip('/').split('/')[-1]
+        body = json.dumps({method + 'Result': 1.2345}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def urllib_send_request(base_url, service, method, params):
+    """The transport used before pooling: one connection per request."""
+    data = json.dumps(params).encode('utf-8')
+    headers = {'Content-Type': 'application/json',
+               'Accept': 'application/json',
+               'Content-Length': len(data)}
+    url = '/'.join((base_url, service, method))
+    req = urllib_request.Request(url, data, headers)
+    with urllib_request.urlopen(req) as resp:
+        return json.loads(resp.read().decode('utf-8'))
+
+
+def run(func, count, threads):
+    per_thread = count // threads
+
+    def worker():
+        for _ in range(per_thread):
+            func()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubMxHandler)
+    server.daemon_threads = True
+    port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    params = {'path': ('Measurement', 'Surface', 'PV'), 'units': 'MicroMeters'}
+    base_url = 'http://127.0.0.1:{0}'.format(port)
+
+    before = run(lambda: urllib_send_request(
+        base_url, 'MxService', 'GetResultNumber', params), count, threads)
+
+    connectionmanager.connect(host='127.0.0.1', port=port)
+    after = run(lambda: connectionmanager.get_send_request(
+        'MxService', 'GetResultNumber', params), count, threads)
+    connectionmanager.terminate()
+    server.shutdown()
+
+    print('requests: {0}, threads: {1}'.format(count, threads))
+    print('urllib (new connection per call): {0:8.0f} req/s'.format(before))
+    print('pooled keep-alive:                {0:8.0f} req/s'.format(after))
+    print('speedup: {0:.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark ERP upload latency against a local stub ADInterface server.
+
+Compares the previous transport (urlopen with a new connection per upload)
+with ERPAPIUtil.send_to_erp on the shared keep-alive ERPClient, and reports
+p50/p99 latency per upload.
+
+Usage:
+    python test/bench_erp_client.py [uploads] [fields] [attributes]
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import Request, urlopen
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from config import ERPConfig
+from erp_util import ERPAPIUtil
+
+RESPONSE = (b'<?xml version="1.0"?><_0:CompositeResponses>'
+            b'<_0:StandardResponse RecordID="1000123"/>'
+            b'</_0:CompositeResponses>')
+
+
+class StubADInterfaceHandler(BaseHTTPRequestHandler):
+    """Accepts composite requests and answers with a fixed RecordID."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(RESPONSE)))
+        self.end_headers()
+        self.wfile.write(RESPONSE)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def urlopen_send(data):
+    """The transport used before ERPClient: new connection, indent=2 body."""
+    data_string = json.dumps(data, indent=2).encode('utf-8')
+    req = Request(ERPConfig.API_URL)
+    req.add_header('Content-Type', 'application/json')
+    response = urlopen(req, data_string)
+    return 'RecordID=' in response.read().decode('utf-8')
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(label, func, request, count):
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func(request)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print('{0:<28} p50 {1:7.3f} ms   p99 {2:7.3f} ms'.format(
+        label, percentile(latencies, 50), percentile(latencies, 99)))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    field_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    attribute_count = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    logging.disable(logging.CRITICAL)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubADInterfaceHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    ERPConfig.API_URL = 'http://127.0.0.1:{0}/ADInterface/services/rest/' \
+                        'composite_service/composite_operation/'.format(
+                            server.server_address[1])
+
+    attributes = {'sop_param_{0:02d}'.format(i): str(i) for i in range(attribute_count)}
+    measurements = [{'field_name': 'Field{0:02d}'.format(i), 'value': 0.5,
+                     'attributes': attributes} for i in range(field_count)]
+    request = ERPAPIUtil.create_composite_request(
+        ERPAPIUtil.create_measure_operations(
+            'Sample1', '1', 'GroupA', 'OP01', 'Micro.appx', 'Sample1-1', '1',
+            measurements, compact=False))
+
+    print('{0} uploads, {1} fields x {2} attributes'.format(
+        count, field_count, attribute_count))
+    run('urlopen (before)', urlopen_send, request, count)
+    run('ERPClient keep-alive', ERPAPIUtil.send_to_erp, request, count)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
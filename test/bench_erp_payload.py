@@ -0,0 +1,68 @@
+"""
+Benchmark the size and serialization time of the ERP composite payload.
+
+Compares the previous format (one attribute copy per MeasuredData row,
+pretty-printed with indent=2) with compact serialization and with the compact
+payload mode that creates shared attributes once per Measure.
+
+Usage:
+    python test/bench_erp_payload.py [fields] [attributes]
+"""
+import json
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from erp_util import ERPAPIUtil
+
+
+def build_measurements(field_count, attribute_count):
+    attributes = {'sop_param_{0:02d}'.format(i): '{0}.5'.format(i * 10)
+                  for i in range(attribute_count)}
+    return [{'field_name': 'Field{0:02d}'.format(i),
+             'value': 0.123456 * (i + 1),
+             'attributes': dict(attributes),
+             'operator': 'OP01'}
+            for i in range(field_count)]
+
+
+def build_request(measurements, compact):
+    operations = ERPAPIUtil.create_measure_operations(
+        'Sample1', '3', 'GroupA', 'OP01', 'Micro.appx',
+        'Sample1-20250114-1', '1', measurements, compact=compact)
+    return ERPAPIUtil.create_composite_request(operations)
+
+
+def measure(label, request, dumps_kwargs, number=200):
+    body = json.dumps(request, **dumps_kwargs).encode('utf-8')
+    seconds = timeit.timeit(
+        lambda: json.dumps(request, **dumps_kwargs).encode('utf-8'),
+        number=number) / number
+    operations = len(request['CompositeRequest']['operations']['operation'])
+    print('{0:<34} {1:>6} ops {2:>9} bytes {3:>9.1f} us'.format(
+        label, operations, len(body), seconds * 1e6))
+    return len(body)
+
+
+def main():
+    field_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    attribute_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    measurements = build_measurements(field_count, attribute_count)
+    print('{0} fields x {1} attributes'.format(field_count, attribute_count))
+
+    full = build_request(measurements, compact=False)
+    deduplicated = build_request(measurements, compact=True)
+    compact_json = {'separators': (',', ':')}
+
+    before = measure('per-field attributes, indent=2', full, {'indent': 2})
+    measure('per-field attributes, compact', full, compact_json)
+    after = measure('shared attributes, compact', deduplicated, compact_json)
+    print('size reduction: {0:.1f}x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main()
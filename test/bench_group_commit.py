@@ -0,0 +1,93 @@
+"""
+Benchmark SettingsManager.save_measurement with and without group commit.
+
+Each configuration runs T writer threads that each save N measurements into a
+fresh database and reports total throughput and per-save latency:
+  * direct, synchronous=NORMAL  (default; WAL commits are not fsynced)
+  * direct, synchronous=FULL    (every commit fsyncs the WAL)
+  * group commit                (writer thread, synchronous=FULL, concurrent
+                                 saves share one commit and one fsync)
+
+Group commit only pays off against synchronous=FULL: with one thread it should
+match direct FULL, with several threads it should approach NORMAL throughput
+while keeping every acknowledged save durable.
+
+Usage:
+    python test/bench_group_commit.py [saves_per_thread] [thread_counts...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from db_connection import ConnectionManager
+from settings_manager import SettingsManager
+
+FIELDS = [{'name': 'Field{0}'.format(f), 'path': 'Results, Field{0}'.format(f)}
+          for f in range(3)]
+BASE = {'sample_name': 'S', 'position_name': '1', 'group_name': 'G',
+        'operator': 'OP01', 'slide_id': 'S-1', 'sample_number': '1'}
+MEASUREMENTS = [{'field_name': f['name'], 'value': 0.5,
+                 'attributes': dict(('sop_{0}'.format(a), str(a)) for a in range(5))}
+                for f in FIELDS]
+
+
+def run(path, thread_count, saves, group_commit):
+    manager = SettingsManager(path, group_commit=group_commit)
+    latencies = []
+    lock = threading.Lock()
+
+    def writer():
+        local = []
+        for _ in range(saves):
+            start = time.perf_counter()
+            manager.save_measurement(BASE, 'Micro.appx', MEASUREMENTS, FIELDS)
+            local.append((time.perf_counter() - start) * 1000)
+        ConnectionManager.close(path)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=writer) for _ in range(thread_count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    manager.close()
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[-1]
+
+
+def main():
+    saves = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    thread_counts = [int(n) for n in sys.argv[2:]] or [1, 4, 8]
+    configs = [('direct, synchronous=NORMAL', 'NORMAL', False),
+               ('direct, synchronous=FULL', 'FULL', False),
+               ('group commit (FULL)', 'NORMAL', True)]
+
+    workdir = tempfile.mkdtemp()
+    default_synchronous = ConnectionManager.SYNCHRONOUS
+    try:
+        for thread_count in thread_counts:
+            print('{0} thread(s) x {1} saves'.format(thread_count, saves))
+            for label, synchronous, group_commit in configs:
+                ConnectionManager.SYNCHRONOUS = synchronous
+                path = os.path.join(workdir, '{0}-{1}.db'.format(thread_count, len(os.listdir(workdir))))
+                rate, median, worst = run(path, thread_count, saves, group_commit)
+                print('  {0:<28} {1:8.0f} saves/s   median {2:7.3f} ms   max {3:8.3f} ms'.format(
+                    label, rate, median, worst))
+                ConnectionManager.close()
+    finally:
+        ConnectionManager.SYNCHRONOUS = default_synchronous
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
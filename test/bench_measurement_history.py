@@ -0,0 +1,76 @@
+"""
+Benchmark MeasurementHistory queries on a large measurements.db.
+
+Builds N measures with bench_settings_db.build_database (50 distinct samples,
+so each sample has N/50 measures), lets ConnectionManager create the history
+indexes, then times:
+  * iterating every measure of one sample (index on sample_name)
+  * a one-day created_at range
+  * a full scan with iter_measurements, oldest and newest first
+  * fetching a page deep into the history by keyset (after_id)
+
+Usage:
+    python test/bench_measurement_history.py [measures] [fields] [attributes]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from bench_settings_db import build_database
+from db_connection import ConnectionManager
+from measurement_history import MeasurementHistory
+
+
+def timed(label, func):
+    start = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - start
+    print('  {0:<36} {1:7d} measures in {2:7.3f} s  ({3:8.0f} measures/s)'.format(
+        label, count, elapsed, count / elapsed if elapsed else 0))
+
+
+def main():
+    measure_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    field_count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    attribute_count = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'history.db')
+    try:
+        build_database(path, measure_count, field_count, attribute_count)
+        # 每天 1000 筆, 讓時間範圍查詢有固定的選擇性
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE measures SET created_at = "
+                     "datetime('2024-01-01', '+' || (id * 86.4) || ' seconds')")
+        conn.commit()
+        conn.close()
+        print('{0} measures x {1} fields x {2} attributes'.format(
+            measure_count, field_count, attribute_count))
+
+        history = MeasurementHistory(path)
+        history.count()                 # 建立索引, 不計入時間
+        timed('filter sample_name',
+              lambda: sum(1 for _ in history.iter_measurements(sample_name='Sample7')))
+        timed('filter one-day created_at range',
+              lambda: sum(1 for _ in history.iter_measurements(
+                  start_time='2024-01-05 00:00:00', end_time='2024-01-06 00:00:00')))
+        timed('full scan, oldest first',
+              lambda: sum(1 for _ in history.iter_measurements()))
+        timed('full scan, newest first',
+              lambda: sum(1 for _ in history.iter_measurements(newest_first=True)))
+        timed('page at after_id = N - 500',
+              lambda: len(history.query_page(after_id=measure_count - 500)[0]))
+    finally:
+        ConnectionManager.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmark settings load/save latency on a measurements.db holding a large
+measurement history.
+
+Builds a database in the legacy layout (rollback journal, no foreign-key
+indexes) with N historical measures, then compares:
+  * the previous access pattern: sqlite3.connect per call, latest-measure
+    settings read with one query per field, settings saved as new rows
+  * the same queries on the shared per-thread WAL connection with the
+    foreign-key indexes created by ConnectionManager
+  * SettingsManager as it is now (current_settings table, shared connection),
+    plus save_measurement for the history write path
+
+Usage:
+    python test/bench_settings_db.py [measures] [fields] [attributes] [repeat]
+"""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+from db_connection import ConnectionManager, get_connection
+from settings_manager import SettingsManager
+
+SCHEMA = """
+    CREATE TABLE measures (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sample_name TEXT NOT NULL, position_name TEXT NOT NULL,
+        group_name TEXT NOT NULL, operator TEXT NOT NULL,
+        appx_filename TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        slide_id TEXT, sample_number TEXT);
+    CREATE TABLE measured_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, measure_id INTEGER,
+        data_name TEXT NOT NULL, data_value REAL NOT NULL,
+        identity_path TEXT NOT NULL);
+    CREATE TABLE measure_attributes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, measured_data_id INTEGER,
+        attribute_name TEXT NOT NULL, attribute_value TEXT NOT NULL);
+"""
+
+
+def build_database(path, measure_count, field_count, attribute_count):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    data_id = 0
+    measures, data, attributes = [], [], []
+    for measure_id in range(1, measure_count + 1):
+        measures.append((measure_id, 'Sample{0}'.format(measure_id % 50),
+                         str(measure_id % 9 + 1), 'Group{0}'.format(measure_id % 5),
+                         'OP01', 'Micro.appx', 'Slide{0}'.format(measure_id // 9), '1'))
+        for f in range(field_count):
+            data_id += 1
+            data.append((data_id, measure_id, 'Field{0}'.format(f),
+                         0.1 * f, 'Results, Field{0}'.format(f)))
+            for a in range(attribute_count):
+                attributes.append((data_id, 'sop_{0}'.format(a), str(a)))
+    conn.executemany("INSERT INTO measures (id, sample_name, position_name, group_name,"
+                     " operator, appx_filename, slide_id, sample_number)"
+                     " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", measures)
+    conn.executemany("INSERT INTO measured_data VALUES (?, ?, ?, ?, ?)", data)
+    conn.executemany("INSERT INTO measure_attributes (measured_data_id, attribute_name,"
+                     " attribute_value) VALUES (?, ?, ?)", attributes)
+    conn.commit()
+    conn.close()
+
+
+def legacy_load(connect, path):
+    with connect(path) as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, sample_name, position_name, group_name, operator,"
+                  " slide_id, sample_number FROM measures ORDER BY id DESC LIMIT 1")
+        row = c.fetchone()
+        settings = {'measurement_fields': []}
+        c.execute("SELECT id, data_name, identity_path FROM measured_data"
+                  " WHERE measure_id = ?", (row[0],))
+        for data_id, name, path_ in c.fetchall():
+            settings['measurement_fields'].append({'name': name, 'path': path_})
+            c.execute("SELECT attribute_name, attribute_value FROM measure_attributes"
+                      " WHERE measured_data_id = ?", (data_id,))
+            for attr_name, attr_value in c.fetchall():
+                settings[attr_name] = attr_value
+        return settings
+
+
+def legacy_save(connect, path, fields, attributes):
+    with connect(path) as conn:
+        c = conn.cursor()
+        c.execute("INSERT INTO measures (sample_name, position_name, group_name,"
+                  " operator, appx_filename, slide_id, sample_number)"
+                  " VALUES ('S', '1', 'G', 'OP01', 'Micro.appx', 'S-1', '1')")
+        measure_id = c.lastrowid
+        for field in fields:
+            c.execute("INSERT INTO measured_data (measure_id, data_name, data_value,"
+                      " identity_path) VALUES (?, ?, 0.0, ?)",
+                      (measure_id, field['name'], field['path']))
+            data_id = c.lastrowid
+            for name, value in attributes.items():
+                c.execute("INSERT INTO measure_attributes (measured_data_id,"
+                          " attribute_name, attribute_value) VALUES (?, ?, ?)",
+                          (data_id, name, value))
+        conn.commit()
+
+
+def timed(label, func, repeat):
+    func()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print('  {0:<34} median {1:8.3f} ms   max {2:8.3f} ms'.format(
+        label, samples[len(samples) // 2], samples[-1]))
+
+
+def main():
+    measure_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    field_count = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    attribute_count = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    repeat = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+
+    workdir = tempfile.mkdtemp()
+    template = os.path.join(workdir, 'template.db')
+    start = time.perf_counter()
+    build_database(template, measure_count, field_count, attribute_count)
+    print('{0} measures x {1} fields x {2} attributes, built in {3:.1f} s, {4:.1f} MB'.format(
+        measure_count, field_count, attribute_count, time.perf_counter() - start,
+        os.path.getsize(template) / 1e6))
+
+    fields = [{'name': 'Field{0}'.format(f), 'path': 'Results, Field{0}'.format(f)}
+              for f in range(field_count)]
+    attributes = dict(('sop_{0}'.format(a), str(a)) for a in range(attribute_count))
+    params = dict(attributes, measurement_fields=fields)
+    base_data = {'sample_name': 'S', 'position_name': '1', 'group_name': 'G',
+                 'operator': 'OP01', 'slide_id': 'S-1', 'sample_number': '1'}
+    measurements = [{'field_name': f['name'], 'value': 0.5, 'attributes': attributes}
+                    for f in fields]
+
+    try:
+        before = os.path.join(workdir, 'before.db')
+        shutil.copy(template, before)
+        print('sqlite3.connect per call, rollback journal, no indexes')
+        timed('load settings', lambda: legacy_load(sqlite3.connect, before), repeat)
+        timed('save settings', lambda: legacy_save(sqlite3.connect, before, fields,
+                                                   attributes), repeat)
+
+        shared = os.path.join(workdir, 'shared.db')
+        shutil.copy(template, shared)
+        print('shared WAL connection, foreign-key indexes')
+        timed('load settings', lambda: legacy_load(get_connection, shared), repeat)
+        timed('save settings', lambda: legacy_save(get_connection, shared, fields,
+                                                   attributes), repeat)
+
+        after = os.path.join(workdir, 'after.db')
+        shutil.copy(template, after)
+        manager = SettingsManager(after)
+        print('SettingsManager (current_settings table, shared connection)')
+        timed('load settings (cached)', manager.load_current_settings, repeat)
+        timed('load settings (uncached)', lambda: (manager.invalidate_settings_cache(),
+                                                   manager.load_current_settings()), repeat)
+        timed('save settings', lambda: manager.save_settings(
+            'S', '1', 'G', 'OP01', 'Micro.appx', 'S-1', '1', params), repeat)
+        timed('save measurement history', lambda: manager.save_measurement(
+            base_data, 'Micro.appx', measurements, fields), repeat)
+        manager.close()
+    finally:
+        ConnectionManager.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+# 需要 Mx、OCR 或畫面的手動測試腳本, 不由 pytest 收集
+collect_ignore = ['ocr_test.py', 'output_ui_test.py', 'testMeasureUI.py', 'checkNetwork.py']
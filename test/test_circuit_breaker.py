@@ -0,0 +1,104 @@
+import threading
+import time
+
+from circuit_breaker import CircuitBreaker
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def test_opens_after_consecutive_failures_only():
+    circuit = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    circuit.record_failure()
+    circuit.record_failure()
+    circuit.record_success()        # 成功會重置連續失敗次數
+    circuit.record_failure()
+    circuit.record_failure()
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert circuit.allow_request()
+
+    circuit.record_failure()
+    assert circuit.state == CircuitBreaker.OPEN
+    assert not circuit.allow_request()
+    assert not circuit.is_available()
+
+
+def test_half_open_allows_a_single_trial():
+    circuit = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    circuit.record_failure()
+    assert not circuit.allow_request()
+
+    time.sleep(0.06)
+    assert circuit.is_available()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(circuit.allow_request()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert not circuit.is_available()
+
+
+def test_failed_trial_reopens_and_successful_trial_closes():
+    circuit = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    circuit.record_failure()
+    time.sleep(0.06)
+    assert circuit.allow_request()
+    circuit.record_failure()
+    assert circuit.state == CircuitBreaker.OPEN
+    assert not circuit.allow_request()
+
+    time.sleep(0.06)
+    assert circuit.allow_request()
+    circuit.record_success()
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert circuit.allow_request() and circuit.allow_request()
+
+
+def test_probe_runs_only_while_open():
+    calls = []
+    reachable = threading.Event()
+
+    def probe():
+        calls.append(time.time())
+        return reachable.is_set()
+
+    circuit = CircuitBreaker(failure_threshold=1, reset_timeout=60,
+                             probe=probe, probe_interval=0.02)
+    time.sleep(0.1)
+    assert calls == []              # closed: 不探測
+
+    circuit.record_failure()
+    assert wait_for(lambda: len(calls) >= 2)
+    assert circuit.state == CircuitBreaker.OPEN
+
+    reachable.set()
+    assert wait_for(lambda: circuit.state == CircuitBreaker.HALF_OPEN)
+    count = len(calls)
+    time.sleep(0.1)
+    assert len(calls) == count      # half_open: probe 執行緒已結束
+
+    assert circuit.allow_request()
+    circuit.record_success()
+    time.sleep(0.1)
+    assert len(calls) == count
+
+
+def test_probe_error_counts_as_unreachable():
+    def probe():
+        raise OSError('network down')
+
+    circuit = CircuitBreaker(failure_threshold=1, reset_timeout=60,
+                             probe=probe, probe_interval=0.02)
+    circuit.record_failure()
+    time.sleep(0.1)
+    assert circuit.state == CircuitBreaker.OPEN
@@ -0,0 +1,95 @@
+import http.client
+
+import pytest
+
+from zygo import connectionmanager
+
+
+class FakeResponse(object):
+    status = 200
+    reason = 'OK'
+    will_close = False
+
+    def read(self):
+        return b'{}'
+
+
+class FakeConnection(object):
+    """取代 HTTPConnection: 依 script 決定送出或讀取回應時的錯誤"""
+
+    script = []
+    sent = []
+
+    def __init__(self, host, port, timeout=None):
+        self.sock = None
+        self.error = None
+
+    def request(self, method, path, body, headers):
+        self.error = self.script.pop(0) if self.script else None
+        if self.error == 'send':
+            raise BrokenPipeError()
+        self.sent.append(path)
+        self.sock = object()
+
+    def getresponse(self):
+        if self.error == 'read':
+            raise http.client.RemoteDisconnected('closed')
+        return FakeResponse()
+
+    def close(self):
+        self.sock = None
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(connectionmanager, '_Connection', FakeConnection)
+    FakeConnection.script = []
+    FakeConnection.sent = []
+    pool = connectionmanager._ConnectionPool('localhost', 8733)
+    pool.request('/MxService/GetMxVersion', b'', {})  # 留下一個閒置的連線
+    return pool
+
+
+def stale(*errors):
+    """閒置的 keep-alive 連線已被伺服器關閉"""
+    FakeConnection.script = list(errors)
+    FakeConnection.sent = []
+
+
+def test_unsent_request_is_retried_once(pool):
+    stale('send')
+    assert pool.request('/MxService/Measure', b'', {})[0] == 200
+    assert FakeConnection.sent == ['/MxService/Measure']
+
+    # 新連線也失敗時不再重試
+    pool.request('/MxService/GetMxVersion', b'', {})
+    stale('send', 'send')
+    with pytest.raises(BrokenPipeError):
+        pool.request('/MxService/Measure', b'', {})
+
+
+def test_sent_request_is_retried_only_if_idempotent(pool):
+    stale('read')
+    assert pool.request('/MxService/GetResultNumber', b'', {}, True)[0] == 200
+    assert FakeConnection.sent == ['/MxService/GetResultNumber'] * 2
+
+    stale('read')
+    with pytest.raises(http.client.RemoteDisconnected):
+        pool.request('/MxService/Measure', b'', {})
+    assert FakeConnection.sent == ['/MxService/Measure']
+
+
+def test_new_connection_is_not_retried(pool):
+    pool.close()
+    pool = connectionmanager._ConnectionPool('localhost', 8733)
+    stale('read')
+    with pytest.raises(http.client.RemoteDisconnected):
+        pool.request('/MxService/GetResultNumber', b'', {}, True)
+
+
+def test_stream_retries_stale_socket(pool):
+    stale('read')
+    chunks = pool.stream('/MxService/GetData', b'', {}, idempotent=True)
+    assert next(chunks) == (200, 'OK')
+    chunks.close()
+    assert len(FakeConnection.sent) == 2
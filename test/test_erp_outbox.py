@@ -0,0 +1,266 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+from config import ERPConfig
+from db_connection import ConnectionManager
+from erp_outbox import ERPOutbox
+from erp_util import ERPAPIUtil, ERPError
+
+
+def make_request(sample_name, field_count=1):
+    measurements = [{'field_name': 'Field{0}'.format(i), 'value': 0.5, 'attributes': {}}
+                    for i in range(field_count)]
+    return ERPAPIUtil.create_composite_request(ERPAPIUtil.create_measure_operations(
+        sample_name, '1', 'G1', 'OP01', 'Micro.appx', sample_name + '-1', '1',
+        measurements, compact=False))
+
+
+def sample_names(request_data):
+    """request 中各 Measure 的 SampleName, 依送出順序"""
+    names = []
+    for op in request_data['CompositeRequest']['operations']['operation']:
+        if op['ModelCRUD']['TableName'] == 'Measure':
+            fields = op['ModelCRUD']['DataRow']['field']
+            names.append([f['val'] for f in fields if f['@column'] == 'SampleName'][0])
+    return names
+
+
+class FakeERP(object):
+    """依序回傳預設結果, 記錄每次送出的 SampleName"""
+
+    def __init__(self, results=None):
+        self.results = list(results or [])
+        self.sent = []
+        self.requests = []
+
+    def __call__(self, request_data):
+        self.sent.append(sample_names(request_data))
+        self.requests.append(request_data)
+        if self.results:
+            return self.results.pop(0)
+        return True, None
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    yield str(tmp_path / 'measurements.db')
+    ConnectionManager.close()
+
+
+def rows(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT idempotency_key, status, attempts FROM erp_outbox "
+                            "ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def make_due(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE erp_outbox SET next_attempt_at = 0")
+    conn.commit()
+    conn.close()
+
+
+def transient(message='connection refused'):
+    return False, ERPError(message, ERPError.TRANSIENT)
+
+
+def test_failing_head_blocks_later_items_and_keeps_order(db_path):
+    erp = FakeERP([transient()])
+    outbox = ERPOutbox(db_path, send_func=erp, batch_size=1)
+    outbox.enqueue(make_request('A'), 'a')
+    outbox.enqueue(make_request('B'), 'b')
+
+    sent, error, _ = outbox.process_next()
+    assert sent is False and error.kind == ERPError.TRANSIENT
+    sent, _, next_attempt_at = outbox.process_next()
+    assert sent is None and next_attempt_at > time.time()
+    assert erp.sent == [['A']]
+    assert rows(db_path) == [('a', 'pending', 1), ('b', 'pending', 0)]
+
+    make_due(db_path)
+    assert outbox.drain() == (True, None)
+    assert erp.sent == [['A'], ['A'], ['B']]
+    assert rows(db_path) == [('a', 'sent', 2), ('b', 'sent', 1)]
+
+
+def test_backlog_is_merged_and_tail_beyond_limits_released(db_path, monkeypatch):
+    # 每個 request 2 個操作 (Measure + MeasuredData), 上限 4 只能合併兩筆
+    monkeypatch.setattr(ERPConfig, 'BATCH_MAX_OPERATIONS', 4)
+    erp = FakeERP()
+    outbox = ERPOutbox(db_path, send_func=erp, batch_size=3)
+    for name in 'ABC':
+        outbox.enqueue(make_request(name), name.lower())
+
+    assert outbox.process_next()[0] is True
+    assert erp.sent == [['A', 'B']]
+    assert rows(db_path) == [('a', 'sent', 1), ('b', 'sent', 1), ('c', 'pending', 0)]
+
+    assert outbox.process_next()[0] is True
+    assert erp.sent == [['A', 'B'], ['C']]
+
+
+def test_transient_batch_failure_releases_tail_without_spending_attempts(db_path):
+    erp = FakeERP([transient()])
+    outbox = ERPOutbox(db_path, send_func=erp, batch_size=3)
+    for name in 'ABC':
+        outbox.enqueue(make_request(name), name.lower())
+
+    assert outbox.process_next()[0] is False
+    assert erp.sent == [['A', 'B', 'C']]
+    assert rows(db_path) == [('a', 'pending', 1), ('b', 'pending', 0), ('c', 'pending', 0)]
+
+
+def test_rejected_batch_resends_head_alone_and_fails_it(db_path):
+    rejected = (False, ERPError('Invalid DataValue', ERPError.REJECTED))
+    erp = FakeERP([rejected, rejected])
+    outbox = ERPOutbox(db_path, send_func=erp, batch_size=3)
+    for name in 'ABC':
+        outbox.enqueue(make_request(name), name.lower())
+
+    assert outbox.process_next()[0] is False
+    assert erp.sent == [['A', 'B', 'C'], ['A']]
+    # 被拒絕的項目直接 failed, 不阻擋後續項目
+    assert rows(db_path) == [('a', 'failed', 1), ('b', 'pending', 0), ('c', 'pending', 0)]
+
+    assert outbox.process_next()[0] is True
+    assert erp.sent[-1] == ['B', 'C']
+
+
+def test_unknown_result_is_not_resent_without_idempotency_column(db_path, monkeypatch):
+    monkeypatch.setattr(ERPConfig, 'IDEMPOTENCY_COLUMN', None)
+    erp = FakeERP([(False, ERPError('timed out', ERPError.UNKNOWN))])
+    outbox = ERPOutbox(db_path, send_func=erp, batch_size=3)
+    outbox.enqueue(make_request('A'), 'a')
+    outbox.enqueue(make_request('B'), 'b')
+
+    outbox.process_next()
+    # 整批可能已寫入 ERP, 兩筆都不自動重送
+    assert rows(db_path) == [('a', 'unconfirmed', 1), ('b', 'unconfirmed', 1)]
+    assert outbox.process_next()[0] is None
+
+    assert [(item['key'], item['last_error']) for item in outbox.list_items()] == [
+        ('a', 'timed out'), ('b', 'timed out')]
+    assert outbox.requeue('a') is True
+    assert outbox.process_next()[0] is True
+    assert erp.sent == [['A', 'B'], ['A']]
+    assert [item['key'] for item in outbox.list_items()] == ['b']
+
+
+def test_unknown_result_is_retried_when_key_is_sent_to_erp(db_path, monkeypatch):
+    monkeypatch.setattr(ERPConfig, 'IDEMPOTENCY_COLUMN', 'ExternalKey')
+    erp = FakeERP([(False, ERPError('timed out', ERPError.UNKNOWN)),
+                   (False, ERPError('ERROR: duplicate key value violates unique '
+                                    'constraint "measure_externalkey"', ERPError.REJECTED))])
+    outbox = ERPOutbox(db_path, send_func=erp, batch_size=1)
+    request_data = make_request('A')
+    outbox.enqueue(request_data, 'station1-a')
+
+    assert 'ExternalKey' not in json.dumps(request_data)
+    outbox.process_next()
+    assert rows(db_path) == [('station1-a', 'pending', 1)]
+
+    make_due(db_path)
+    outbox.process_next()
+    # 重送被 unique 約束拒絕, 代表第一次已經寫入
+    assert rows(db_path) == [('station1-a', 'sent', 2)]
+    measure_fields = erp.requests[0]['CompositeRequest']['operations']['operation'][0][
+        'ModelCRUD']['DataRow']['field']
+    assert {'@column': 'ExternalKey', 'val': 'station1-a'} in measure_fields
+
+
+def test_stale_sending_item_is_reclaimed(db_path):
+    erp = FakeERP()
+    outbox = ERPOutbox(db_path, send_func=erp)
+    outbox.enqueue(make_request('A'), 'a')
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE erp_outbox SET status = 'sending', claimed_at = ?",
+                 (time.time() - ERPOutbox.STALE_CLAIM_TIME - 1,))
+    conn.commit()
+    conn.close()
+
+    assert outbox.process_next()[0] is True
+    assert rows(db_path) == [('a', 'sent', 1)]
+
+
+def test_recent_sending_item_blocks_queue(db_path):
+    erp = FakeERP()
+    outbox = ERPOutbox(db_path, send_func=erp)
+    outbox.enqueue(make_request('A'), 'a')
+    outbox.enqueue(make_request('B'), 'b')
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE erp_outbox SET status = 'sending', claimed_at = ? "
+                 "WHERE idempotency_key = 'a'", (time.time(),))
+    conn.commit()
+    conn.close()
+
+    sent, _, next_attempt_at = outbox.process_next()
+    assert sent is None and next_attempt_at is not None
+    assert erp.sent == []
+
+
+def test_send_item_only_sends_its_own_item_at_queue_head(db_path):
+    erp = FakeERP()
+    outbox = ERPOutbox(db_path, send_func=erp)
+    outbox.enqueue(make_request('A'), 'a')
+    outbox.enqueue(make_request('B'), 'b')
+
+    assert outbox.send_item('b') == (None, None)
+    assert erp.sent == []
+    assert outbox.send_item('a') == (True, None)
+    assert erp.sent == [['A']]
+    assert rows(db_path) == [('a', 'sent', 1), ('b', 'pending', 0)]
+
+
+def test_circuit_open_does_not_claim_or_spend_attempts(db_path):
+    class OpenCircuit(object):
+        def is_available(self):
+            return False
+
+    erp = FakeERP()
+    outbox = ERPOutbox(db_path, send_func=erp, circuit=OpenCircuit())
+    outbox.enqueue(make_request('A'), 'a')
+
+    assert outbox.process_next()[0] is None
+    assert outbox.send_item('a') == (None, None)
+    assert erp.sent == []
+    assert rows(db_path) == [('a', 'pending', 0)]
+
+
+def test_command_line_lists_and_requeues(db_path, monkeypatch):
+    import os
+    import subprocess
+    import sys
+
+    monkeypatch.setattr(ERPConfig, 'IDEMPOTENCY_COLUMN', None)
+    erp = FakeERP([(False, ERPError('timed out', ERPError.UNKNOWN))])
+    outbox = ERPOutbox(db_path, send_func=erp)
+    outbox.enqueue(make_request('A'), 'a')
+    outbox.process_next()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    script = os.path.join(root, 'src', 'erp_outbox.py')
+    env = dict(os.environ, PYTHONPATH=root)
+
+    def run(*args):
+        return subprocess.run([sys.executable, script] + list(args), env=env,
+                              capture_output=True, text=True, check=True).stdout
+
+    assert run('list', db_path).startswith('a\tunconfirmed\t1\t')
+    assert run('requeue', 'a', 'missing', '--db', db_path) == 'a: requeued\nmissing: not found\n'
+    assert rows(db_path) == [('a', 'pending', 1)]
+
+
+def test_unexpected_send_error_is_not_treated_as_rejected(monkeypatch):
+    class BrokenClient(object):
+        def post(self, data):
+            return 200, 'OK', None  # 無法解碼的回應
+
+    monkeypatch.setattr(ERPAPIUtil, 'get_client', staticmethod(lambda: BrokenClient()))
+    success, error = ERPAPIUtil.send_to_erp(make_request('A'))
+    assert success is False and error.kind == ERPError.UNKNOWN
@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+from config import ERPConfig
+from erp_util import ERPAPIUtil, ERPError
+
+
+def measurement(sample_name, fields=2, attributes=None):
+    attributes = {'lens': '50x', 'zoom': '1'} if attributes is None else attributes
+    return {'sample_name': sample_name, 'position_name': '1', 'group_name': 'G1',
+            'operator': 'OP01', 'slide_id': sample_name + '-1', 'sample_number': '1',
+            'measurement_data_list': [
+                {'field_name': 'F{0}'.format(i), 'value': 0.5 + i,
+                 'attributes': dict(attributes)} for i in range(fields)]}
+
+
+def sample_names(request_data):
+    names = []
+    for op in request_data['CompositeRequest']['operations']['operation']:
+        if op['ModelCRUD']['TableName'] == 'Measure':
+            fields = op['ModelCRUD']['DataRow']['field']
+            names.append([f['val'] for f in fields if f['@column'] == 'SampleName'][0])
+    return names
+
+
+class FakeERP(object):
+    """假 send_to_erp: 含 rejected 中任一 SampleName 的請求整批回滾"""
+
+    def __init__(self, rejected=(), error_kind=ERPError.REJECTED):
+        self.rejected = set(rejected)
+        self.error_kind = error_kind
+        self.sent = []
+
+    def __call__(self, request_data):
+        names = sample_names(request_data)
+        self.sent.append(names)
+        if self.rejected.intersection(names):
+            return False, ERPError('rolled back', self.error_kind)
+        return True, None
+
+
+@pytest.fixture
+def erp(monkeypatch):
+    def install(*args, **kwargs):
+        fake = FakeERP(*args, **kwargs)
+        monkeypatch.setattr(ERPAPIUtil, 'send_to_erp', staticmethod(fake))
+        return fake
+    monkeypatch.setattr(ERPAPIUtil, '_get_appx_filename', staticmethod(lambda: 'Micro.appx'))
+    return install
+
+
+def test_measurements_share_one_request(erp):
+    fake = erp()
+    results = ERPAPIUtil.upload_measurements([measurement('A'), measurement('B')])
+    assert results == [(True, None), (True, None)]
+    assert fake.sent == [['A', 'B']]
+
+
+def test_rejected_batch_reports_each_record(erp):
+    fake = erp(rejected=['B'])
+    results = ERPAPIUtil.upload_measurements(
+        [measurement('A'), measurement('B'), measurement('C')])
+    assert [success for success, _ in results] == [True, False, True]
+    assert results[1][1].kind == ERPError.REJECTED
+    # 整批回滾後逐筆重送, 找出被拒絕的那一筆
+    assert fake.sent == [['A', 'B', 'C'], ['A'], ['B'], ['C']]
+
+
+def test_unknown_batch_failure_is_not_resent(erp):
+    fake = erp(rejected=['A'], error_kind=ERPError.UNKNOWN)
+    results = ERPAPIUtil.upload_measurements([measurement('A'), measurement('B')])
+    assert [success for success, _ in results] == [False, False]
+    assert fake.sent == [['A', 'B']]
+
+
+def test_batches_respect_operation_limit(erp):
+    fake = erp()
+    # 每筆 1 Measure + 2 MeasuredData + 4 attributes = 7 個操作
+    results = ERPAPIUtil.upload_measurements(
+        [measurement(name) for name in 'ABCDE'], max_operations=15)
+    assert all(success for success, _ in results)
+    assert fake.sent == [['A', 'B'], ['C', 'D'], ['E']]
+
+
+def attribute_rows(operations):
+    """(AttributeName, AttributeValue, 父欄位, 父參照) 依操作順序"""
+    rows = []
+    for op in operations:
+        if op['ModelCRUD']['TableName'] == 'MeasureAttribute':
+            fields = [f['val'] for f in op['ModelCRUD']['DataRow']['field']]
+            parent = op['ModelCRUD']['DataRow']['field'][2]['@column']
+            rows.append((fields[0], fields[1], parent, fields[2]))
+    return rows
+
+
+def operations(m, compact):
+    return ERPAPIUtil.create_measure_operations(
+        m['sample_name'], '1', 'G1', 'OP01', 'Micro.appx', 'S-1', '1',
+        m['measurement_data_list'], compact=compact)
+
+
+def test_compact_payload_links_shared_attributes_to_measure():
+    m = measurement('A', fields=3)
+    m['measurement_data_list'][1]['attributes']['zoom'] = 2  # 只有 zoom 不一致
+    ops = operations(m, compact=True)
+    rows = attribute_rows(ops)
+    assert rows.count(('lens', '50x', 'Measure_ID', '@Measure.Measure_id')) == 1
+    assert [r for r in rows if r[0] == 'zoom'] == [
+        ('zoom', v, 'MeasuredData_ID', '@MeasuredData.MeasuredData_ID')
+        for v in ('1', '2', '1')]
+    assert len(ops) == 1 + 3 + 1 + 3
+
+    full = attribute_rows(operations(m, compact=False))
+    assert len(full) == 6 and all(r[2] == 'MeasuredData_ID' for r in full)
+
+
+def test_compact_mode_follows_config(monkeypatch):
+    m = measurement('A', fields=4)
+    monkeypatch.setattr(ERPConfig, 'COMPACT_PAYLOAD', True)
+    assert len(attribute_rows(operations(m, compact=None))) == 2
+    monkeypatch.setattr(ERPConfig, 'COMPACT_PAYLOAD', False)
+    assert len(attribute_rows(operations(m, compact=None))) == 8
+
+
+def test_request_body_is_serialized_without_whitespace(monkeypatch):
+    bodies = []
+
+    class Client(object):
+        def post(self, data):
+            bodies.append(data)
+            return 200, 'OK', b'<Result RecordID="1"/>'
+
+    monkeypatch.setattr(ERPAPIUtil, 'get_client', staticmethod(lambda: Client()))
+    request_data = ERPAPIUtil.create_composite_request(operations(measurement('A'), False))
+    assert ERPAPIUtil.send_to_erp(request_data) == (True, None)
+    assert bodies[0] == json.dumps(request_data, separators=(',', ':')).encode('utf-8')
+    assert b'\n' not in bodies[0] and b'": ' not in bodies[0]
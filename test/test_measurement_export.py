@@ -0,0 +1,115 @@
+import csv
+import glob
+import os
+import sqlite3
+
+import pytest
+
+from db_connection import ConnectionManager
+from measurement_export import MeasurementExporter
+from settings_manager import SettingsManager
+
+FIELDS = [{'name': 'PV', 'path': 'Results, PV'}, {'name': 'RMS', 'path': 'Results, RMS'}]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """9 筆量測: group G{id % 2}, id 1-4 在 2024-01-01, 其餘在 2024-01-02"""
+    path = str(tmp_path / 'measurements.db')
+    manager = SettingsManager(path)
+    for i in range(1, 10):
+        base = {'sample_name': 'S1', 'position_name': str(i),
+                'group_name': 'G{0}'.format(i % 2), 'operator': 'OP01',
+                'slide_id': 'slide-{0}'.format(i), 'sample_number': '1'}
+        fields = FIELDS if i != 9 else FIELDS[:1]
+        measurements = [{'field_name': f['name'], 'value': i + 0.25 * k,
+                         'attributes': {'lens': '50x'}} for k, f in enumerate(fields)]
+        manager.save_measurement(base, 'Micro.appx', measurements, fields)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE measures SET created_at = CASE WHEN id <= 4 "
+                 "THEN '2024-01-01 08:00:00' ELSE '2024-01-02 08:00:00' END")
+    conn.commit()
+    conn.close()
+    yield path
+    manager.close()
+    ConnectionManager.close()
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def test_csv_export_is_wide_and_partitioned(db_path, tmp_path):
+    out = str(tmp_path / 'export')
+    report = MeasurementExporter(db_path, out, fmt='csv').export()
+
+    assert report['measures'] == 9 and report['partitions'] == 4
+    relative = sorted(os.path.relpath(path, out) for path in report['files'])
+    assert relative == [os.path.join('date=2024-01-01', 'group_name=G0', 'part-00000.csv'),
+                        os.path.join('date=2024-01-01', 'group_name=G1', 'part-00000.csv'),
+                        os.path.join('date=2024-01-02', 'group_name=G0', 'part-00000.csv'),
+                        os.path.join('date=2024-01-02', 'group_name=G1', 'part-00000.csv')]
+
+    rows = read_csv(os.path.join(out, 'date=2024-01-02', 'group_name=G1', 'part-00000.csv'))
+    assert list(rows[0]) == MeasurementExporter.BASE_COLUMNS + ['PV', 'PV.lens', 'RMS',
+                                                                'RMS.lens']
+    assert [r['id'] for r in rows] == ['5', '7', '9']
+    assert rows[0]['PV'] == '5.0' and rows[0]['RMS'] == '5.25' and rows[0]['RMS.lens'] == '50x'
+    # 沒有 RMS 的量測留空
+    assert rows[2]['PV'] == '9.0' and rows[2]['RMS'] == '' and rows[2]['RMS.lens'] == ''
+
+
+def test_chunking_and_buffer_limit_split_parts(db_path, tmp_path):
+    out = str(tmp_path / 'export')
+    exporter = MeasurementExporter(db_path, out, fmt='csv', chunk_rows=2, max_buffered_rows=2)
+    report = exporter.export(group_name='G1')
+
+    assert report['measures'] == 5
+    parts = sorted(glob.glob(os.path.join(out, '*', '*', '*.csv')))
+    assert all(len(read_csv(path)) <= 2 for path in parts)
+    assert sorted(int(r['id']) for path in parts for r in read_csv(path)) == [1, 3, 5, 7, 9]
+
+
+def test_repeated_export_continues_part_numbers(db_path, tmp_path):
+    out = str(tmp_path / 'export')
+    MeasurementExporter(db_path, out, fmt='csv').export(end_time='2024-01-02')
+    MeasurementExporter(db_path, out, fmt='csv').export(end_time='2024-01-02')
+    assert sorted(os.listdir(os.path.join(out, 'date=2024-01-01', 'group_name=G0'))) == \
+        ['part-00000.csv', 'part-00001.csv']
+
+
+def test_npz_export_uses_nan_for_missing_values(db_path, tmp_path):
+    np = pytest.importorskip('numpy')
+    out = str(tmp_path / 'export')
+    MeasurementExporter(db_path, out, fmt='npz').export()
+    with np.load(os.path.join(out, 'date=2024-01-02', 'group_name=G1', 'part-00000.npz')) as data:
+        assert data['id'].tolist() == [5, 7, 9]
+        assert data['PV'].dtype == np.float64
+        assert np.isnan(data['RMS'][2])
+        assert data['RMS.lens'].tolist() == ['50x', '50x', '']
+
+
+def test_parquet_export_converts_attribute_values_to_text(db_path, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    out = str(tmp_path / 'export')
+    MeasurementExporter(db_path, out, fmt='parquet').export()
+    table = pq.read_table(os.path.join(out, 'date=2024-01-02', 'group_name=G1',
+                                       'part-00000.parquet'))
+    assert table.column('id').to_pylist() == [5, 7, 9]
+    assert table.column('RMS').to_pylist()[2] is None
+    assert table.column('RMS.lens').to_pylist() == ['50x', '50x', None]
+
+    # 數值型的屬性值 (例如 SOP 參數) 以文字寫入
+    path = str(tmp_path / 'numbers.parquet')
+    MeasurementExporter._write_parquet(
+        path, ['id', 'PV', 'PV.zoom', 'PV.lens'], {'PV'},
+        [{'id': 1, 'PV': 0.5, 'PV.zoom': 2, 'PV.lens': 50.0}, {'id': 2, 'PV': 1.5}])
+    table = pq.read_table(path)
+    assert table.column('PV.zoom').to_pylist() == ['2', None]
+    assert table.column('PV.lens').to_pylist() == ['50.0', None]
+
+
+def test_unavailable_format_is_rejected(db_path, tmp_path):
+    with pytest.raises(ValueError):
+        MeasurementExporter(db_path, str(tmp_path), fmt='xlsx')
@@ -0,0 +1,90 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from db_connection import ConnectionManager
+from measurement_history import MeasurementHistory
+from settings_manager import SettingsManager
+
+FIELDS = [{'name': 'PV', 'path': 'Results, PV'}, {'name': 'RMS', 'path': 'Results, RMS'}]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """10 筆量測: id 1-10, sample S{id % 3}, 第 n 筆在 2024-01-(n) 08:00"""
+    path = str(tmp_path / 'measurements.db')
+    manager = SettingsManager(path)
+    for i in range(1, 11):
+        base = {'sample_name': 'S{0}'.format(i % 3), 'position_name': str(i),
+                'group_name': 'G{0}'.format(i % 2), 'operator': 'OP01',
+                'slide_id': 'slide-{0}'.format(i), 'sample_number': '1'}
+        measurements = [{'field_name': f['name'], 'value': i + 0.5 * k,
+                         'attributes': {'lens': '50x'}} for k, f in enumerate(FIELDS)]
+        manager.save_measurement(base, 'Micro.appx', measurements, FIELDS)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE measures SET created_at = printf('2024-01-%02d 08:00:00', id)")
+    conn.commit()
+    conn.close()
+    yield path
+    manager.close()
+    ConnectionManager.close()
+
+
+def ids(measures):
+    return [m['id'] for m in measures]
+
+
+def test_keyset_paging_oldest_first(db_path):
+    history = MeasurementHistory(db_path)
+    page, after_id = history.query_page(limit=4)
+    assert ids(page) == [1, 2, 3, 4] and after_id == 4
+    page, after_id = history.query_page(after_id=after_id, limit=4)
+    assert ids(page) == [5, 6, 7, 8] and after_id == 8
+    page, after_id = history.query_page(after_id=after_id, limit=4)
+    assert ids(page) == [9, 10] and after_id is None
+
+
+def test_keyset_paging_newest_first(db_path):
+    history = MeasurementHistory(db_path)
+    page, after_id = history.query_page(limit=4, newest_first=True)
+    assert ids(page) == [10, 9, 8, 7] and after_id == 7
+    page, after_id = history.query_page(after_id=after_id, limit=4, newest_first=True)
+    assert ids(page) == [6, 5, 4, 3]
+    page, after_id = history.query_page(after_id=after_id, limit=4, newest_first=True)
+    assert ids(page) == [2, 1] and after_id is None
+
+
+def test_full_last_page_ends_with_an_empty_page(db_path):
+    history = MeasurementHistory(db_path)
+    page, after_id = history.query_page(limit=5, after_id=5)
+    assert ids(page) == [6, 7, 8, 9, 10] and after_id == 10
+    assert history.query_page(limit=5, after_id=after_id) == ([], None)
+    assert ids(history.iter_measurements(page_size=5)) == list(range(1, 11))
+
+
+def test_single_and_list_filters(db_path):
+    history = MeasurementHistory(db_path)
+    assert ids(history.query_page(sample_name='S1')[0]) == [1, 4, 7, 10]
+    assert ids(history.query_page(sample_name=['S0', 'S2'], group_name='G0')[0]) == [2, 6, 8]
+    assert ids(history.query_page(slide_id=('slide-3', 'slide-9'))[0]) == [3, 9]
+    assert history.count(sample_name=['S0', 'S1']) == 7
+    assert history.query_page(operator='nobody') == ([], None)
+
+
+def test_time_range_is_half_open(db_path):
+    history = MeasurementHistory(db_path)
+    page, _ = history.query_page(start_time='2024-01-03 08:00:00',
+                                 end_time=datetime(2024, 1, 6, 8, 0, 0))
+    assert ids(page) == [3, 4, 5]
+    assert history.count(start_time=datetime(2024, 1, 9)) == 2
+    assert ids(history.iter_measurements(end_time='2024-01-03', page_size=1)) == [1, 2]
+
+
+def test_page_includes_data_and_attributes(db_path):
+    measure = MeasurementHistory(db_path).query_page(slide_id='slide-4')[0][0]
+    assert measure['sample_name'] == 'S1' and measure['created_at'] == '2024-01-04 08:00:00'
+    assert measure['data'] == [
+        {'name': 'PV', 'value': 4.0, 'path': 'Results, PV', 'attributes': {'lens': '50x'}},
+        {'name': 'RMS', 'value': 4.5, 'path': 'Results, RMS', 'attributes': {'lens': '50x'}},
+    ]
@@ -0,0 +1,170 @@
+import time
+
+import pytest
+
+import monitor_and_upload
+from db_connection import ConnectionManager
+from monitor_and_upload import MeasurementMonitor
+from zygo.core import ZygoError
+
+PV = ('Results', 'PV')
+RMS = ('Results', 'RMS')
+
+
+class FakeMx(object):
+    """假 zygo.mx: 記錄請求次數, 信號與量測值可由測試改變"""
+
+    def __init__(self):
+        self.signal = ('a.datx',)
+        self.values = {PV: '1.0', RMS: '2.0'}
+        self.bad_paths = set()
+        self.fail_bulk = False
+        self.requests = []
+
+    def get_bulk_attribute_values(self, paths_and_units):
+        self.requests.append('signal')
+        if self.fail_bulk or any(p in self.bad_paths for p, _ in paths_and_units):
+            raise ZygoError('Invalid path')
+        return list(self.signal)[:len(paths_and_units)]
+
+    def get_attribute_string(self, path):
+        self.requests.append('probe')
+        if path in self.bad_paths or self.fail_bulk:
+            raise ZygoError('Invalid path')
+        return self.signal[0]
+
+    def get_bulk_result_values(self, paths_and_units):
+        self.requests.append('results')
+        if self.fail_bulk:
+            raise ZygoError('Bulk read failed')
+        return [self.values[path] for path, _ in paths_and_units]
+
+    def get_result_number(self, path, unit=None):
+        self.requests.append('result')
+        value = self.values[path]
+        return value if isinstance(value, float) else float(value)
+
+
+@pytest.fixture
+def fake(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    fake = FakeMx()
+    for name in ('get_bulk_attribute_values', 'get_attribute_string',
+                 'get_bulk_result_values', 'get_result_number'):
+        monkeypatch.setattr(monitor_and_upload.mx, name, getattr(fake, name))
+    now = [1000.0]
+    fake.advance = lambda seconds: now.__setitem__(0, now[0] + seconds)
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    yield fake
+    ConnectionManager.close()
+
+
+@pytest.fixture
+def monitor(fake):
+    monitor = MeasurementMonitor(change_signal_paths=[('System', 'Load', 'Data Filename')])
+    yield monitor
+    monitor.settings_manager.close()
+
+
+def idle_cycles(monitor, fake, count):
+    """閒置的輪詢: 每輪間隔 MAX_POLL_INTERVAL, 回傳期間送出的請求"""
+    fake.requests = []
+    reads = 0
+    for _ in range(count):
+        fake.advance(monitor.MAX_POLL_INTERVAL)
+        if monitor._should_read_results():
+            reads += 1
+            fake.requests.append('results')
+    return reads
+
+
+def test_signal_is_the_only_idle_cost_once_verified(monitor, fake):
+    assert monitor._should_read_results() and monitor._read_reason == 'initial'
+    # 確認前維持每 5 秒強制讀取
+    assert idle_cycles(monitor, fake, 4) == 4
+    assert monitor._read_reason == 'forced'
+
+    fake.signal = ('b.datx',)
+    fake.advance(1)
+    assert monitor._should_read_results() and monitor._read_reason == 'signal'
+    monitor._check_change_signal()  # 讀到新量測
+    assert monitor._signal_verified
+
+    fake.advance(monitor.SIGNAL_SETTLE_TIME)
+    assert idle_cycles(monitor, fake, 4) == 0
+    assert fake.requests == ['signal'] * 4
+
+
+def test_missed_measurement_disables_signal(monitor, fake):
+    monitor._should_read_results()
+    fake.advance(monitor.SIGNAL_SETTLE_TIME)
+    assert monitor._should_read_results() and monitor._read_reason == 'forced'
+    monitor._check_change_signal()  # 信號沒變卻有新量測
+
+    assert monitor.change_signal_paths == []
+    assert idle_cycles(monitor, fake, 3) == 3
+    assert fake.requests == ['results'] * 3  # 不再讀取信號
+
+
+def test_invalid_path_is_probed_once_and_dropped(fake):
+    fake.bad_paths.add(RMS)
+    monitor = MeasurementMonitor(change_signal_paths=[PV, RMS])
+    try:
+        assert monitor._read_change_signal() is None
+        assert monitor.change_signal_paths == [PV]
+        assert monitor._read_change_signal() == ('a.datx',)
+    finally:
+        monitor.settings_manager.close()
+
+
+def test_repeated_signal_failures_disable_signal(monitor, fake):
+    fake.fail_bulk = True
+    for _ in range(monitor.SIGNAL_MAX_FAILURES):
+        assert monitor._read_change_signal() is None
+    # 只在第一次失敗時逐一檢查路徑
+    assert fake.requests.count('probe') == 1
+    assert monitor.change_signal_paths == []
+    fake.requests = []
+    assert monitor._read_change_signal() is None and fake.requests == []
+
+
+FIELDS = [('PV', PV), ('RMS', RMS)]
+
+
+@pytest.mark.parametrize('bulk', [True, False])
+def test_bulk_and_single_reads_drop_the_same_invalid_values(monitor, fake, bulk):
+    fake.fail_bulk = not bulk
+    fake.values = {PV: 'nan', RMS: '0.25'}
+    assert monitor._read_field_values(FIELDS) == {'RMS': 0.25}
+    fake.values = {PV: float('nan'), RMS: 'No Data'}
+    assert monitor._read_field_values(FIELDS) == {}
+    fake.values = {PV: float('inf'), RMS: 1}
+    assert monitor._read_field_values(FIELDS) == {'RMS': 1.0}
+
+
+def test_fields_are_read_in_one_request(monitor, fake):
+    fake.requests = []
+    assert monitor._read_field_values(FIELDS) == {'PV': 1.0, 'RMS': 2.0}
+    assert fake.requests == ['results']
+
+    fake.fail_bulk = True
+    fake.requests = []
+    monitor._read_field_values(FIELDS)
+    assert fake.requests == ['results', 'result', 'result']
+
+
+def test_measurement_data_needs_every_field_and_a_change(monitor, fake):
+    settings = {'sample_name': 'S1', 'group_name': 'G1', 'position_name': '1',
+                'operator': 'OP01', 'lens': '50x',
+                'measurement_fields': [{'name': 'PV', 'path': 'Results, PV'},
+                                       {'name': 'RMS', 'path': '"Results", RMS'}]}
+    base, measurements = monitor.get_measurement_data(settings)
+    assert [(m['field_name'], m['value']) for m in measurements] == [('PV', 1.0), ('RMS', 2.0)]
+    assert measurements[0]['attributes'] == {'lens': '50x'}
+    assert base['sample_name'] == 'S1'
+    assert monitor.get_measurement_data(settings) is None  # 值沒有改變
+
+    fake.values[PV] = 'No Data'
+    assert monitor.get_measurement_data(settings) is None  # 缺少欄位
+    fake.values[PV] = '1.5'
+    assert monitor.get_measurement_data(settings) is not None
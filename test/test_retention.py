@@ -0,0 +1,114 @@
+import os
+import sqlite3
+
+import pytest
+
+from db_connection import ConnectionManager
+from retention import RetentionJob
+from settings_manager import SettingsManager
+
+BASE = {'sample_name': 'S1', 'position_name': '1', 'group_name': 'G1',
+        'operator': 'OP01', 'slide_id': 'S1-1', 'sample_number': '1'}
+FIELDS = [{'name': 'PV', 'path': 'Results, PV'}, {'name': 'RMS', 'path': 'Results, RMS'}]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'measurements.db')
+    manager = SettingsManager(path)
+    measurements = [{'field_name': f['name'], 'value': 0.5 + i,
+                     'attributes': {'temp': '20', 'lens': '50x'}}
+                    for i, f in enumerate(FIELDS)]
+    for _ in range(12):
+        manager.save_measurement(BASE, 'Micro.appx', measurements, FIELDS)
+    conn = sqlite3.connect(path)
+    # 前 5 筆在 2020-01, 接著 3 筆在 2020-02, 其餘是新的
+    conn.execute("UPDATE measures SET created_at = '2020-01-15 08:00:00' WHERE id <= 5")
+    conn.execute("UPDATE measures SET created_at = '2020-02-03 08:00:00' "
+                 "WHERE id > 5 AND id <= 8")
+    conn.commit()
+    conn.close()
+    yield path
+    manager.close()
+    ConnectionManager.close()
+
+
+def count(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_archives_deletes_and_reads_back(db_path, tmp_path):
+    archive_dir = str(tmp_path / 'archive')
+    job = RetentionJob(db_path, archive_dir=archive_dir, max_age_days=30, batch_size=3)
+    job.BATCH_PAUSE = 0
+
+    report = job.run_once()
+
+    assert report['archived'] == 8
+    assert count(db_path, 'measures') == 4
+    assert count(db_path, 'measured_data') == 8
+    assert count(db_path, 'measure_attributes') == 16
+    assert sorted(os.listdir(archive_dir)) == ['measures-2020-01.jsonl.gz',
+                                               'measures-2020-02.jsonl.gz']
+
+    january = list(RetentionJob.iter_archive(
+        os.path.join(archive_dir, 'measures-2020-01.jsonl.gz')))
+    assert [m['id'] for m in january] == [1, 2, 3, 4, 5]
+    assert [d['name'] for d in january[0]['data']] == ['PV', 'RMS']
+    assert january[0]['data'][1]['value'] == 1.5
+    assert january[0]['data'][0]['attributes'] == {'temp': '20', 'lens': '50x'}
+    february = list(RetentionJob.iter_archive(
+        os.path.join(archive_dir, 'measures-2020-02.jsonl.gz')))
+    assert [m['id'] for m in february] == [6, 7, 8]
+
+
+def test_second_run_appends_to_month_archive(db_path, tmp_path):
+    archive_dir = str(tmp_path / 'archive')
+    job = RetentionJob(db_path, archive_dir=archive_dir, max_age_days=30)
+    job.BATCH_PAUSE = 0
+    job.run_once()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE measures SET created_at = '2020-01-20 08:00:00' WHERE id = 9")
+    conn.commit()
+    conn.close()
+    assert job.run_once()['archived'] == 1
+
+    january = list(RetentionJob.iter_archive(
+        os.path.join(archive_dir, 'measures-2020-01.jsonl.gz')))
+    assert [m['id'] for m in january] == [1, 2, 3, 4, 5, 9]
+
+
+def test_skips_compaction_until_incremental_vacuum_enabled(db_path, tmp_path):
+    job = RetentionJob(db_path, archive_dir=str(tmp_path / 'archive'), max_age_days=30)
+    job.BATCH_PAUSE = 0
+
+    report = job.run_once()
+    assert report['compacted'] is False
+    assert job._auto_vacuum_mode() == 0
+
+    assert job.enable_incremental_vacuum() is True
+    assert job._auto_vacuum_mode() == RetentionJob.AUTO_VACUUM_INCREMENTAL
+    assert job.run_once()['compacted'] is True
+
+
+def test_purges_only_old_sent_outbox_items(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE IF NOT EXISTS erp_outbox (id INTEGER PRIMARY KEY, "
+                 "idempotency_key TEXT, payload TEXT, status TEXT, sent_at TIMESTAMP)")
+    conn.executemany("INSERT INTO erp_outbox (idempotency_key, payload, status, sent_at) "
+                     "VALUES (?, '{}', ?, ?)",
+                     [('a', 'sent', '2020-01-01 00:00:00'),
+                      ('b', 'pending', None),
+                      ('c', 'sent', '2999-01-01 00:00:00')])
+    conn.commit()
+    conn.close()
+
+    job = RetentionJob(db_path, archive_dir=str(tmp_path / 'archive'), max_age_days=30)
+    job.BATCH_PAUSE = 0
+    assert job.run_once()['outbox_purged'] == 1
+    assert count(db_path, 'erp_outbox') == 2
@@ -0,0 +1,164 @@
+import sqlite3
+
+import pytest
+
+from db_connection import ConnectionManager
+from settings_manager import SettingsManager
+
+# 舊版 settings_manager 建立的表
+BASELINE_SCHEMA = """
+CREATE TABLE measures (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sample_name TEXT NOT NULL, position_name TEXT NOT NULL,
+    group_name TEXT NOT NULL, operator TEXT NOT NULL,
+    appx_filename TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    slide_id TEXT, sample_number TEXT);
+CREATE TABLE measured_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, measure_id INTEGER,
+    data_name TEXT NOT NULL, data_value REAL NOT NULL,
+    identity_path TEXT NOT NULL);
+CREATE TABLE measure_attributes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, measured_data_id INTEGER,
+    attribute_name TEXT NOT NULL, attribute_value TEXT NOT NULL);
+CREATE TABLE ps_patterns (
+    measure_id INTEGER PRIMARY KEY, ht_values TEXT, dom_values TEXT,
+    current_ht_index INTEGER, current_dom_index INTEGER);
+"""
+
+
+def baseline_db(path, snapshots=3):
+    """舊版每次保存設置都新增一筆 measure, 量測值固定為 0.0"""
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    for i in range(1, snapshots + 1):
+        measure_id = conn.execute(
+            "INSERT INTO measures (sample_name, position_name, group_name, operator,"
+            " appx_filename, slide_id, sample_number) VALUES (?, 'P1', 'G1', 'OP01',"
+            " 'Micro.appx', ?, '7')", ('S{0}'.format(i), 'slide-{0}'.format(i))).lastrowid
+        for name in ('PV', 'RMS'):
+            data_id = conn.execute(
+                "INSERT INTO measured_data (measure_id, data_name, data_value, identity_path)"
+                " VALUES (?, ?, 0.0, ?)", (measure_id, name, 'Results, ' + name)).lastrowid
+            conn.execute("INSERT INTO measure_attributes (measured_data_id, attribute_name,"
+                         " attribute_value) VALUES (?, 'lens', ?)", (data_id, str(i)))
+    conn.execute("INSERT INTO ps_patterns VALUES (?, '[1]', '{}', 0, 0)", (snapshots,))
+    conn.commit()
+    conn.close()
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    yield str(tmp_path / 'measurements.db')
+    ConnectionManager.close()
+
+
+def count(path, table):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM %s" % table).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_baseline_snapshots_move_to_current_settings(db_path):
+    baseline_db(db_path)
+    manager = SettingsManager(db_path)
+    try:
+        settings = manager.load_current_settings()
+        assert settings['sample_name'] == 'S3' and settings['slide_id'] == 'slide-3'
+        assert settings['measurement_fields'] == [
+            {'name': 'PV', 'path': 'Results, PV'}, {'name': 'RMS', 'path': 'Results, RMS'}]
+        assert settings['lens'] == '3'
+        # PS 重複模式沿用最新快照的 id
+        assert manager.get_current_settings_id() == 3
+        assert manager.get_ps_patterns(3)['repeat_patterns']['HT'] == [1]
+        for table in ('measures', 'measured_data', 'measure_attributes'):
+            assert count(db_path, table) == 0, table
+        assert manager.migrate_settings() is False  # 只執行一次
+    finally:
+        manager.close()
+
+
+def test_real_measurements_are_kept(db_path):
+    baseline_db(db_path, snapshots=2)
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO measures (sample_name, position_name, group_name, operator,"
+                 " appx_filename) VALUES ('S9', 'P1', 'G1', 'OP01', 'Micro.appx')")
+    conn.execute("INSERT INTO measured_data (measure_id, data_name, data_value, identity_path)"
+                 " VALUES (3, 'PV', 0.25, 'Results, PV')")
+    conn.commit()
+    conn.close()
+
+    manager = SettingsManager(db_path)
+    try:
+        assert manager.load_current_settings()['sample_name'] == 'S2'
+        assert count(db_path, 'measures') == 1
+        assert count(db_path, 'measured_data') == 1
+    finally:
+        manager.close()
+
+
+def test_new_database_is_not_migrated(db_path):
+    manager = SettingsManager(db_path)
+    try:
+        assert manager.load_current_settings() is None
+        manager.save_measurement(
+            {'sample_name': 'S1', 'position_name': 'P1', 'group_name': 'G1',
+             'operator': 'OP01', 'slide_id': 's', 'sample_number': '1'},
+            'Micro.appx', [{'field_name': 'PV', 'value': 0.0}],
+            [{'name': 'PV', 'path': 'Results, PV'}])
+        assert manager.migrate_settings() is False
+        assert count(db_path, 'measures') == 1
+    finally:
+        manager.close()
+
+
+def test_close_keeps_shared_connection_open(db_path):
+    from db_connection import get_connection
+    from erp_outbox import ERPOutbox
+
+    outbox = ERPOutbox(db_path, send_func=lambda payload: (True, None))
+    manager = SettingsManager(db_path)
+    manager.close()
+    # outbox 與其他物件共用本執行緒的連線, 關閉設置管理後仍可使用
+    outbox.enqueue({'data': []}, 'key-1')
+    assert get_connection(db_path).execute(
+        "SELECT COUNT(*) FROM erp_outbox").fetchone()[0] == 1
+
+
+def save(manager, sample_name, fields=({'name': 'PV', 'path': 'Results, PV'},), **params):
+    params['measurement_fields'] = list(fields)
+    return manager.save_settings(sample_name, '1', 'G1', 'OP01', 'Micro.appx',
+                                 sample_name + '-1', '1', params)
+
+
+def test_settings_are_cached_until_written(db_path, monkeypatch):
+    manager = SettingsManager(db_path)
+    queries = []
+    query = manager._query_current_settings
+    monkeypatch.setattr(manager, '_query_current_settings',
+                        lambda: queries.append(1) or query())
+    try:
+        assert save(manager, 'S1', lens='50x')
+        first = manager.load_current_settings()
+        assert first['sample_name'] == 'S1' and first['lens'] == '50x'
+        # 修改回傳值不影響快取
+        first['measurement_fields'][0]['name'] = 'changed'
+        assert manager.load_current_settings()['measurement_fields'][0]['name'] == 'PV'
+        assert len(queries) == 1
+
+        assert save(manager, 'S2')
+        assert manager.load_current_settings()['sample_name'] == 'S2'
+        assert len(queries) == 2
+
+        # 其他連線 (例如另一個程序) 寫入後重新查詢
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE current_settings SET sample_name = 'S3'")
+        conn.commit()
+        conn.close()
+        assert manager.load_current_settings()['sample_name'] == 'S3'
+        assert len(queries) == 3
+    finally:
+        manager.close()
+
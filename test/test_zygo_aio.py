@@ -0,0 +1,164 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from zygo import aio, connectionmanager
+from zygo import mx as sync_mx
+from zygo.aio import motion, mx
+from zygo.core import ZygoError
+from zygo.units import Units
+
+
+class FakeMx(object):
+    """以 asyncio 實作的最小 Mx WebServices: 依方法名稱回傳 handlers 的結果"""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.requests = []
+        self.connections = 0
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b''):
+                        break
+                    key, _, value = line.decode().partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                service, method = request_line.split()[1].decode().strip('/').split('/')
+                params = json.loads(body) if body else None
+                self.requests.append((method, params))
+                status, payload = await self.handlers[method](params)
+                if isinstance(payload, bytes):
+                    data = payload
+                elif status == 200:
+                    data = json.dumps({method + 'Result': payload}).encode()
+                else:
+                    data = json.dumps(payload).encode()
+                writer.write('HTTP/1.1 {0} X\r\nContent-Length: {1}\r\n\r\n'.format(
+                    status, len(data)).encode() + data)
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+def ok(value, delay=0):
+    async def handler(params):
+        if delay:
+            await asyncio.sleep(delay)
+        return 200, value
+    return handler
+
+
+def run(handlers, scenario):
+    """連線到 FakeMx 執行 scenario(server), 結束後中斷連線"""
+    async def main():
+        server = FakeMx(dict({'Connect': ok('uid-1'), 'Terminate': ok(None)}, **handlers))
+        port = await server.start()
+        try:
+            assert await aio.connect(host='127.0.0.1', port=port) == 'uid-1'
+            return await scenario(server)
+        finally:
+            await aio.terminate()
+            await server.stop()
+    return asyncio.run(main())
+
+
+def test_function_runs_over_async_transport():
+    async def scenario(server):
+        value = await mx.get_result_number(('Analysis', 'PV'), Units.MicroMeters)
+        assert value == 1.5
+        assert server.requests[-1] == ('GetResultNumber', {
+            'path': ['Analysis', 'PV'], 'units': 'MicroMeters', 'uid': 'uid-1'})
+    run({'GetResultNumber': ok(1.5)}, scenario)
+    assert not connectionmanager._connected
+
+
+def test_replayed_requests_bypass_the_result_cache():
+    def read_two():
+        return (sync_mx.get_result_number(('Analysis', 'PV')),
+                sync_mx.get_result_number(('Analysis', 'RMS')))
+
+    async def scenario(server):
+        assert await aio.call(read_two) == (1.5, 1.5)
+        # 每次重播都依序送達 hook, 不被快取截走
+        assert [m for m, _ in server.requests].count('GetResultNumber') == 2
+
+    sync_mx.enable_result_cache(True)
+    try:
+        run({'GetResultNumber': ok(1.5)}, scenario)
+    finally:
+        sync_mx.enable_result_cache(False)
+
+
+def test_requests_overlap_on_separate_connections():
+    async def scenario(server):
+        start = time.perf_counter()
+        values = await asyncio.gather(*[
+            mx.get_result_number(('Analysis', 'PV')) for _ in range(4)])
+        elapsed = time.perf_counter() - start
+        assert values == [2.0] * 4
+        assert elapsed < 0.35           # 4 x 0.2 s 依序執行需要 0.8 s
+        # 閒置連線被重複使用
+        connections = server.connections
+        await mx.get_result_number(('Analysis', 'PV'))
+        assert server.connections == connections
+    run({'GetResultNumber': ok(2.0, delay=0.2)}, scenario)
+
+
+def test_error_response_raises_zygo_error():
+    async def fail(params):
+        return 500, {'Reason': 'Invalid path', 'DetailedInformation': 'no such result'}
+
+    async def scenario(server):
+        with pytest.raises(ZygoError) as excinfo:
+            await mx.get_result_number(('Nope',))
+        assert 'Invalid path' in str(excinfo.value)
+    run({'GetResultNumber': fail}, scenario)
+
+
+def test_async_move_returns_task_that_can_be_awaited():
+    async def scenario(server):
+        task = await motion.move_xy(1, 2, Units.MilliMeters, wait=False)
+        assert await aio.done(task) is False
+        await aio.wait(task)
+        assert task.done
+        methods = [method for method, _ in server.requests]
+        assert methods[-3:] == ['MoveAbsolute', 'IsStageTaskComplete',
+                                'WaitForStageTaskComplete']
+        # 每個請求只送出一次
+        assert methods.count('MoveAbsolute') == 1
+    run({'MoveAbsolute': ok('task-7'), 'IsStageTaskComplete': ok(False),
+         'WaitForStageTaskComplete': ok(None, delay=0.05)}, scenario)
+
+
+def test_raw_stream_response_is_returned_undecoded():
+    async def stream(params):
+        return 200, b'\x00\x01binary'
+
+    async def scenario(server):
+        data = await aio.send_request('MxService', 'GetStream', decode=False)
+        assert data == b'\x00\x01binary'
+    run({'GetStream': stream}, scenario)
+
+
+def test_sync_calls_are_unaffected_outside_call():
+    with pytest.raises(ZygoError):
+        connectionmanager.send_request('MxService', 'Anything')
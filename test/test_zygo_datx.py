@@ -0,0 +1,105 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+
+from zygo import datx  # noqa: E402
+from zygo.units import Units  # noqa: E402
+
+NO_DATA = 1.0e38
+CONVERTER = np.dtype([('Category', 'S12'), ('BaseUnit', 'S12'),
+                      ('Parameters', '<f8', (4,))])
+
+
+def surface():
+    z = np.arange(12, dtype='<f4').reshape(3, 4) * 10.0  # nm
+    z[0, 0] = NO_DATA
+    z[2, 3] = np.nan
+    return z
+
+
+def write_datx(path, legacy=False, compress=False):
+    """寫出一個最小的 .datx: 表面, 強度, converter 與 Attributes"""
+    options = {'compression': 'gzip', 'chunks': (3, 4)} if compress else {}
+    with h5py.File(path, 'w') as h5:
+        if legacy:
+            ds = h5.create_dataset('Data/Surface/{0001}', data=surface(), **options)
+            h5.create_dataset('Data/Intensity/{0002}',
+                              data=np.full((3, 4), 7, dtype='<u2'), **options)
+        else:
+            ds = h5.create_dataset('Measurement/Surface', data=surface(), **options)
+            h5.create_dataset('Measurement/Intensity',
+                              data=np.full((3, 4), 7, dtype='<u2'), **options)
+        ds.attrs['No Data'] = np.array([NO_DATA], dtype='<f8')
+        ds.attrs['Z Converter'] = np.array(
+            [(b'HeightCat', b'NanoMeters', (633e-9, 0.5, 1.0, 0.0))], dtype=CONVERTER)
+        ds.attrs['X Converter'] = np.array(
+            [(b'LateralCat', b'Meters', (0.0, 1.5e-6, 0.0, 0.0))], dtype=CONVERTER)
+        attrs = h5.create_group('Attributes/{0003}').attrs
+        attrs['Data Context.Data Attributes.Wavelength:Value'] = np.array([633e-9])
+        attrs['Data Context.Data Attributes.Wavelength:Unit'] = np.array([b'Meters'])
+        attrs['Data Context.Window'] = b'Surface'
+
+
+def check(data):
+    assert data.shape == (3, 4)
+    assert data.height_unit == 'NanoMeters'
+    assert data.lateral_resolution == pytest.approx(1.5e-6)
+    assert data.lateral_unit == 'Meters'
+    assert data.lateral_resolution_in(Units.MicroMeters) == pytest.approx(1.5)
+    assert int(data.valid.sum()) == 10
+    heights = data.heights(Units.MicroMeters)
+    assert heights.dtype == np.float32
+    assert np.isnan(heights[0, 0]) and np.isnan(heights[2, 3])
+    assert heights[1, 1] == pytest.approx(0.05)
+    assert data.intensity.dtype == np.uint16 and int(data.intensity[0, 0]) == 7
+    assert data.attributes['Data Context.Data Attributes.Wavelength:Value'] == \
+        pytest.approx(633e-9)
+    assert data.attributes['Data Context.Data Attributes.Wavelength:Unit'] == 'Meters'
+    assert data.attributes['Data Context.Window'] == 'Surface'
+
+
+def test_file_is_memory_mapped(tmp_path):
+    path = tmp_path / 'part.datx'
+    write_datx(path)
+    data = datx.load(path)
+    check(data)
+    assert isinstance(data.surface, np.memmap) and not data.surface.flags.writeable
+    assert data.heights()[1, 1] == pytest.approx(50.0)
+
+    read = datx.load(str(path), mmap=False)
+    assert not isinstance(read.surface, np.memmap)
+    check(read)
+
+
+@pytest.mark.parametrize('legacy', [False, True])
+def test_buffer_is_viewed_without_copy(tmp_path, legacy):
+    path = tmp_path / 'part.datx'
+    write_datx(path, legacy=legacy)
+    raw = path.read_bytes()
+    data = datx.load(raw)
+    check(data)
+    assert np.shares_memory(data.surface, np.frombuffer(raw, dtype=np.uint8))
+    assert np.shares_memory(data.intensity, np.frombuffer(raw, dtype=np.uint8))
+
+
+def test_compressed_datasets_are_read(tmp_path):
+    path = tmp_path / 'part.datx'
+    write_datx(path, compress=True)
+    check(datx.load(path))
+    check(datx.load(bytearray(path.read_bytes())))
+
+
+def test_missing_surface_and_units(tmp_path):
+    path = tmp_path / 'empty.datx'
+    with h5py.File(path, 'w') as h5:
+        h5.create_group('Measurement')
+    with pytest.raises(ValueError):
+        datx.load(path)
+
+    data = datx.SurfaceData(np.zeros((2, 2), np.int32), None, None,
+                            'NanoMeters', None, 'Meters', {})
+    assert data.heights().dtype == np.float64
+    assert data.lateral_resolution_in('MilliMeters') is None
+    with pytest.raises(ValueError):
+        data.heights(Units.Degrees)
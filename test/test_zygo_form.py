@@ -0,0 +1,126 @@
+import math
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from zygo import form  # noqa: E402
+
+
+def grid(size):
+    y, x = np.mgrid[:size, :size].astype(float)
+    return x, y
+
+
+def test_plane_is_removed():
+    x, y = grid(100)
+    heights = 5.0 + 0.3 * x - 0.1 * y
+    heights[10:20, 30:40] = np.nan
+    fit = form.fit_plane(heights)
+    # 正規化座標: 中心 (49.5, 49.5), 半徑為最遠像素距離
+    radius = math.hypot(49.5, 49.5)
+    assert fit.coefficients == pytest.approx((5.0 + 0.2 * 49.5, 0.3 * radius, -0.1 * radius))
+    residual = form.remove_plane(heights)
+    assert np.nanmax(np.abs(residual)) < 1e-9
+    assert np.isnan(residual[15, 35]) and fit.radius is None
+
+
+def test_sphere_radius_and_mask():
+    x, y = grid(200)
+    r2 = (x - 80.0) ** 2 + (y - 120.0) ** 2
+    heights = r2 / (2 * 4000.0) + 0.01 * x
+    fit = form.fit_sphere(heights, pixel_size=0.5)
+    assert fit.radius == pytest.approx(4000.0 * 0.25, rel=1e-6)
+    assert np.nanmax(np.abs(form.remove_sphere(heights))) < 1e-8
+
+    # 遮罩外的缺陷不影響擬合
+    damaged = heights.copy()
+    damaged[:20] += 50.0
+    mask = np.ones(heights.shape, dtype=bool)
+    mask[:20] = False
+    residual = form.remove_sphere(damaged, mask)
+    assert np.abs(residual[20:]).max() < 1e-8
+    assert residual[:20] == pytest.approx(50.0)
+
+
+def test_zernike_terms_are_fitted_on_a_circular_aperture():
+    assert [form.noll_to_nm(j) for j in (1, 2, 3, 4, 5, 6, 7, 11)] == [
+        (0, 0), (1, 1), (1, -1), (2, 0), (2, -2), (2, 2), (3, -1), (4, 0)]
+    with pytest.raises(ValueError):
+        form.noll_to_nm(0)
+
+    x, y = grid(129)
+    u, v = (x - 64) / 64, (y - 64) / 64
+    rho2 = u * u + v * v
+    heights = 1.0 + 0.5 * u + 2.0 * (2 * rho2 - 1) + 0.7 * (3 * rho2 - 2) * u
+    heights[rho2 > 1] = np.nan
+    fit = form.fit_zernike(heights, range(1, 9))
+    assert fit.coefficients == pytest.approx((1.0, 0.5, 0, 2.0, 0, 0, 0, 0.7), abs=1e-9)
+
+    coma = form.remove_zernike(heights, range(1, 5))
+    expected = 0.7 * (3 * rho2 - 2) * u
+    # 離散取樣下各項並非完全正交, 只剩少量 tilt 被 coma 吸收
+    assert np.nanmax(np.abs(coma - expected)) < 0.01
+
+
+def test_gaussian_filter_transmission():
+    x, _ = grid(512)
+    cutoff = 40.0
+    sine = np.sin(2 * np.pi * x / cutoff)
+    low = form.gaussian_filter(sine, cutoff)
+    center = low[256, 200:312]
+    # 截止波長處振幅保留 50%
+    assert np.max(np.abs(center)) == pytest.approx(0.5, abs=0.01)
+
+    long_wave = np.sin(2 * np.pi * x / (20 * cutoff))
+    low = form.gaussian_filter(long_wave, cutoff)
+    assert np.max(np.abs(low - long_wave)[:, 100:400]) < 0.01
+    high = form.gaussian_filter(long_wave, cutoff, high_pass=True)
+    assert np.allclose(high, long_wave - low)
+
+    # 以實際像素尺寸表示的截止波長
+    assert np.allclose(form.gaussian_filter(sine, cutoff * 0.5, pixel_size=0.5),
+                       form.gaussian_filter(sine, cutoff))
+    with pytest.raises(ValueError):
+        form.gaussian_filter(sine, 0)
+
+
+def test_gaussian_filter_ignores_missing_data():
+    heights = np.full((64, 64), 3.0)
+    heights[20:30, 20:30] = np.nan
+    filtered = form.gaussian_filter(heights, 16.0)
+    assert np.isnan(filtered[25, 25])
+    # 邊緣與缺值附近以有效權重正規化, 常數面維持不變
+    assert np.nanmax(np.abs(filtered - 3.0)) < 1e-9
+
+
+def test_pipeline_chains_stages():
+    datx = pytest.importorskip('zygo.datx')
+    x, y = grid(256)
+    roughness = 0.05 * np.sin(2 * np.pi * x / 8.0)
+    raw = (10.0 + 0.2 * x + ((x - 128) ** 2 + (y - 128) ** 2) / 5000.0 + roughness)
+    data = datx.SurfaceData(raw.astype(np.float32), None, None, 'NanoMeters',
+                            0.5, 'MicroMeters', {})
+    pipeline = form.Pipeline([form.RemoveSphere()]).then(
+        form.GaussianFilter(cutoff=40.0, high_pass=True))
+    result = pipeline(data)  # pixel size 取自 SurfaceData (0.5 um)
+    assert len(pipeline.stages) == 2
+    inner = (slice(64, 192),) * 2
+    assert np.abs(result[inner] - roughness[inner]).max() < 0.005
+
+    zernike = form.Pipeline([form.RemovePlane(), form.RemoveZernike([1, 4])])
+    assert np.nanstd(zernike.apply(raw - roughness)) < 0.01
+
+
+def test_1k_map_pipeline_is_fast():
+    rng = np.random.default_rng(3)
+    x, y = grid(1024)
+    heights = 0.01 * x + ((x - 512) ** 2 + (y - 512) ** 2) / 1e5 + rng.normal(size=x.shape)
+    heights[::13, ::7] = np.nan
+    pipeline = form.Pipeline([form.RemovePlane(), form.RemoveSphere(),
+                              form.GaussianFilter(cutoff=80.0, high_pass=True)])
+    pipeline(heights[:64, :64])
+    start = time.perf_counter()
+    pipeline(heights)
+    assert time.perf_counter() - start < 1.0
@@ -0,0 +1,164 @@
+import contextvars
+import json
+import threading
+
+import pytest
+
+from zygo import connectionmanager, instrument, mx
+from zygo.core import ZygoError
+from zygo.units import Units
+
+
+class FakeMx(object):
+    """取代 connection pool 的假 Mx, 記錄每個送出的 method
+
+    不使用 request hook: 設定 hook 時 (zygo.aio) 快取一律略過.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.values = {}
+        self.complete = False
+
+    def request(self, path, body, headers, idempotent=False):
+        method = path.rsplit('/', 1)[-1]
+        params = json.loads(body) if body else None
+        try:
+            result = self.handle(method, params)
+        except ZygoError as ze:
+            return 500, 'Error', json.dumps({'Reason': str(ze)}).encode()
+        return 200, 'OK', json.dumps(result).encode()
+
+    def handle(self, method, params):
+        self.calls.append(method)
+        if method == 'GetResultNumber' and params['path'] == ['Bad']:
+            raise ZygoError('Invalid path')
+        if method.startswith('Set'):
+            value = [v for k, v in params.items() if k.endswith(('Value', 'value'))][0]
+            self.values[tuple(params['path'])] = value
+            return {method + 'Result': None}
+        if method.startswith('Is') and method.endswith('Complete'):
+            return {method + 'Result': self.complete}
+        value = self.values.get(tuple(params['path']), 1.0) if params and 'path' in params else 'task'
+        return {method + 'Result': value}
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeMx()
+    monkeypatch.setattr(connectionmanager, '_pool', fake)
+    monkeypatch.setattr(connectionmanager, '_connected', True)
+    mx.enable_result_cache(True)
+    mx.clear_result_cache(reset_stats=True)
+    yield fake
+    mx.enable_result_cache(False)
+
+
+PV = ('Analysis', 'PV')
+
+
+def test_repeated_reads_are_served_from_cache(fake):
+    assert mx.get_result_number(PV, Units.MicroMeters) == 1.0
+    assert mx.get_result_number(PV, Units.MicroMeters) == 1.0
+    assert mx.get_result_number(PV, Units.NanoMeters) == 1.0  # 不同單位另存
+    assert mx.get_attribute_string(PV) == 1.0
+    assert fake.calls.count('GetResultNumber') == 2
+    stats = mx.get_result_cache_stats()
+    assert (stats.hits, stats.misses, stats.entries) == (1, 3, 3)
+
+
+@pytest.mark.parametrize('change', [
+    lambda: mx.analyze(),
+    lambda: mx.load_data('part.datx'),
+    lambda: mx.set_control_number(('Ctrl',), 2.0),
+    lambda: instrument.measure(wait=False),
+])
+def test_state_changes_invalidate(fake, change):
+    mx.get_result_number(PV)
+    change()
+    mx.get_result_number(PV)
+    assert fake.calls.count('GetResultNumber') == 2
+    assert mx.get_result_cache_stats().invalidations == 1
+
+
+def test_setter_value_is_read_back(fake):
+    assert mx.get_control_string(('Ctrl',)) == 1.0
+    mx.set_control_string(('Ctrl',), 'new')
+    assert mx.get_control_string(('Ctrl',)) == 'new'
+
+
+def test_completion_checks_invalidate_but_getters_do_not(fake):
+    mx.get_result_number(PV)
+    mx.get_result_string(PV)
+    mx.get_mx_version()
+    mx.get_result_number(PV)
+    assert fake.calls.count('GetResultNumber') == 1
+    changes = connectionmanager._changes_state
+    assert changes('IsMeasureComplete', {'IsMeasureCompleteResult': True})
+    assert not changes('IsMeasureComplete', {'IsMeasureCompleteResult': False})
+    assert not changes('IsApplicationOpen', {'IsApplicationOpenResult': True})
+    assert changes('WaitForMeasureComplete', {'WaitForMeasureCompleteResult': None})
+    assert not changes('WaitForMeasureComplete', None)  # 逾時或失敗
+    assert changes('Measure', None)
+
+
+def test_polling_keeps_cache_until_complete(fake):
+    mx.get_result_number(PV)
+    for _ in range(3):
+        assert instrument._measure_async_done('task') is False
+    mx.get_result_number(PV)
+    assert fake.calls.count('GetResultNumber') == 1
+
+    fake.complete = True
+    assert instrument._measure_async_done('task') is True
+    mx.get_result_number(PV)
+    assert fake.calls.count('GetResultNumber') == 2
+
+
+def test_value_read_across_a_state_change_is_not_cached(fake):
+    real = fake.handle
+
+    def slow_read(method, params):
+        result = real(method, params)
+        if method == 'GetResultNumber' and fake.calls.count(method) == 1:
+            # 讀取期間另一個執行緒送出 analyze
+            context = contextvars.copy_context()
+            thread = threading.Thread(target=context.run, args=(mx.analyze,))
+            thread.start()
+            thread.join()
+        return result
+
+    fake.handle = slow_read
+    mx.get_result_number(PV)
+    mx.get_result_number(PV)
+    assert fake.calls.count('GetResultNumber') == 2
+
+
+def test_errors_and_disabled_cache_are_not_cached(fake):
+    for _ in range(2):
+        with pytest.raises(ZygoError):
+            mx.get_result_number(('Bad',))
+    assert fake.calls.count('GetResultNumber') == 2
+
+    mx.enable_result_cache(False)
+    mx.get_result_bool(PV)
+    mx.get_result_bool(PV)
+    assert fake.calls.count('GetResultBool') == 2
+    assert mx.get_result_cache_stats().enabled is False
+
+
+def test_request_hook_bypasses_cache(fake):
+    replies = []
+
+    def hook(service, method, params, decode):
+        replies.append(method)
+        return {method + 'Result': 3.0}
+
+    token = connectionmanager._request_hook.set(hook)
+    try:
+        assert mx.get_result_number(PV) == 3.0
+        assert mx.get_result_number(PV) == 3.0
+    finally:
+        connectionmanager._request_hook.reset(token)
+    assert replies == ['GetResultNumber'] * 2
+    assert mx.get_result_cache_stats().entries == 0
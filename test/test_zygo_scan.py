@@ -0,0 +1,145 @@
+import pytest
+
+from zygo import instrument, motion, mx, scan
+from zygo.core import ZygoError, ZygoTask
+from zygo.scan import ScanEngine, Site
+from zygo.units import Units
+
+
+class FakeStation(object):
+    """記錄 Mx 呼叫順序的假 motion/instrument/mx"""
+
+    def __init__(self, monkeypatch, fail_measure_at=None):
+        self.events = []
+        self.position = None
+        self.measure_count = 0
+        self.fail_measure_at = fail_measure_at
+        monkeypatch.setattr(motion, 'move_absolute', self.move_absolute)
+        monkeypatch.setattr(instrument, 'measure', self.measure)
+        monkeypatch.setattr(mx, 'get_bulk_result_values', self.get_bulk_result_values)
+        monkeypatch.setattr(mx, '_get_native_image_stream', self.get_image)
+
+    def task(self, name, on_wait=None):
+        def wait(task_id, timeout):
+            self.events.append('wait ' + name)
+            if on_wait is not None:
+                on_wait()
+        return ZygoTask(name, lambda task_id: False, wait)
+
+    def move_absolute(self, axes, unit, wait=True):
+        target = (axes[motion.AxisType.x], axes[motion.AxisType.y])
+        self.events.append('move {0}'.format(target))
+        assert wait is False and unit == Units.MilliMeters
+
+        def arrive():
+            self.position = target
+        return self.task('move', arrive)
+
+    def measure(self, wait=True):
+        self.measure_count += 1
+        self.events.append('measure at {0}'.format(self.position))
+        if self.measure_count == self.fail_measure_at:
+            raise ZygoError('Acquisition failed')
+        acquisition = instrument.AcquisitionTask('m')
+        acquisition._acquire_task = self.task('acquire')
+        acquisition._measure_task = self.task('analyze')
+        return acquisition
+
+    def get_bulk_result_values(self, paths_and_units):
+        self.events.append('read results')
+        return [str(self.measure_count + 0.5) for _ in paths_and_units]
+
+    def get_image(self, control, sub_sample=1):
+        self.events.append('read image')
+        return b'png' + str(self.measure_count).encode()
+
+
+PV = ('Analysis', 'PV')
+
+
+def test_next_move_starts_before_results_are_read(monkeypatch):
+    station = FakeStation(monkeypatch)
+    engine = ScanEngine([(PV, Units.MicroMeters)], Units.MilliMeters,
+                        image_controls={'surface': object()})
+    records = list(engine.scan([Site(0, 0), Site(5, 0)]))
+
+    assert station.events == [
+        'move (0.0, 0.0)', 'wait move',
+        'measure at (0.0, 0.0)', 'wait acquire',
+        'move (5.0, 0.0)',                      # 擷取完成後立即移動
+        'wait analyze', 'read results', 'read image',
+        'wait move',
+        'measure at (5.0, 0.0)', 'wait acquire',
+        'wait analyze', 'read results', 'read image',
+    ]
+    assert [r.results for r in records] == [{PV: 1.5}, {PV: 2.5}]
+    assert [r.images for r in records] == [{'surface': b'png1'}, {'surface': b'png2'}]
+    assert all(r.error is None for r in records)
+    assert set(records[0].timings) == {'move', 'acquire', 'analyze', 'read'}
+
+
+def test_records_are_streamed_while_stage_moves(monkeypatch):
+    station = FakeStation(monkeypatch)
+    records = ScanEngine([(PV, None)]).scan([Site(0, 0), Site(1, 1), Site(2, 2)])
+
+    first = next(records)
+    assert first.index == 0 and first.results == {PV: '1.5'}
+    # 第一筆 yield 時下一個點位的移動已經送出, 但尚未量測
+    assert station.events[-3:] == ['move (1.0, 1.0)', 'wait analyze', 'read results']
+    assert station.measure_count == 1
+    assert [r.index for r in records] == [1, 2]
+
+
+def test_measure_error_is_reported_and_scan_continues(monkeypatch):
+    station = FakeStation(monkeypatch, fail_measure_at=1)
+    records = list(ScanEngine([(PV, None)]).scan([Site(0, 0), Site(1, 0)]))
+
+    assert isinstance(records[0].error, ZygoError) and records[0].results == {}
+    assert records[1].error is None
+    assert 'move (1.0, 0.0)' in station.events
+
+
+def test_non_numeric_result_reads_as_nan(monkeypatch):
+    station = FakeStation(monkeypatch)
+    RMS = ('Analysis', 'RMS')
+    monkeypatch.setattr(mx, 'get_bulk_result_values',
+                        lambda paths_and_units: ['No Data', ''])
+    records = list(ScanEngine([(PV, Units.MicroMeters), (RMS, None)]).scan([Site(0, 0)]))
+
+    assert records[0].error is None
+    assert records[0].results[PV] != records[0].results[PV]  # NaN
+    assert records[0].results[RMS] == ''
+    assert station.measure_count == 1
+
+
+def test_stage_error_ends_scan(monkeypatch):
+    FakeStation(monkeypatch)
+
+    def broken_move(axes, unit, wait=True):
+        def fail(task_id, timeout):
+            raise ZygoError('Stage fault')
+        return ZygoTask('move', lambda task_id: False, fail)
+
+    monkeypatch.setattr(motion, 'move_absolute', broken_move)
+    with pytest.raises(ZygoError):
+        list(ScanEngine([]).scan([Site(0, 0)]))
+
+
+def test_site_axes_for_second_stage():
+    axes = Site(1, 2, 3)._axes(motion.StageType.stage2)
+    assert axes == {motion.AxisType.x2: 1.0, motion.AxisType.y2: 2.0, motion.AxisType.z2: 3.0}
+    assert list(ScanEngine([]).scan([])) == []
+    assert scan.ScanRecord._fields[0] == 'index'
+
+
+def test_turret_and_zoom_only_change_between_configurations(monkeypatch):
+    station = FakeStation(monkeypatch)
+    monkeypatch.setattr(instrument, 'move_turret',
+                        lambda position: station.events.append('turret {0}'.format(position)))
+    monkeypatch.setattr(instrument, 'set_zoom',
+                        lambda zoom: station.events.append('zoom {0}'.format(zoom)))
+    sites = [Site(0, 0, turret=1, zoom=2.0), Site(1, 0, turret=1, zoom=2.0),
+             Site(2, 0, turret=2, zoom=2.0), Site(3, 0)]
+    list(ScanEngine([]).scan(sites))
+    changes = [e for e in station.events if e.startswith(('turret', 'zoom'))]
+    assert changes == ['turret 1', 'zoom 2.0', 'turret 2']
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from zygo.scan import Site
+from zygo.sitescheduler import ScheduleMethod, SiteScheduler
+
+
+def grid(columns, rows, pitch=1.0):
+    return [Site(x * pitch, y * pitch) for y in range(rows) for x in range(columns)]
+
+
+def test_travel_time_uses_slowest_axis():
+    scheduler = SiteScheduler(velocity=(10.0, 2.0, 1.0))
+    assert scheduler.travel_time(Site(0, 0), Site(10, 1)) == pytest.approx(1.0)
+    assert scheduler.travel_time(Site(0, 0), Site(1, 10)) == pytest.approx(5.0)
+    assert scheduler.travel_time((0, 0, 0), Site(0, 0, 3)) == pytest.approx(3.0)
+
+
+def test_shuffled_grid_is_scanned_in_serpentine_order():
+    sites = grid(6, 5)
+    random.Random(3).shuffle(sites)
+    schedule = SiteScheduler().schedule(sites, start=(0.0, 0.0))
+
+    assert schedule.method == ScheduleMethod.serpentine
+    # 6x5 網格: 每列 5 步 x 5 列 + 4 次換列
+    assert schedule.scheduled_time == pytest.approx(29.0)
+    assert schedule.time_saved == pytest.approx(schedule.original_time - 29.0)
+    assert sorted((s.x, s.y) for s in schedule.sites) == sorted((s.x, s.y) for s in sites)
+
+
+def test_serpentine_follows_the_fast_axis():
+    # y 軸比 x 軸快很多時, 應沿 y 方向蛇行 (由 2-opt 找到), 而不是沿 x 的列
+    sites = grid(4, 4, pitch=10.0)
+    slow_x = SiteScheduler(velocity=(1.0, 100.0)).schedule(sites, start=(0.0, 0.0))
+    row_order = SiteScheduler(velocity=(1.0, 100.0)).schedule(
+        sites, start=(0.0, 0.0), method='serpentine')
+    assert slow_x.scheduled_time < row_order.scheduled_time
+    assert slow_x.scheduled_time == pytest.approx(30.0 + 4 * 30 / 100.0)
+
+
+def test_two_opt_removes_crossings():
+    scheduler = SiteScheduler()
+    random_sites = [Site(random.Random(i).uniform(0, 100), random.Random(i + 99).uniform(0, 100))
+                    for i in range(60)]
+    greedy = scheduler._nearest_neighbor(random_sites, (0.0, 0.0))
+    improved = scheduler._two_opt(greedy, (0.0, 0.0))
+    assert scheduler.path_time(improved, (0.0, 0.0)) <= scheduler.path_time(greedy, (0.0, 0.0))
+    schedule = scheduler.schedule(random_sites, start=(0.0, 0.0), method='nearest_neighbor')
+    assert schedule.scheduled_time < schedule.original_time / 3
+
+
+def test_sites_are_grouped_by_turret_and_zoom():
+    sites = [Site(x, 0, turret=1 + x % 2, zoom=1.0) for x in range(10)]
+    scheduler = SiteScheduler(turret_change_time=5.0)
+    schedule = scheduler.schedule(sites, start=(0.0, 0.0))
+
+    turrets = [site.turret for site in schedule.sites]
+    assert turrets == [1] * 5 + [2] * 5
+    assert schedule.configuration_changes == 1
+    # 原順序每個點位都換一次 turret (10 x 5 s + 9 s 移動)
+    assert schedule.original_time == pytest.approx(59.0)
+    assert schedule.scheduled_time == pytest.approx(2 * 5.0 + 8.0 + 9.0)
+
+    ungrouped = SiteScheduler(turret_change_time=5.0, group_configurations=False)
+    assert ungrouped.schedule(sites, start=(0.0, 0.0)).configuration_changes == 1
+
+
+def test_schedule_never_worse_than_given_order():
+    sites = grid(5, 1)
+    schedule = SiteScheduler().schedule(sites, start=(0.0, 0.0))
+    assert schedule.time_saved == pytest.approx(0.0)
+    assert [s.x for s in schedule.sites] == [0, 1, 2, 3, 4]
+
+    kept = SiteScheduler().schedule(sites[::-1], method=ScheduleMethod.keep)
+    assert kept.sites == sites[::-1] and kept.method == ScheduleMethod.keep
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        SiteScheduler(velocity=(1.0, 0.0))
+    with pytest.raises(ValueError):
+        SiteScheduler().schedule([], method='fastest')
+    with pytest.raises(TypeError):
+        SiteScheduler().schedule([], method=1.5)
+    assert SiteScheduler().schedule([]).sites == []
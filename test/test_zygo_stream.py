@@ -0,0 +1,142 @@
+import io
+import json
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from zygo import connectionmanager, mx, ui
+from zygo.core import ZygoError
+
+SIZE = 50 * 1024 * 1024
+BLOCK = bytes(range(256)) * 256  # 64 KiB
+
+
+class StreamingMxHandler(BaseHTTPRequestHandler):
+    """假 Mx: 以 64 KiB 區塊送出 SIZE 位元組, 可選 chunked 編碼"""
+    protocol_version = 'HTTP/1.1'
+    chunked = False
+    size = SIZE
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        method = self.path.rstrip('/').split('/')[-1]
+        if method == 'Connect':
+            return self.reply(200, {'ConnectResult': 'uid'})
+        if method == 'Fail':
+            return self.reply(500, {'Reason': 'Invalid control'})
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        if self.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(self.size))
+        self.end_headers()
+        remaining = self.size
+        while remaining:
+            block = BLOCK[:min(remaining, len(BLOCK))]
+            if self.chunked:
+                self.wfile.write(b'%x\r\n' % len(block) + block + b'\r\n')
+            else:
+                self.wfile.write(block)
+            remaining -= len(block)
+        if self.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def reply(self, status, value):
+        body = json.dumps(value).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StreamingMxHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    connectionmanager.connect(host='127.0.0.1', port=server.server_address[1])
+    yield server
+    connectionmanager._reset_connection()
+    server.shutdown()
+    server.server_close()
+    StreamingMxHandler.chunked = False
+    StreamingMxHandler.size = SIZE
+
+
+class CountingSink(object):
+    def __init__(self):
+        self.size = 0
+        self.checksum = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self.checksum = (self.checksum + sum(chunk[:16])) % 65521
+
+
+def expected_checksum(chunk_size):
+    checksum = 0
+    for start in range(0, SIZE, chunk_size):
+        checksum = (checksum + sum(BLOCK[start % len(BLOCK):][:16])) % 65521
+    return checksum
+
+
+@pytest.mark.parametrize('chunked', [False, True])
+def test_50mb_download_stays_near_chunk_size(server, chunked):
+    StreamingMxHandler.chunked = chunked
+    control = ui.Control('Surface', 'c1', ('Surface',))
+    sink = CountingSink()
+    tracemalloc.start()
+    try:
+        assert control.save_data_into(sink, '.datx', chunk_size=64 * 1024) == SIZE
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert sink.size == SIZE
+    assert peak < 2 * 1024 * 1024
+    if not chunked:
+        assert sink.checksum == expected_checksum(64 * 1024)
+
+
+def test_chunks_and_buffers(server):
+    StreamingMxHandler.size = 300000
+    control = ui.Control('Surface', 'c1', ('Surface',))
+    chunks = list(mx._iter_native_image_stream(control, chunk_size=100000))
+    assert [len(c) for c in chunks] == [100000, 100000, 100000]
+    assert b''.join(chunks) == (BLOCK * 5)[:300000]
+
+    buffer = bytearray(400000)
+    assert mx._get_native_image_stream_into(control, memoryview(buffer)) == 300000
+    assert buffer[:300000] == (BLOCK * 5)[:300000]
+    assert control.save_data_to_stream('.datx') == bytes(buffer[:300000])
+
+    output = io.BytesIO()
+    control.save_data_into(output, '.datx')
+    assert output.getvalue() == bytes(buffer[:300000])
+
+    with pytest.raises(ZygoError):
+        control.save_data_into(bytearray(1000), '.datx')
+    with pytest.raises(TypeError):
+        mx._iter_native_image_stream(control, sub_sample=1.5)
+
+
+def test_abandoned_stream_does_not_break_the_pool(server):
+    StreamingMxHandler.size = 10 * 1024 * 1024
+    control = ui.Control('Surface', 'c1', ('Surface',))
+    chunks = control.iter_data_stream('.datx', chunk_size=4096)
+    next(chunks)
+    chunks.close()
+    assert len(control.save_data_to_stream('.datx')) == 10 * 1024 * 1024
+
+
+def test_error_response_is_raised(server):
+    with pytest.raises(ZygoError) as info:
+        list(connectionmanager.send_request_stream('MxService', 'Fail'))
+    assert 'Invalid control' in str(info.value)
+    with pytest.raises(ZygoError):
+        connectionmanager.receive_into(io.BytesIO(), 'MxService', 'Fail')
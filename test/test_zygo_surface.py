@@ -0,0 +1,81 @@
+import math
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from zygo import surface  # noqa: E402
+
+
+def sine_surface(amplitude=50.0, periods=4, size=256):
+    """整數週期的正弦面: Sq = A/sqrt(2), Sa = 2A/pi, Ssk = 0, Sku = 1.5"""
+    x = np.arange(size) * (2 * np.pi * periods / size)
+    return np.tile(amplitude * np.sin(x), (size // 2, 1))
+
+
+def reference(values):
+    """逐點的參考實作, 直接套用 ISO 25178 定義"""
+    values = [float(v) for v in values]
+    mean = math.fsum(values) / len(values)
+    d = [v - mean for v in values]
+    sq = math.sqrt(math.fsum(x * x for x in d) / len(d))
+    return {'Sa': math.fsum(abs(x) for x in d) / len(d), 'Sq': sq,
+            'Ssk': math.fsum(x ** 3 for x in d) / len(d) / sq ** 3,
+            'Sku': math.fsum(x ** 4 for x in d) / len(d) / sq ** 4,
+            'Sp': max(d), 'Sv': -min(d), 'PV': max(values) - min(values)}
+
+
+def test_sine_surface_matches_closed_form():
+    params = surface.parameters(sine_surface())
+    assert params.Sq == pytest.approx(50.0 / math.sqrt(2), rel=1e-9)
+    assert params.RMS == params.Sq
+    assert params.Sa == pytest.approx(100.0 / math.pi, rel=1e-3)
+    assert params.Ssk == pytest.approx(0.0, abs=1e-9)
+    assert params.Sku == pytest.approx(1.5, rel=1e-9)
+    assert params.PV == pytest.approx(100.0) and params.Sz == params.PV
+    assert params.points == 256 * 128
+
+
+def test_random_surface_matches_reference():
+    rng = np.random.default_rng(7)
+    heights = rng.gamma(2.0, 3.0, size=(60, 80)).astype(np.float32)
+    params = surface.parameters(heights)._asdict()
+    for name, value in reference(heights.ravel()).items():
+        assert params[name] == pytest.approx(value, rel=1e-6), name
+    assert params['Ssk'] > 0.5  # gamma 分佈右偏
+
+
+def test_invalid_pixels_are_ignored():
+    heights = sine_surface(size=64)
+    with_holes = heights.copy()
+    with_holes[::3, ::5] = np.nan
+    with_holes[1, 1] = np.inf
+    params = surface.parameters(with_holes)
+    valid = np.isfinite(with_holes)
+    assert params.points == int(valid.sum())
+    assert params.Sq == pytest.approx(reference(heights[valid])['Sq'], rel=1e-9)
+    assert all(np.isfinite(v) for v in params)
+
+
+def test_masked_regions():
+    heights = np.zeros((40, 40))
+    heights[:, 20:] = np.linspace(-1.0, 1.0, 20 * 40).reshape(40, 20)
+    left = np.zeros((40, 40), dtype=bool)
+    left[:, :20] = True
+    regions = surface.region_parameters(heights, {'left': left, 'right': ~left})
+    assert regions['left'].PV == 0.0 and math.isnan(regions['left'].Ssk)
+    assert regions['right'].PV == pytest.approx(2.0)
+    assert regions['right'] == surface.parameters(heights, ~left)
+    assert surface.region_parameters(heights, [~left])[0] == regions['right']
+
+    empty = surface.parameters(heights, np.zeros_like(left))
+    assert empty.points == 0 and math.isnan(empty.Sa)
+    with pytest.raises(ValueError):
+        surface.parameters(heights, left[:10])
+
+
+def test_surface_data_is_accepted():
+    datx = pytest.importorskip('zygo.datx')
+    raw = sine_surface(size=32).astype(np.float32)
+    data = datx.SurfaceData(raw, None, None, 'NanoMeters', 1e-6, 'Meters', {})
+    assert surface.parameters(data).Sq == pytest.approx(50.0 / math.sqrt(2), rel=1e-6)
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+from concurrent import futures
+
+import pytest
+
+from zygo import core
+from zygo.core import ZygoError, ZygoTask
+
+
+class FakeOperation(object):
+    """模擬 Mx 的非同步作業: finish() 之後 done_func 才回傳 True"""
+
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished = threading.Event()
+        self.done_calls = 0
+        self.wait_calls = 0
+
+    def finish(self):
+        self.finished.set()
+
+    def done_func(self, task_id):
+        self.done_calls += 1
+        if self.error is not None and self.finished.is_set():
+            raise self.error
+        return self.finished.is_set()
+
+    def wait_func(self, task_id, timeout):
+        self.wait_calls += 1
+        if not self.finished.wait(None if timeout is None else timeout / 1000.0):
+            raise ZygoError('timed out')
+        return self.result
+
+    def task(self, task_id='t'):
+        return ZygoTask(task_id, self.done_func, self.wait_func)
+
+
+def finish_later(operation, delay):
+    timer = threading.Timer(delay, operation.finish)
+    timer.start()
+    return timer
+
+
+def test_blocking_interface_is_unchanged():
+    operation = FakeOperation(result=42)
+    task = operation.task()
+    assert task.done is False
+    with pytest.raises(ZygoError):
+        task.wait(10)
+    operation.finish()
+    assert task.result() == 42
+    calls = operation.done_calls
+    assert task.done is True and operation.done_calls == calls  # 完成後不再詢問 Mx
+
+
+def test_future_is_completed_by_shared_waiter():
+    operation = FakeOperation(result='ok')
+    task = operation.task()
+    callbacks = []
+    task.add_done_callback(callbacks.append)
+    finish_later(operation, 0.05)
+
+    assert task.future.result(timeout=2) == 'ok'
+    assert callbacks == [task]
+    assert task.result() == 'ok'
+    assert operation.wait_calls == 1
+    # 已完成的 task 立即呼叫 callback
+    task.add_done_callback(callbacks.append)
+    assert callbacks == [task, task]
+
+
+def test_as_completed_yields_in_completion_order():
+    slow, fast = FakeOperation('slow'), FakeOperation('fast')
+    tasks = [slow.task('slow'), fast.task('fast')]
+    finish_later(fast, 0.02)
+    finish_later(slow, 0.15)
+    assert [task.result() for task in core.as_completed(tasks, timeout=2)] == ['fast', 'slow']
+
+
+def test_wait_first_completed_and_timeout():
+    move, measure = FakeOperation(), FakeOperation()
+    move_task, measure_task = move.task(), measure.task()
+    finish_later(measure, 0.03)
+    done, not_done = core.wait([move_task, measure_task], timeout=2,
+                               return_when=core.FIRST_COMPLETED)
+    assert done == {measure_task} and not_done == {move_task}
+
+    with pytest.raises(futures.TimeoutError):
+        list(core.as_completed([move_task], timeout=0.05))
+    move.finish()
+    assert core.wait([move_task], timeout=2)[0] == {move_task}
+
+
+def test_error_while_polling_fails_the_future():
+    operation = FakeOperation(error=ZygoError('connection lost'))
+    task = operation.task()
+    operation.finish()
+    with pytest.raises(ZygoError):
+        task.future.result(timeout=2)
+    with pytest.raises(ZygoError):
+        task.result()
+
+
+def test_task_is_awaitable():
+    operations = [FakeOperation(i) for i in range(3)]
+
+    async def main():
+        for i, operation in enumerate(operations):
+            finish_later(operation, 0.02 * (3 - i))
+        return await asyncio.gather(*[operation.task() for operation in operations])
+
+    assert asyncio.run(main()) == [0, 1, 2]
+
+
+def test_waiter_thread_exits_when_idle():
+    operation = FakeOperation()
+    task = operation.task()
+    operation.finish()
+    task.future.result(timeout=2)
+    deadline = time.time() + 2
+    while core._waiter._thread is not None and time.time() < deadline:
+        time.sleep(0.01)
+    assert core._waiter._thread is None
@@ -0,0 +1,97 @@
+import pytest
+
+from zygo import connectionmanager, mx, ui
+from zygo.core import ZygoError
+
+
+def control(name, uid, path):
+    return {'Name': name, 'Id': uid, 'Path': list(path)}
+
+
+class FakeMxUi(object):
+    """以 request hook 提供一個小型 Mx UI 樹: 1 tab / 1 group / 1 container"""
+
+    def __init__(self):
+        self.calls = []
+        self.plot = control('Surface Map', 'c2', ('Surface', 'Surface Map'))
+        self.tree = {
+            'GetTabs': [{'m_Item1': 'Analyze', 'm_Item2': 't1'}],
+            'GetGroupings': [{'m_Item1': 'Main', 'm_Item2': 'g1'}],
+            'GetContainers': [{'m_Item1': 'Results', 'm_Item2': 'k1',
+                               'm_Item3': 'Container'}],
+            'GetControlsFromContainer': [control('Surface', 'c1', ('Surface',))],
+        }
+        self.children = {'c1': [self.plot], 'c2': []}
+
+    def __call__(self, service, method, params, decode):
+        self.calls.append(method)
+        if method == 'GetControls':
+            value = self.children[params['controlId']]
+        elif method == 'GetControlByPath':
+            if params['path'][0] == 'Missing':
+                raise ZygoError('Control not found')
+            value = control(params['path'][-1], 'w1', params['path'])
+        else:
+            value = self.tree.get(method)
+        return {method + 'Result': value}
+
+
+@pytest.fixture
+def fake():
+    fake = FakeMxUi()
+    token = connectionmanager._request_hook.set(fake)
+    ui.get_control_tree().invalidate()
+    yield fake
+    connectionmanager._request_hook.reset(token)
+
+
+def test_tree_is_read_once(fake):
+    tree = ui.ControlTree()
+    assert [c.name for c in tree.find_controls('surface map')] == ['Surface Map']
+    requests = len(fake.calls)
+    assert requests == 6  # tabs, groups, containers, controls, 2 x GetControls
+
+    for _ in range(3):
+        assert tree.find_control('Surface').path == ('Surface',)
+        assert tree.get_control(('Surface', 'Surface Map')).name == 'Surface Map'
+        assert len(list(tree.walk())) == 5
+    assert len(fake.calls) == requests
+    assert tree.find_controls('Nothing') == ()
+    with pytest.raises(RuntimeError):
+        tree.find_control('Nothing')
+
+
+def test_path_lookup_is_lazy(fake):
+    tree = ui.get_control_tree()
+    window_control = tree.get_control(('Mask Editor', 'Mask'))
+    assert tree.get_control(['Mask Editor', 'Mask']) is window_control
+    assert fake.calls == ['GetControlByPath']
+    with pytest.raises(ZygoError):
+        tree.get_control(('Missing',))
+
+
+def test_children_are_memoized_per_node(fake):
+    tree = ui.ControlTree()
+    tab, = tree.children()
+    group, = tree.children(tab)
+    container, = tree.children(group)
+    assert tree.children(group)[0] is container
+    surface, = tree.children(container)
+    assert tree.children(surface)[0] is tree.get_control(('Surface', 'Surface Map'))
+    assert fake.calls.count('GetContainers') == 1
+
+
+def test_opening_an_application_invalidates(fake):
+    tree = ui.ControlTree()
+    tree.build()
+    mx.set_control_string(('Ctrl',), 'x')  # 一般的 set 不影響 UI 樹
+    tree.find_control('Surface')
+    assert fake.calls.count('GetTabs') == 1
+
+    fake.children['c1'] = []
+    mx.open_application('other.mxa')
+    assert tree.find_controls('Surface Map') == ()
+    assert fake.calls.count('GetTabs') == 2
+    mx.close_application()
+    tree.get_control(('Surface',))
+    assert fake.calls.count('GetTabs') == 2 and fake.calls[-1] == 'GetControlByPath'
@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+
+# ****************************************************************************
+# THIS PROGRAM IS AN UNPUBLISHED WORK FULLY PROTECTED BY THE UNITED
+# STATES COPYRIGHT LAWS AND IS CONSIDERED A TRADE SECRET BELONGING TO
+# THE COPYRIGHT HOLDER. IT IS COVERED BY THE ZYGO SOFTWARE LICENSE AGREEMENT.
+# COPYRIGHT (c) ZYGO CORPORATION.
+#
+# ****************************************************************************
+
+"""
+Asyncio support for Mx Scripting.
+
+The modules zygo.aio.mx, zygo.aio.instrument, zygo.aio.motion and zygo.aio.ui
+expose the functions of the corresponding zygo modules as coroutines. Requests
+are sent over non-blocking keep-alive HTTP connections, so stage moves, result
+reads and data downloads can overlap in one event loop without a thread per
+operation::
+
+    from zygo import aio
+    from zygo.aio import instrument, motion, mx
+
+    await aio.connect(host='localhost', port=8733)
+    move = await motion.move_xy(10, 20, Units.MilliMeters, wait=False)
+    pv, sa = await asyncio.gather(
+        mx.get_result_number(pv_path, Units.MicroMeters),
+        mx.get_result_number(sa_path, Units.NanoMeters))
+    await aio.wait(move)
+
+A connection made with zygo.connectionmanager.connect is shared; connect and
+terminate here are the coroutine equivalents. Methods and properties of
+objects returned by these functions (e.g. ui.Control) still block; run them
+with `call`, e.g. ``await aio.call(control.save_data_to_stream, '.datx')``.
+
+Each event loop uses its own connection pool.
+"""
+import asyncio as _asyncio
+import functools as _functools
+import json as _json
+import socket as _socket
+from urllib.parse import urlsplit as _urlsplit
+import weakref as _weakref
+
+from zygo import connectionmanager as _cm
+from zygo.core import ZygoError as _ZygoError
+
+# =========================================================================
+# ---Global variables
+# =========================================================================
+_pools = _weakref.WeakKeyDictionary()
+"""WeakKeyDictionary: The _AsyncConnectionPool of each event loop."""
+
+
+# =========================================================================
+# ---Transport
+# =========================================================================
+class _AsyncConnectionPool(object):
+    """Pool of persistent HTTP/1.1 connections to one Mx host.
+
+    The asyncio counterpart of connectionmanager._ConnectionPool: each
+    in-flight request uses its own connection, idle connections are kept
+    alive, and a request on a reused connection that the server has already
+    closed is retried once on a fresh connection.
+
+    Parameters
+    ----------
+    host : str
+        Host name or ip address.
+    port : int
+        Port number.
+    max_size : int, optional
+        Maximum number of idle connections to keep open.
+    """
+
+    def __init__(self, host, port, max_size=_cm._POOL_SIZE):
+        """Initialize the pool.
+
+        Parameters
+        ----------
+        host : str
+            Host name or ip address.
+        port : int
+            Port number.
+        max_size : int, optional
+            Maximum number of idle connections to keep open.
+        """
+        self.host = host
+        self.port = port
+        self._max_size = max_size
+        self._idle = []
+        self._closed = False
+
+    async def _acquire(self):
+        """Return an idle (reader, writer) pair, or open a new one."""
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await _asyncio.open_connection(self.host, self.port)
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+        return reader, writer, False
+
+    def _release(self, reader, writer):
+        """Return a connection to the pool, closing it if the pool is full."""
+        if not self._closed and len(self._idle) < self._max_size:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader, headers):
+        """Read a response body framed by the given headers."""
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    # Skip trailers up to the terminating blank line
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    return b''.join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+        if 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length']))
+        return await reader.read()
+
+    async def _exchange(self, reader, writer, path, body, headers):
+        """Send one request and read its response."""
+        lines = ['POST {0} HTTP/1.1'.format(path),
+                 'Host: {0}:{1}'.format(self.host, self.port)]
+        lines.extend('{0}: {1}'.format(k, v) for k, v in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by Mx host')
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n')
+                                   .split(' ', 2) + [''])[:3]
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            response_headers[key.strip().lower()] = value.strip()
+        data = await self._read_body(reader, response_headers)
+        connection = response_headers.get('connection', '').lower()
+        will_close = connection == 'close' or \
+            (version == 'HTTP/1.0' and connection != 'keep-alive') or \
+            ('content-length' not in response_headers and
+             'chunked' not in response_headers.get('transfer-encoding', '').lower())
+        return int(status), reason, data, will_close
+
+    async def request(self, path, body, headers):
+        """Send a POST request and read the full response.
+
+        Parameters
+        ----------
+        path : str
+            Request path, starting with '/'.
+        body : bytes
+            Request body.
+        headers : dict
+            Request headers.
+
+        Returns
+        -------
+        tuple
+            The (status, reason, body) of the response.
+        """
+        while True:
+            reader, writer, reused = await self._acquire()
+            try:
+                status, reason, data, will_close = await self._exchange(
+                    reader, writer, path, body, headers)
+            except (ConnectionError, _asyncio.IncompleteReadError):
+                writer.close()
+                # A stale keep-alive socket; retry once on a new connection
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                # Includes cancellation: the response may be half read
+                writer.close()
+                raise
+            if will_close:
+                writer.close()
+            else:
+                self._release(reader, writer)
+            return status, reason, data
+
+    def close(self):
+        """Close all idle connections and stop accepting released ones."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+
+def _get_pool():
+    """Return the connection pool of the running event loop."""
+    loop = _asyncio.get_running_loop()
+    url = _urlsplit(_cm._base_url)
+    host, port = url.hostname, url.port
+    pool = _pools.get(loop)
+    if pool is None or (pool.host, pool.port) != (host, port):
+        if pool is not None:
+            pool.close()
+        pool = _pools[loop] = _AsyncConnectionPool(host, port)
+    return pool
+
+
+def _close_pool():
+    """Close the connection pool of the running event loop, if any."""
+    pool = _pools.pop(_asyncio.get_running_loop(), None)
+    if pool is not None:
+        pool.close()
+
+
+async def send_request(service, method, params=None, *, decode=True):
+    """Coroutine version of connectionmanager.send_request.
+
+    Parameters
+    ----------
+    service : str
+        Service name.
+    method : str
+        Method name to invoke.
+    params : dict, optional
+        Dictionary of input parameters (Default=None).
+    decode : bool, optional
+        True to decode and unpack JSON byte string, False to return
+        response unmodified.
+
+    Returns
+    -------
+    dict or bytes
+        The decoded response from Mx as a dict, or the raw undecoded response.
+    """
+    try:
+        if not _cm._connected:
+            raise _ZygoError('No valid connection to Mx.')
+        path, data, headers = _cm._encode_request(service, method, params)
+        status, reason, read_resp = await _get_pool().request(path, data, headers)
+        return _cm._decode_response(status, reason, read_resp, decode)
+    except _ZygoError as ze:
+        raise ze
+    except Exception as e:
+        raise _ZygoError(e)
+
+
+# =========================================================================
+# ---Running synchronous zygo functions
+# =========================================================================
+class _PendingRequest(BaseException):
+    """Raised out of a replayed function at its first unanswered request.
+
+    Derives from BaseException so that `except Exception` clauses in the
+    replayed function do not intercept it.
+    """
+
+    def __init__(self, request):
+        super().__init__(request)
+        self.request = request
+
+
+class _Replay(object):
+    """Request hook that answers requests from previously sent responses.
+
+    Parameters
+    ----------
+    responses : list of tuple
+        The (request, result, error) of each request already sent, in order.
+    """
+
+    def __init__(self, responses):
+        self._responses = responses
+        self._index = 0
+
+    def __call__(self, service, method, params, decode):
+        request = (service, method,
+                   _json.dumps(params, sort_keys=True, skipkeys=True), decode)
+        if self._index == len(self._responses):
+            raise _PendingRequest((service, method, params, decode, request))
+        sent, result, error = self._responses[self._index]
+        if sent != request:
+            raise _ZygoError('Request sequence changed while replaying {0}/{1}'
+                             .format(service, method))
+        self._index += 1
+        if error is not None:
+            raise error
+        return result
+
+
+async def call(func, *args, **kwargs):
+    """Run a zygo function or method, sending its Mx requests asynchronously.
+
+    The function runs synchronously up to its first Mx request, which is sent
+    without blocking the event loop. It is then run again from the start with
+    the responses received so far, until it completes. zygo functions only
+    validate arguments, build requests and convert results between requests,
+    so running them again is cheap and has no other effect.
+
+    Parameters
+    ----------
+    func : callable
+        Function that makes Mx requests through zygo.connectionmanager.
+    *args, **kwargs
+        Arguments for `func`.
+
+    Returns
+    -------
+    object
+        The return value of `func`.
+    """
+    responses = []
+    while True:
+        token = _cm._request_hook.set(_Replay(responses))
+        try:
+            return func(*args, **kwargs)
+        except _PendingRequest as pending:
+            service, method, params, decode, request = pending.request
+        finally:
+            _cm._request_hook.reset(token)
+        try:
+            result = await send_request(service, method, params, decode=decode)
+            responses.append((request, result, None))
+        except _ZygoError as ze:
+            responses.append((request, None, ze))
+
+
+def _coroutine(func, module_name):
+    """Return a coroutine function that runs `func` with `call`."""
+    @_functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await call(func, *args, **kwargs)
+    wrapper.__doc__ = 'Coroutine version of {0}.{1}.\n\n{2}'.format(
+        module_name, func.__name__, func.__doc__ or '')
+    return wrapper
+
+
+def _export(module, namespace):
+    """Fill `namespace` with coroutine versions of the functions in `module`.
+
+    Public functions defined in `module` become coroutine functions; public
+    classes and enumerations are exported unchanged.
+
+    Parameters
+    ----------
+    module : module
+        The synchronous zygo module.
+    namespace : dict
+        The globals() of the asyncio module.
+    """
+    names = []
+    for name, value in vars(module).items():
+        if name.startswith('_') or \
+                getattr(value, '__module__', None) != module.__name__:
+            continue
+        if isinstance(value, type):
+            namespace[name] = value
+        elif callable(value):
+            namespace[name] = _coroutine(value, module.__name__)
+        else:
+            continue
+        names.append(name)
+    namespace['__all__'] = names
+
+
+# =========================================================================
+# ---Connection and task methods
+# =========================================================================
+async def connect(force_if_active=False, host='localhost', port=8733, uid=''):
+    """Coroutine version of connectionmanager.connect.
+
+    Parameters
+    ----------
+    force_if_active : bool
+        True to connect even if current service state is Active.
+    host : str
+        Host name (Default='localhost') or ip address.
+    port : int
+        Port number (Default=8733).
+    uid : str
+        The string that uniquely identifies this connection.
+
+    Returns
+    -------
+    str
+        The uniquely-identifying string (uid) for this connection.
+    """
+    if _cm._connected:
+        await terminate()
+    try:
+        _cm._start_connection(host, port)
+        result = await send_request(_cm._SERVICE, 'Connect',
+                                    _cm._connect_params(force_if_active, uid))
+        _cm._uid = result['ConnectResult']
+        return _cm._uid
+    except _ZygoError as ze:
+        _cm._reset_connection()
+        _close_pool()
+        raise ze
+    except Exception as e:
+        _cm._reset_connection()
+        _close_pool()
+        raise _ZygoError(e)
+
+
+async def terminate():
+    """Coroutine version of connectionmanager.terminate."""
+    try:
+        await send_request(_cm._SERVICE, 'Terminate', {'uid': _cm._uid})
+    finally:
+        _cm._reset_connection()
+        _close_pool()
+
+
+async def wait(task, timeout=None):
+    """Wait for a core.ZygoTask to complete without blocking the event loop.
+
+    Parameters
+    ----------
+    task : core.ZygoTask
+        Task returned by an asynchronous operation (wait=False).
+    timeout : int or None, optional
+        Maximum time to wait in milliseconds; None for infinite wait.
+
+    Returns
+    -------
+    object
+        The result of the task.
+    """
+    return await call(task.result, timeout)
+
+
+async def done(task):
+    """Return True if a core.ZygoTask has completed.
+
+    Parameters
+    ----------
+    task : core.ZygoTask
+        Task returned by an asynchronous operation (wait=False).
+
+    Returns
+    -------
+    bool
+        True if the task has completed; False otherwise.
+    """
+    return await call(lambda: task.done)
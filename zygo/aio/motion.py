@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+# ****************************************************************************
+# THIS PROGRAM IS AN UNPUBLISHED WORK FULLY PROTECTED BY THE UNITED
+# STATES COPYRIGHT LAWS AND IS CONSIDERED A TRADE SECRET BELONGING TO
+# THE COPYRIGHT HOLDER. IT IS COVERED BY THE ZYGO SOFTWARE LICENSE AGREEMENT.
+# COPYRIGHT (c) ZYGO CORPORATION.
+#
+# ****************************************************************************
+
+"""
+Coroutine versions of the zygo.motion motion functions.
+
+Every public function of zygo.motion is available here under the same name and
+signature as a coroutine function; classes and enumerations are the ones from
+zygo.motion.
+"""
+from zygo import motion as _motion
+from zygo.aio import _export
+
+_export(_motion, globals())
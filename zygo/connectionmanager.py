@@ -14,9 +14,12 @@ Supports connection to Mx.
 This module is intended for internal use by other modules in the zygo scripting
 package, and should not be called directly from end-user scripts.
 """
+import contextvars as _contextvars
 from enum import IntEnum as _IntEnum
-from urllib import request as _request, error as _error
+from http import client as _client
 import json as _json
+import socket as _socket
+import threading as _threading
 
 from zygo.core import ZygoError as _ZygoError
 
@@ -29,6 +32,14 @@ _CLIENT_TYPE = 0
 """int: The Mx WebServices client type for the scripting client."""
 _STATUS_OK = 200
 """int: The HTTP OK status code."""
+_POOL_SIZE = 4
+"""int: The maximum number of idle keep-alive connections kept per host."""
+_CHUNK_SIZE = 256 * 1024
+"""int: The default chunk size, in bytes, of streamed responses."""
+_READ_ONLY_PREFIXES = ('Get', 'Is', 'Log')
+"""tuple of str: Prefixes of the method names that do not change Mx state."""
+_APPLICATION_METHODS = ('OpenApplication', 'CloseApplication')
+"""tuple of str: Methods that replace the Mx user interface."""
 
 
 # =========================================================================
@@ -40,6 +51,19 @@ _uid = ''
 """str: The uniquely identifying string for the active connection."""
 _connected = False
 """bool: True if a connection with Mx has been established; False otherwise."""
+_pool = None
+"""_ConnectionPool: The pool of persistent HTTP connections to the Mx host."""
+_request_hook = _contextvars.ContextVar('zygo_request_hook', default=None)
+"""ContextVar: Callable that handles requests in the current context instead
+of the blocking transport; used by zygo.aio."""
+_state_generation = 0
+"""int: Incremented after every request that may change Mx state; used by
+the zygo.mx result cache to detect stale values."""
+_application_generation = 0
+"""int: Incremented after every request that opens or closes an application;
+used by the zygo.ui control tree index."""
+_generation_lock = _threading.Lock()
+"""threading.Lock: Guards _state_generation and _application_generation."""
 
 
 # =========================================================================
@@ -52,6 +76,208 @@ class WebServiceState(_IntEnum):
     active = 2
 
 
+# =========================================================================
+# ---Transport
+# =========================================================================
+class _Connection(_client.HTTPConnection):
+    """HTTP connection with Nagle's algorithm disabled.
+
+    Requests and responses are small, so waiting to coalesce segments on a
+    kept-alive socket only adds delayed-ACK latency to every round trip.
+    """
+
+    def connect(self):
+        """Connect to the host and port specified in __init__."""
+        super().connect()
+        self.sock.setsockopt(_socket.IPPROTO_TCP, _socket.TCP_NODELAY, 1)
+
+
+class _ConnectionPool(object):
+    """Thread-safe pool of persistent HTTP/1.1 connections to one Mx host.
+
+    Connections are kept alive between requests and handed out one per
+    in-flight request, so concurrent callers never share a socket. A request
+    that fails on a reused connection the server has already closed is sent
+    again once on a fresh connection, but only if it could not be sent at all
+    or is idempotent; otherwise Mx may already have run it.
+
+    Parameters
+    ----------
+    host : str
+        Host name or ip address.
+    port : int
+        Port number.
+    max_size : int, optional
+        Maximum number of idle connections to keep open.
+    timeout : float or None, optional
+        Socket timeout in seconds; None to block indefinitely.
+    """
+
+    def __init__(self, host, port, max_size=_POOL_SIZE, timeout=None):
+        """Initialize the pool.
+
+        Parameters
+        ----------
+        host : str
+            Host name or ip address.
+        port : int
+            Port number.
+        max_size : int, optional
+            Maximum number of idle connections to keep open.
+        timeout : float or None, optional
+            Socket timeout in seconds; None to block indefinitely.
+        """
+        self._host = host
+        self._port = port
+        self._max_size = max_size
+        self._timeout = timeout
+        self._idle = []
+        self._lock = _threading.Lock()
+        self._closed = False
+
+    def _acquire(self):
+        """Return an idle connection, or a new one if none is available."""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return _Connection(self._host, self._port, timeout=self._timeout)
+
+    def _release(self, conn):
+        """Return a connection to the pool, closing it if the pool is full."""
+        with self._lock:
+            if not self._closed and len(self._idle) < self._max_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def _send(self, path, body, headers, idempotent):
+        """Send a POST request and return the connection and its response.
+
+        Parameters
+        ----------
+        path : str
+            Request path, starting with '/'.
+        body : bytes
+            Request body.
+        headers : dict
+            Request headers.
+        idempotent : bool
+            True if the request may safely be sent twice.
+
+        Returns
+        -------
+        tuple
+            The (connection, response); the response body is not read.
+        """
+        conn = self._acquire()
+        reused = conn.sock is not None
+        while True:
+            sent = False
+            try:
+                conn.request('POST', path, body, headers)
+                sent = True
+                return conn, conn.getresponse()
+            except (ConnectionError, _client.BadStatusLine):
+                conn.close()
+                # A stale keep-alive socket; retry once on a new connection
+                if not reused or (sent and not idempotent):
+                    raise
+            except Exception:
+                conn.close()
+                raise
+            reused = False
+            conn = _Connection(self._host, self._port, timeout=self._timeout)
+
+    def request(self, path, body, headers, idempotent=False):
+        """Send a POST request and read the full response.
+
+        Parameters
+        ----------
+        path : str
+            Request path, starting with '/'.
+        body : bytes
+            Request body.
+        headers : dict
+            Request headers.
+        idempotent : bool, optional
+            True if the request may be sent again after the server closed a
+            reused connection without answering.
+
+        Returns
+        -------
+        tuple
+            The (status, reason, body) of the response.
+        """
+        conn, resp = self._send(path, body, headers, idempotent)
+        try:
+            data = resp.read()
+        except Exception:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(conn)
+        return resp.status, resp.reason, data
+
+    def stream(self, path, body, headers, chunk_size=_CHUNK_SIZE,
+               idempotent=False):
+        """Send a POST request and read the response in chunks.
+
+        The first item yielded is the (status, reason) of the response. An OK
+        response body follows as memoryview chunks of one reused buffer, so
+        each chunk is only valid until the next one is requested; any other
+        status is followed by the full (small) error body as bytes.
+
+        Parameters
+        ----------
+        path : str
+            Request path, starting with '/'.
+        body : bytes
+            Request body.
+        headers : dict
+            Request headers.
+        chunk_size : int, optional
+            Size of the read buffer in bytes.
+        idempotent : bool, optional
+            True if the request may be sent again after the server closed a
+            reused connection without answering.
+
+        Yields
+        ------
+        tuple, then memoryview or bytes
+            The (status, reason) of the response, then the body.
+        """
+        conn, resp = self._send(path, body, headers, idempotent)
+        complete = False
+        try:
+            yield resp.status, resp.reason
+            if resp.status != _STATUS_OK:
+                yield resp.read()
+            else:
+                view = memoryview(bytearray(chunk_size))
+                while True:
+                    count = resp.readinto(view)
+                    if not count:
+                        break
+                    yield view[:count]
+            complete = True
+        finally:
+            # A partly read response leaves the socket unusable
+            if complete and not resp.will_close:
+                self._release(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        """Close all idle connections and stop accepting released ones."""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
 # =========================================================================
 # ---Connection methods
 # =========================================================================
@@ -74,31 +300,50 @@ def connect(force_if_active=False, host='localhost', port=8733, uid=''):
     str
         The uniquely-identifying string (uid) for this connection.
     """
-    global _base_url
     global _uid
-    global _connected
 
     if _connected:
         terminate()
     try:
-        _base_url = 'http://{0}:{1}'.format(host, port)
-        params = {'forceIfActive': force_if_active,
-                  'clientType': _CLIENT_TYPE,
-                  'uid': uid}
-        _connected = True
-        _uid = get_send_request(_SERVICE, 'Connect', params)
+        _start_connection(host, port)
+        _uid = get_send_request(_SERVICE, 'Connect',
+                                _connect_params(force_if_active, uid))
 
         return _uid
     except _ZygoError as ze:
-        _base_url = ''
-        _connected = False
+        _reset_connection()
         raise ze
     except Exception as e:
-        _base_url = ''
-        _connected = False
+        _reset_connection()
         raise _ZygoError(e)
 
 
+def _start_connection(host, port):
+    """Set the connection state for a new connection to the Mx host.
+
+    Parameters
+    ----------
+    host : str
+        Host name or ip address.
+    port : int
+        Port number.
+    """
+    global _base_url
+    global _connected
+    global _pool
+
+    _base_url = 'http://{0}:{1}'.format(host, port)
+    _pool = _ConnectionPool(host, port)
+    _connected = True
+
+
+def _connect_params(force_if_active, uid):
+    """Return the parameters of the Connect request."""
+    return {'forceIfActive': force_if_active,
+            'clientType': _CLIENT_TYPE,
+            'uid': uid}
+
+
 def terminate():
     """Close connection to Mx."""
     try:
@@ -109,11 +354,20 @@ def terminate():
     except Exception as e:
         raise _ZygoError(e)
     finally:
-        global _base_url
-        global _connected
+        _reset_connection()
 
-        _base_url = ''
-        _connected = False
+
+def _reset_connection():
+    """Clear the connection state and close any pooled connections."""
+    global _base_url
+    global _connected
+    global _pool
+
+    _base_url = ''
+    _connected = False
+    if _pool is not None:
+        _pool.close()
+        _pool = None
 
 
 def get_service_state():
@@ -195,52 +449,305 @@ def send_request(service,
     concatenation of the method name and the string "Result", e.g.,
     "ConnectResult", and the value is the return value of the invoked method.
     """
+    response = None
+    try:
+        hook = _request_hook.get()
+        if hook is not None:
+            response = hook(service, method, params, decode)
+            return response
+        try:
+            if not _connected:
+                raise _ZygoError('No valid connection to Mx.')
+
+            # Send request on a pooled keep-alive connection, get response
+            path, data, headers = _encode_request(service, method, params)
+            status, reason, read_resp = _pool.request(
+                path, data, headers, method.startswith(_READ_ONLY_PREFIXES))
+            response = _decode_response(status, reason, read_resp, decode)
+            return response
+        except _ZygoError as ze:
+            raise ze
+        except Exception as e:
+            raise _ZygoError(e)
+    finally:
+        if _changes_state(method, response):
+            _bump_state_generation(method in _APPLICATION_METHODS)
+
+
+def send_request_stream(service,
+                        method,
+                        params=None,
+                        *,
+                        chunk_size=_CHUNK_SIZE):
+    """Send HTTP request to the service and stream the raw response body.
+
+    Unlike send_request with decode=False, the response is never held in
+    memory as a whole: it is read from the socket into one buffer of
+    `chunk_size` bytes, so large data and image streams can be written
+    straight to their destination.
+
+    Parameters
+    ----------
+    service : str
+        Service name.
+    method : str
+        Method name to invoke.
+    params : dict, optional
+        Dictionary of input parameters (Default=None).
+    chunk_size : int, optional
+        Size of the read buffer in bytes.
+
+    Yields
+    ------
+    memoryview
+        Consecutive chunks of the response body. The chunks share one
+        buffer, so each is only valid until the next one is requested;
+        copy it (bytes(chunk)) to keep it.
+
+    Raises
+    ------
+    ZygoError
+        If the request fails or Mx returns an error.
+    """
+    hook = _request_hook.get()
+    if hook is not None:
+        # Replayed transports deliver the body in one piece
+        try:
+            data = memoryview(send_request(service, method, params,
+                                           decode=False))
+        except _ZygoError as ze:
+            raise ze
+        except Exception as e:
+            raise _ZygoError(e)
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+        return
     try:
         if not _connected:
             raise _ZygoError('No valid connection to Mx.')
 
-        # Prepare input data, headers
-        data = bytes() if params is None else \
-            _json.dumps(params, skipkeys=True).encode('utf-8')
-        headers = {'Content-Type': 'application/json',
-                   'Accept': 'application/json',
-                   'Content-Length': len(data)}
-        # Send request, get response
-        url = '/'.join((_base_url, service, method))
-
-        req = _request.Request(url, data, headers)
-        with _request.urlopen(req) as resp:
-            try:
-                read_resp = resp.read()
-                # Interpret JSON byte string as Python object if requested
-                value = _json.loads(read_resp.decode('utf-8')) \
-                    if decode else read_resp
-            except Exception:
-                raise _ZygoError(resp.reason)
-            # check HTTP status code; 200 == OK
-            if resp.status != _STATUS_OK:
-                value = (_json.loads(value.decode('utf-8')) if not decode
-                         else value)
-                if ('DetailedInformation' in value and
-                        value['DetailedInformation']):
-                    raise _ZygoError(value['Reason'],
-                                     value['DetailedInformation'])
-                else:
-                    raise _ZygoError(value['Reason'])
-            return value
-    except _error.HTTPError as e:
-        e_resp = e.read()
-        value = _json.loads(e_resp.decode('utf-8')) if decode else e_resp
+        path, data, headers = _encode_request(service, method, params)
+        response = _pool.stream(path, data, headers, chunk_size,
+                                method.startswith(_READ_ONLY_PREFIXES))
+        try:
+            status, reason = next(response)
+            if status != _STATUS_OK:
+                _decode_response(status, reason, next(response), False)
+            for chunk in response:
+                yield chunk
+        finally:
+            response.close()
+    except _ZygoError as ze:
+        raise ze
+    except Exception as e:
+        raise _ZygoError(e)
+    finally:
+        # Streamed methods are never completion checks or waits
+        if _changes_state(method, True):
+            _bump_state_generation(method in _APPLICATION_METHODS)
+
+
+def receive_into(target,
+                 service,
+                 method,
+                 params=None,
+                 *,
+                 chunk_size=_CHUNK_SIZE):
+    """Send HTTP request to the service and write the raw response into a
+    file or buffer.
+
+    Parameters
+    ----------
+    target : file-like object or writable buffer
+        A binary file (anything with a write method), or a writable
+        bytes-like object such as a bytearray, memoryview or numpy array,
+        which is filled from its start.
+    service : str
+        Service name.
+    method : str
+        Method name to invoke.
+    params : dict, optional
+        Dictionary of input parameters (Default=None).
+    chunk_size : int, optional
+        Size of the read buffer in bytes.
+
+    Returns
+    -------
+    int
+        The number of bytes written.
+
+    Raises
+    ------
+    ZygoError
+        If the request fails, Mx returns an error or the response does not
+        fit in `target`.
+    """
+    write = getattr(target, 'write', None)
+    buffer = None if write is not None else memoryview(target).cast('B')
+    size = 0
+    chunks = send_request_stream(service, method, params,
+                                 chunk_size=chunk_size)
+    try:
+        for chunk in chunks:
+            if buffer is None:
+                write(chunk)
+            elif size + len(chunk) > len(buffer):
+                raise _ZygoError(
+                    'Response does not fit in the {0} byte buffer.'.format(
+                        len(buffer)))
+            else:
+                buffer[size:size + len(chunk)] = chunk
+            size += len(chunk)
+    finally:
+        chunks.close()
+    return size
+
+
+def _changes_state(method, response):
+    """Return whether a request may have changed the Mx state.
+
+    Getters do not, with the exception of the Is...Complete checks that
+    return True: a measurement or move has just ended and its results are
+    new. Waits change the state when they complete, and any other request
+    is assumed to change it, even when it failed.
+
+    Parameters
+    ----------
+    method : str
+        Method name.
+    response : object
+        The response of the request; None if it failed.
+
+    Returns
+    -------
+    bool
+        True if values read before the request may be stale after it.
+    """
+    if method.startswith(_READ_ONLY_PREFIXES):
+        if not method.endswith('Complete') or response is None:
+            return False
+        if isinstance(response, dict):
+            response = response.get(method + 'Result')
+        return response is True
+    if method.startswith('WaitFor'):
+        return response is not None
+    return True
+
+
+def _bump_state_generation(application=False):
+    """Mark every value read from Mx so far as possibly stale.
+
+    Parameters
+    ----------
+    application : bool, optional
+        True if the application was opened or closed, which also replaces
+        the user interface.
+    """
+    global _state_generation, _application_generation
+    with _generation_lock:
+        _state_generation += 1
+        if application:
+            _application_generation += 1
+
+
+def get_state_generation():
+    """Get the current Mx state generation.
+
+    The generation increases after every request that may change the state
+    of Mx (measurements, analysis, loading data, setters and so on). Two
+    reads made in the same generation see the same state, as long as this
+    client is the only one driving Mx.
+
+    Returns
+    -------
+    int
+        The current generation.
+    """
+    return _state_generation
+
+
+def get_application_generation():
+    """Get the current Mx application generation.
+
+    The generation increases after every request that opens or closes an
+    Mx application, which replaces the user interface tree.
+
+    Returns
+    -------
+    int
+        The current generation.
+    """
+    return _application_generation
+
+
+def _encode_request(service, method, params):
+    """Build the path, body and headers of a request.
+
+    Parameters
+    ----------
+    service : str
+        Service name.
+    method : str
+        Method name to invoke.
+    params : dict or None
+        Dictionary of input parameters.
+
+    Returns
+    -------
+    tuple
+        The (path, body, headers) of the request.
+    """
+    data = bytes() if params is None else \
+        _json.dumps(params, skipkeys=True).encode('utf-8')
+    headers = {'Content-Type': 'application/json',
+               'Accept': 'application/json',
+               'Content-Length': len(data)}
+    return '/'.join(('', service, method)), data, headers
+
+
+def _decode_response(status, reason, read_resp, decode):
+    """Check the status of a response and decode its body.
+
+    Parameters
+    ----------
+    status : int
+        HTTP status code.
+    reason : str
+        HTTP reason phrase.
+    read_resp : bytes
+        Response body.
+    decode : bool
+        True to decode and unpack JSON byte string, False to return
+        response unmodified.
+
+    Returns
+    -------
+    dict or bytes
+        The decoded response, or the raw response body.
+
+    Raises
+    ------
+    ZygoError
+        If the status is not OK or the body cannot be decoded.
+    """
+    # check HTTP status code; 200 == OK
+    if status != _STATUS_OK:
+        try:
+            value = _json.loads(read_resp.decode('utf-8'))
+        except Exception:
+            raise _ZygoError(reason)
         if ('DetailedInformation' in value and
                 value['DetailedInformation']):
             raise _ZygoError(value['Reason'],
                              value['DetailedInformation'])
         else:
             raise _ZygoError(value['Reason'])
-    except _ZygoError as ze:
-        raise ze
-    except Exception as e:
-        raise _ZygoError(e)
+    try:
+        # Interpret JSON byte string as Python object if requested
+        return _json.loads(read_resp.decode('utf-8')) \
+            if decode else read_resp
+    except Exception:
+        raise _ZygoError(reason)
 
 
 def get_send_request(service,
@@ -10,6 +10,9 @@
 """
 Provides core functionality for Mx Scripting.
 """
+import asyncio as _asyncio
+from concurrent import futures as _futures
+import threading as _threading
 
 
 class ZygoError(Exception):
@@ -17,12 +20,26 @@ class ZygoError(Exception):
     pass
 
 
+FIRST_COMPLETED = _futures.FIRST_COMPLETED
+"""str: `wait` returns when any task completes."""
+FIRST_EXCEPTION = _futures.FIRST_EXCEPTION
+"""str: `wait` returns when any task fails, or when all have completed."""
+ALL_COMPLETED = _futures.ALL_COMPLETED
+"""str: `wait` returns when all tasks have completed."""
+
+
 class ZygoTask(object):
     """Represents information pertaining to an asynchronous Mx operation.
 
     A new ZygoTask object is automatically returned for each asynchronous
     operation. It is not intended for a ZygoTask to be manually created.
 
+    Besides polling `done` and blocking on `wait`/`result`, a task can be
+    composed with other tasks: `future` is a concurrent.futures.Future that
+    is completed by one shared background waiter, `add_done_callback`
+    registers completion callbacks, the task can be awaited from asyncio, and
+    the module functions `wait` and `as_completed` wait on many tasks.
+
     Parameters
     ----------
     task_id
@@ -49,14 +66,17 @@ class ZygoTask(object):
         self._task_id = task_id
         self._done_func = done_func
         self._wait_func = wait_func
-        self._result = None
-        self._done = False
+        self._future = _futures.Future()
+        # Mx operations cannot be cancelled once started
+        self._future.set_running_or_notify_cancel()
+        self._watched = False
+        self._lock = _threading.Lock()
 
     @property
     def done(self):
         """bool: True if the task has completed; False otherwise."""
-        # Only set if user waits or gets result successfully; Else ask Mx
-        if self._done:
+        # Only set if completed by a wait or by the waiter; Else ask Mx
+        if self._future.done():
             return True
         return self._done_func(self._task_id)
 
@@ -68,10 +88,9 @@ class ZygoTask(object):
         timeout : int or None, optional
             Maximum time to wait; Defaults to None for infinite wait.
         """
-        if not self._done:
+        if not self._future.done():
             # Expected to wait for result
-            self._result = self._wait_func(self._task_id, timeout)
-            self._done = True
+            self._set_result(self._wait_func(self._task_id, timeout))
 
     def result(self, timeout=None):
         """Return the result of the task after waiting to complete.
@@ -87,8 +106,172 @@ class ZygoTask(object):
             The result from the operation, or None for result-less tasks.
 
         """
-        self.wait(timeout)  # Sets self._result
-        return self._result
+        self.wait(timeout)
+        return self._future.result()
+
+    @property
+    def future(self):
+        """concurrent.futures.Future: Future completed with the task result.
+
+        The first access registers the task with the shared background
+        waiter. Timeouts passed to the future's methods are in seconds.
+        """
+        with self._lock:
+            watch = not self._watched and not self._future.done()
+            self._watched = True
+        if watch:
+            _waiter.add(self)
+        return self._future
+
+    def add_done_callback(self, fn):
+        """Call `fn(task)` when the task completes.
+
+        The callback runs on the shared waiter thread, or immediately if the
+        task has already completed.
+
+        Parameters
+        ----------
+        fn : callable
+            Callable taking this task as its only argument.
+        """
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def __await__(self):
+        """Wait for the task from a coroutine; returns the task result."""
+        return _asyncio.wrap_future(self.future).__await__()
+
+    def _set_result(self, result):
+        """Complete the future unless it has already been completed."""
+        try:
+            self._future.set_result(result)
+        except _futures.InvalidStateError:
+            pass
+
+    def _poll(self):
+        """Check the task once for the waiter; return True when complete."""
+        if self._future.done():
+            return True
+        try:
+            if not self._done_func(self._task_id):
+                return False
+            self._set_result(self._wait_func(self._task_id, None))
+        except Exception as e:
+            try:
+                self._future.set_exception(e)
+            except _futures.InvalidStateError:
+                pass
+        return True
+
+
+class _TaskWaiter(object):
+    """Background thread that completes the futures of watched tasks.
+
+    One thread polls the completion status of every watched task, starting
+    again at the shortest interval whenever a task is added or completes and
+    backing off while nothing changes. The thread exits when no tasks are
+    left and is restarted by the next `add`.
+    """
+
+    MIN_INTERVAL = 0.02
+    """float: Poll interval in seconds after a change."""
+    MAX_INTERVAL = 0.25
+    """float: Longest poll interval in seconds while nothing changes."""
+
+    def __init__(self):
+        """Initialize the waiter."""
+        self._tasks = []
+        self._condition = _threading.Condition()
+        self._interval = self.MIN_INTERVAL
+        self._thread = None
+
+    def add(self, task):
+        """Watch a task until it completes.
+
+        Parameters
+        ----------
+        task : ZygoTask
+            The task to watch.
+        """
+        with self._condition:
+            self._tasks.append(task)
+            self._interval = self.MIN_INTERVAL
+            if self._thread is None:
+                self._thread = _threading.Thread(target=self._run,
+                                                 name='ZygoTaskWaiter')
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        """Poll the watched tasks until none are left."""
+        while True:
+            with self._condition:
+                if not self._tasks:
+                    self._thread = None
+                    return
+                tasks = list(self._tasks)
+            completed = [task for task in tasks if task._poll()]
+            with self._condition:
+                for task in completed:
+                    self._tasks.remove(task)
+                if completed:
+                    self._interval = self.MIN_INTERVAL
+                if self._tasks:
+                    interval = self._interval
+                    self._interval = min(interval * 2, self.MAX_INTERVAL)
+                    self._condition.wait(interval)
+
+
+_waiter = _TaskWaiter()
+"""_TaskWaiter: The waiter shared by all tasks."""
+
+
+def wait(tasks, timeout=None, return_when=ALL_COMPLETED):
+    """Wait for tasks to complete, like concurrent.futures.wait.
+
+    Parameters
+    ----------
+    tasks : iterable of ZygoTask
+        The tasks to wait for.
+    timeout : float or None, optional
+        Maximum time to wait in seconds; None for infinite wait.
+    return_when : str, optional
+        FIRST_COMPLETED, FIRST_EXCEPTION or ALL_COMPLETED (default).
+
+    Returns
+    -------
+    tuple of set
+        The (done, not_done) sets of tasks.
+    """
+    by_future = dict((task.future, task) for task in tasks)
+    done, not_done = _futures.wait(by_future, timeout, return_when)
+    return (set(by_future[f] for f in done),
+            set(by_future[f] for f in not_done))
+
+
+def as_completed(tasks, timeout=None):
+    """Yield tasks as they complete, like concurrent.futures.as_completed.
+
+    Parameters
+    ----------
+    tasks : iterable of ZygoTask
+        The tasks to wait for.
+    timeout : float or None, optional
+        Maximum total time to wait in seconds; None for infinite wait.
+
+    Yields
+    ------
+    ZygoTask
+        Each task, in the order in which they complete.
+
+    Raises
+    ------
+    concurrent.futures.TimeoutError
+        If not all tasks complete within `timeout`.
+    """
+    by_future = dict((task.future, task) for task in tasks)
+    for future in _futures.as_completed(by_future, timeout):
+        yield by_future[future]
 
 
 class Point2D(object):
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+# ****************************************************************************
+# THIS PROGRAM IS AN UNPUBLISHED WORK FULLY PROTECTED BY THE UNITED
+# STATES COPYRIGHT LAWS AND IS CONSIDERED A TRADE SECRET BELONGING TO
+# THE COPYRIGHT HOLDER. IT IS COVERED BY THE ZYGO SOFTWARE LICENSE AGREEMENT.
+# COPYRIGHT (c) ZYGO CORPORATION.
+#
+# ****************************************************************************
+
+"""
+Loads Mx .datx (HDF5) data into NumPy arrays.
+
+The surface and intensity arrays are not copied when the file layout allows
+it: datasets stored contiguously and uncompressed are memory-mapped from
+files on disk, and viewed in place in in-memory buffers::
+
+    data = datx.load(control.save_data_to_stream('.datx'))
+    heights = data.heights(Units.MicroMeters)   # NaN where there is no data
+    print(data.shape, data.lateral_resolution, data.height_unit)
+
+This module requires numpy and h5py.
+"""
+import io as _io
+import os as _os
+
+import h5py as _h5py
+import numpy as _np
+
+from zygo.units import _validate_unit
+
+
+_SURFACE_PATHS = ('Measurement/Surface', 'Data/Surface')
+"""tuple of str: Locations of the surface dataset (or of a group holding
+it), newest layout first."""
+_INTENSITY_PATHS = ('Measurement/Intensity', 'Data/Intensity')
+"""tuple of str: Locations of the intensity dataset (or of a group holding
+it), newest layout first."""
+_ATTRIBUTES_PATH = 'Attributes'
+"""str: Group whose subgroup holds the measurement attributes."""
+_METERS_PER_UNIT = {
+    'Angstroms': 1e-10,
+    'NanoMeters': 1e-9,
+    'MicroMeters': 1e-6,
+    'MilliMeters': 1e-3,
+    'CentiMeters': 1e-2,
+    'Meters': 1.0,
+    'MicroInches': 2.54e-8,
+    'Mils': 2.54e-5,
+    'Inches': 0.0254,
+    'Feet': 0.3048,
+}
+"""dict: Length of each linear unit in meters."""
+
+
+# =============================================================================
+# ---Surface data
+# =============================================================================
+class SurfaceData(object):
+    """The contents of a .datx file.
+
+    Parameters
+    ----------
+    surface : numpy.ndarray
+        The stored surface values, in `height_unit`; a read-only view of the
+        file or buffer when possible.
+    intensity : numpy.ndarray or None
+        The stored intensity values, if the file has them.
+    no_data : float or None
+        The surface value that marks pixels without data.
+    height_unit : str
+        Unit of the surface values.
+    lateral_resolution : float or None
+        Pixel size, in `lateral_unit`.
+    lateral_unit : str
+        Unit of `lateral_resolution`.
+    attributes : dict
+        The measurement attributes, keyed by their Mx names.
+    """
+
+    def __init__(self, surface, intensity, no_data, height_unit,
+                 lateral_resolution, lateral_unit, attributes):
+        """Initialize the surface data.
+
+        Parameters
+        ----------
+        surface : numpy.ndarray
+            The stored surface values, in `height_unit`.
+        intensity : numpy.ndarray or None
+            The stored intensity values, if the file has them.
+        no_data : float or None
+            The surface value that marks pixels without data.
+        height_unit : str
+            Unit of the surface values.
+        lateral_resolution : float or None
+            Pixel size, in `lateral_unit`.
+        lateral_unit : str
+            Unit of `lateral_resolution`.
+        attributes : dict
+            The measurement attributes, keyed by their Mx names.
+        """
+        self.surface = surface
+        self.intensity = intensity
+        self.no_data = no_data
+        self.height_unit = height_unit
+        self.lateral_resolution = lateral_resolution
+        self.lateral_unit = lateral_unit
+        self.attributes = attributes
+
+    @property
+    def shape(self):
+        """tuple of int: The (rows, columns) of the surface."""
+        return self.surface.shape
+
+    @property
+    def valid(self):
+        """numpy.ndarray: Boolean mask of the pixels that have data."""
+        valid = _np.isfinite(self.surface) \
+            if self.surface.dtype.kind == 'f' else \
+            _np.ones(self.surface.shape, dtype=bool)
+        if self.no_data is not None and _np.isfinite(self.no_data):
+            valid &= self.surface != self.no_data
+        return valid
+
+    def heights(self, unit=None):
+        """Get the surface as heights with NaN for the pixels without data.
+
+        This is a new array; `surface` itself is left untouched.
+
+        Parameters
+        ----------
+        unit : units.Units or str, optional
+            Unit of the returned heights; None for `height_unit`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The heights, as float32 for float32 surfaces, else float64.
+        """
+        dtype = _np.result_type(self.surface.dtype, _np.float32)
+        heights = self.surface.astype(dtype)
+        heights[~self.valid] = _np.nan
+        scale = _scale(self.height_unit, unit)
+        if scale != 1.0:
+            heights *= scale
+        return heights
+
+    def lateral_resolution_in(self, unit):
+        """Get the pixel size in the given unit.
+
+        Parameters
+        ----------
+        unit : units.Units or str
+            The unit.
+
+        Returns
+        -------
+        float or None
+            The pixel size; None if the file does not record it.
+        """
+        if self.lateral_resolution is None:
+            return None
+        return self.lateral_resolution * _scale(self.lateral_unit, unit)
+
+    def __repr__(self):
+        """Return a string representation of this object."""
+        return ('zygo.datx.SurfaceData(shape={0}, height_unit={1!r}, '
+                'lateral_resolution={2!r}, lateral_unit={3!r})'.format(
+                    self.shape, self.height_unit, self.lateral_resolution,
+                    self.lateral_unit))
+
+
+def _scale(from_unit, to_unit):
+    """Return the factor converting lengths in `from_unit` to `to_unit`."""
+    if to_unit is None:
+        return 1.0
+    to_unit = _validate_unit(to_unit)
+    if from_unit == to_unit:
+        return 1.0
+    try:
+        return _METERS_PER_UNIT[from_unit] / _METERS_PER_UNIT[to_unit]
+    except KeyError:
+        raise ValueError('Cannot convert from {0} to {1}.'.format(
+            from_unit, to_unit))
+
+
+# =============================================================================
+# ---Loading
+# =============================================================================
+class _BufferFile(_io.RawIOBase):
+    """Read-only file object over a buffer, without copying the buffer.
+
+    h5py reads the file structure through it; the datasets themselves are
+    viewed in the buffer directly.
+    """
+
+    def __init__(self, buffer):
+        """Wrap a bytes-like object."""
+        super().__init__()
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self):
+        """Return True; the file is readable."""
+        return True
+
+    def seekable(self):
+        """Return True; the file is seekable."""
+        return True
+
+    def seek(self, offset, whence=_io.SEEK_SET):
+        """Move to a new position and return it."""
+        if whence == _io.SEEK_CUR:
+            offset += self._position
+        elif whence == _io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self):
+        """Return the current position."""
+        return self._position
+
+    def readinto(self, buffer):
+        """Read into `buffer` and return the number of bytes read."""
+        data = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def load(source, mmap=True):
+    """Load a .datx file or buffer.
+
+    Parameters
+    ----------
+    source : str, os.PathLike or bytes-like
+        Path of a .datx file, or the .datx contents, e.g. as returned by
+        ui.Control.save_data_to_stream('.datx').
+    mmap : bool, optional
+        True to memory-map the arrays of a file instead of reading them.
+
+    Returns
+    -------
+    SurfaceData
+        The surface, intensity and attributes.
+
+    Raises
+    ------
+    ValueError
+        If the file has no surface data.
+    """
+    if isinstance(source, (str, _os.PathLike)):
+        with _h5py.File(source, 'r') as h5:
+            return _read(h5, _os.fspath(source) if mmap else None, None)
+    buffer = memoryview(source).cast('B')
+    with _h5py.File(_BufferFile(buffer), 'r') as h5:
+        return _read(h5, None, buffer)
+
+
+def load_control(control):
+    """Load the data of an Mx control.
+
+    Parameters
+    ----------
+    control : ui.Control
+        The control whose data to load.
+
+    Returns
+    -------
+    SurfaceData
+        The surface, intensity and attributes.
+    """
+    return load(control.save_data_to_stream('.datx'))
+
+
+def _read(h5, path, buffer):
+    """Read a SurfaceData from an open file.
+
+    Parameters
+    ----------
+    h5 : h5py.File
+        The open file.
+    path : str or None
+        Path of the file on disk, to memory-map its arrays.
+    buffer : memoryview or None
+        The file contents, to view its arrays in place.
+    """
+    surface_ds = _find_dataset(h5, _SURFACE_PATHS)
+    if surface_ds is None:
+        raise ValueError('The .datx data has no surface dataset.')
+    intensity_ds = _find_dataset(h5, _INTENSITY_PATHS)
+
+    attrs = surface_ds.attrs
+    z_converter = _converter(attrs, 'Z Converter')
+    x_converter = _converter(attrs, 'X Converter')
+    no_data = _scalar(attrs['No Data']) if 'No Data' in attrs else None
+    height_unit = z_converter.get('BaseUnit') or \
+        _scalar(attrs.get('Unit', b'NanoMeters'))
+
+    attributes = _attributes(h5)
+    lateral_unit = x_converter.get('BaseUnit') or 'Meters'
+    parameters = x_converter.get('Parameters')
+    if parameters is not None and len(parameters) > 1:
+        lateral_resolution = float(parameters[1])
+    else:
+        lateral_resolution = attributes.get(
+            'Data Context.Lateral Resolution:Value')
+        lateral_unit = attributes.get(
+            'Data Context.Lateral Resolution:Unit', lateral_unit)
+
+    return SurfaceData(
+        _array(surface_ds, path, buffer),
+        None if intensity_ds is None else _array(intensity_ds, path, buffer),
+        None if no_data is None else float(no_data),
+        height_unit,
+        None if lateral_resolution is None else float(lateral_resolution),
+        lateral_unit,
+        attributes)
+
+
+def _find_dataset(h5, paths):
+    """Return the first dataset found at `paths`, or in a group there."""
+    for path in paths:
+        node = h5.get(path)
+        if isinstance(node, _h5py.Dataset):
+            return node
+        if isinstance(node, _h5py.Group):
+            for name in node:
+                if isinstance(node[name], _h5py.Dataset):
+                    return node[name]
+    return None
+
+
+def _array(dataset, path, buffer):
+    """Return a dataset as an array without copying it where possible.
+
+    Contiguous, unfiltered datasets are memory-mapped from `path` or viewed
+    in `buffer`; all others are read.
+    """
+    offset = dataset.id.get_offset()
+    in_place = (offset is not None and dataset.chunks is None and
+                dataset.compression is None and dataset.dtype.kind in 'biuf'
+                and dataset.size > 0)
+    if in_place and path is not None:
+        return _np.memmap(path, dtype=dataset.dtype, mode='r', offset=offset,
+                          shape=dataset.shape)
+    if in_place and buffer is not None:
+        array = _np.frombuffer(buffer, dtype=dataset.dtype,
+                               count=dataset.size, offset=offset)
+        return array.reshape(dataset.shape)
+    return dataset[()]
+
+
+def _text(value):
+    """Decode a bytes value; return other values unchanged."""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def _scalar(value):
+    """Unwrap a one-element array attribute into a Python value."""
+    if isinstance(value, _np.ndarray):
+        if value.dtype.names is None and value.size == 1:
+            value = value.reshape(-1)[0]
+        elif value.dtype.names is None:
+            return value
+    if isinstance(value, _np.generic):
+        value = value.item()
+    return _text(value)
+
+
+def _converter(attrs, name):
+    """Return the fields of a converter attribute as a dict."""
+    if name not in attrs:
+        return {}
+    value = attrs[name]
+    if value.dtype.names is None:
+        return {}
+    record = value.reshape(-1)[0]
+    converter = {}
+    for field in value.dtype.names:
+        item = record[field]
+        if isinstance(item, _np.ndarray):
+            converter[field] = tuple(float(v) for v in item.reshape(-1))
+        else:
+            converter[field] = _scalar(item)
+    return converter
+
+
+def _attributes(h5):
+    """Return the measurement attributes as a dict of Python values."""
+    group = h5.get(_ATTRIBUTES_PATH)
+    if not isinstance(group, _h5py.Group):
+        return {}
+    nodes = [group] + [group[name] for name in group
+                       if isinstance(group[name], _h5py.Group)]
+    attributes = {}
+    for node in nodes:
+        for key, value in node.attrs.items():
+            attributes[key] = _scalar(value)
+    return attributes
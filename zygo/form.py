@@ -0,0 +1,593 @@
+# -*- coding: utf-8 -*-
+
+# ****************************************************************************
+# THIS PROGRAM IS AN UNPUBLISHED WORK FULLY PROTECTED BY THE UNITED
+# STATES COPYRIGHT LAWS AND IS CONSIDERED A TRADE SECRET BELONGING TO
+# THE COPYRIGHT HOLDER. IT IS COVERED BY THE ZYGO SOFTWARE LICENSE AGREEMENT.
+# COPYRIGHT (c) ZYGO CORPORATION.
+#
+# ****************************************************************************
+
+"""
+Removes form from height maps and filters them locally.
+
+Plane (piston and tilt), sphere (plus power) and Zernike terms are fitted by
+least squares to the pixels with data, and the Gaussian filter of ISO
+16610-61 separates waviness from roughness. Stages are chained into a
+pipeline that runs on height maps loaded with zygo.datx, instead of setting
+Mx controls and analyzing again for every change::
+
+    pipeline = form.Pipeline([form.RemoveSphere(),
+                              form.GaussianFilter(cutoff=80e-6,
+                                                  high_pass=True)])
+    roughness = pipeline.apply(datx.load(path))   # cutoff in lateral_unit
+    print(surface.parameters(roughness).Sa)
+
+Pixels without data are NaN, are ignored by every fit and filter, and stay
+NaN in the results.
+
+This module requires numpy.
+"""
+from collections import namedtuple as _namedtuple
+import math as _math
+
+import numpy as _np
+
+
+_BLOCK_ROWS = 128
+"""int: Rows evaluated at a time when fitting, to bound temporary memory."""
+_ALPHA = _math.sqrt(_math.log(2.0) / _math.pi)
+"""float: Constant of the ISO 16610-61 Gaussian weighting function."""
+
+
+FormFit = _namedtuple('FormFit', ['coefficients', 'form', 'radius'])
+"""namedtuple: The result of a form fit.
+
+coefficients : tuple of float
+    Fitted coefficient of each term, in height units, over coordinates
+    normalized to the smallest circle around the data centre that holds all
+    pixels with data (unit radius).
+form : numpy.ndarray
+    The fitted form at every pixel.
+radius : float or None
+    Radius of curvature of a sphere fit, in the unit of `pixel_size` (or
+    pixels); None for other fits.
+"""
+
+
+# =============================================================================
+# ---Least squares fitting
+# =============================================================================
+def _as_heights(heights):
+    """Return a float64 height array of an array or datx.SurfaceData."""
+    if hasattr(heights, 'heights') and callable(heights.heights):
+        heights = heights.heights()
+    return _np.asarray(heights, dtype=_np.float64)
+
+
+def _fit_mask(heights, mask):
+    """Return the pixels to fit: pixels with data, within `mask` if given."""
+    valid = _np.isfinite(heights)
+    if mask is not None:
+        mask = _np.asarray(mask, dtype=bool)
+        if mask.shape != heights.shape:
+            raise ValueError('`mask` must have the shape of `heights`.')
+        valid &= mask
+    return valid
+
+
+def _aperture(valid):
+    """Return the (center x, center y, radius) of the normalized aperture.
+
+    The centre is the centre of the bounding box of the valid pixels and
+    the radius the distance to the farthest valid pixel.
+    """
+    rows = _np.flatnonzero(valid.any(axis=1))
+    if rows.size == 0:
+        raise ValueError('There are no pixels with data to fit.')
+    columns = _np.flatnonzero(valid.any(axis=0))
+    cx = (columns[0] + columns[-1]) / 2.0
+    cy = (rows[0] + rows[-1]) / 2.0
+    row_valid = valid[rows]
+    first = row_valid.argmax(axis=1)
+    last = valid.shape[1] - 1 - row_valid[:, ::-1].argmax(axis=1)
+    dx = _np.maximum(_np.abs(first - cx), _np.abs(last - cx))
+    radius = _math.sqrt(float(_np.max(dx * dx + (rows - cy) ** 2)))
+    return cx, cy, max(radius, 1.0)
+
+
+def _fit(heights, mask, basis):
+    """Fit a linear combination of basis functions by least squares.
+
+    Parameters
+    ----------
+    heights : numpy.ndarray
+        The float64 height map.
+    mask : array_like of bool or None
+        Pixels to fit, besides requiring data.
+    basis : callable
+        basis(x, y) returns the list of term values at normalized
+        coordinates x, y (arrays of one block of rows).
+
+    Returns
+    -------
+    tuple
+        (coefficients, form, aperture radius in pixels)
+    """
+    valid = _fit_mask(heights, mask)
+    cx, cy, radius = _aperture(valid)
+    rows, columns = heights.shape
+    x = (_np.arange(columns) - cx) / radius
+
+    def blocks():
+        for start in range(0, rows, _BLOCK_ROWS):
+            stop = min(start + _BLOCK_ROWS, rows)
+            y = ((_np.arange(start, stop) - cy) / radius)[:, None]
+            xx, yy = _np.broadcast_arrays(x[None, :], y)
+            yield start, stop, basis(xx, yy)
+
+    # Accumulate the normal equations block by block
+    normal = None
+    for start, stop, terms in blocks():
+        block_valid = valid[start:stop]
+        if not block_valid.any():
+            continue
+        design = _np.array([term[block_valid] for term in terms])
+        if normal is None:
+            normal = _np.zeros((len(terms), len(terms)))
+            right = _np.zeros(len(terms))
+        normal += design @ design.T
+        right += design @ heights[start:stop][block_valid]
+    coefficients = _np.linalg.lstsq(normal, right, rcond=None)[0]
+
+    form = _np.empty_like(heights)
+    for start, stop, terms in blocks():
+        form[start:stop] = sum(c * term for c, term in zip(coefficients, terms))
+    return tuple(float(c) for c in coefficients), form, radius
+
+
+def _plane_terms(x, y):
+    """Piston, x tilt and y tilt."""
+    return [_np.ones_like(x), x, y]
+
+
+def _sphere_terms(x, y):
+    """Piston, tilts and power (x**2 + y**2)."""
+    return [_np.ones_like(x), x, y, x * x + y * y]
+
+
+def fit_plane(heights, mask=None):
+    """Fit a plane (piston and tilt) to a height map.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN marks pixels without data.
+    mask : array_like of bool, optional
+        Pixels to fit (True); None for all pixels with data.
+
+    Returns
+    -------
+    FormFit
+        The (piston, x tilt, y tilt) coefficients and the fitted plane.
+    """
+    coefficients, form, _ = _fit(_as_heights(heights), mask, _plane_terms)
+    return FormFit(coefficients, form, None)
+
+
+def fit_sphere(heights, mask=None, pixel_size=None):
+    """Fit a sphere (piston, tilt and power) to a height map.
+
+    The sphere is fitted as its paraboloid approximation, as for power
+    removal in Mx.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN marks pixels without data.
+    mask : array_like of bool, optional
+        Pixels to fit (True); None for all pixels with data.
+    pixel_size : float, optional
+        Pixel size, for the radius of curvature; None to report the radius
+        in pixels. Give it in the height unit to get the radius in that
+        unit.
+
+    Returns
+    -------
+    FormFit
+        The (piston, x tilt, y tilt, power) coefficients, the fitted sphere
+        and its radius of curvature (positive when concave).
+    """
+    coefficients, form, radius = _fit(_as_heights(heights), mask,
+                                      _sphere_terms)
+    power = coefficients[3]
+    aperture = radius * (1.0 if pixel_size is None else pixel_size)
+    curvature = aperture ** 2 / (2.0 * power) if power else float('inf')
+    return FormFit(coefficients, form, curvature)
+
+
+def remove_plane(heights, mask=None):
+    """Return a height map with its best fit plane removed.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN marks pixels without data.
+    mask : array_like of bool, optional
+        Pixels to fit (True); None for all pixels with data.
+
+    Returns
+    -------
+    numpy.ndarray
+        The residual heights.
+    """
+    heights = _as_heights(heights)
+    return heights - fit_plane(heights, mask).form
+
+
+def remove_sphere(heights, mask=None):
+    """Return a height map with its best fit sphere removed.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN marks pixels without data.
+    mask : array_like of bool, optional
+        Pixels to fit (True); None for all pixels with data.
+
+    Returns
+    -------
+    numpy.ndarray
+        The residual heights.
+    """
+    heights = _as_heights(heights)
+    return heights - fit_sphere(heights, mask).form
+
+
+# =============================================================================
+# ---Zernike polynomials
+# =============================================================================
+def noll_to_nm(index):
+    """Convert a Noll Zernike index to its radial and azimuthal orders.
+
+    Parameters
+    ----------
+    index : int
+        Noll index, starting at 1 (piston).
+
+    Returns
+    -------
+    tuple of int
+        (n, m); m < 0 for the sine terms.
+    """
+    if index < 1:
+        raise ValueError('Noll indices start at 1.')
+    n = 0
+    j = index - 1
+    while j > n:
+        n += 1
+        j -= n
+    m = (n % 2) + 2 * ((j + ((n + 1) % 2)) // 2)
+    return n, m if index % 2 == 0 else -m
+
+
+def _zernike_terms(indices):
+    """Return a basis function of the given Noll Zernike terms."""
+    orders = [noll_to_nm(index) for index in indices]
+
+    def terms(x, y):
+        rho = _np.hypot(x, y)
+        theta = _np.arctan2(y, x)
+        values = []
+        for n, m in orders:
+            m_abs = abs(m)
+            radial = _np.zeros_like(rho)
+            for k in range((n - m_abs) // 2 + 1):
+                radial += ((-1) ** k * _math.factorial(n - k) /
+                           (_math.factorial(k) *
+                            _math.factorial((n + m_abs) // 2 - k) *
+                            _math.factorial((n - m_abs) // 2 - k))) * \
+                    rho ** (n - 2 * k)
+            if m > 0:
+                radial *= _np.cos(m_abs * theta)
+            elif m < 0:
+                radial *= _np.sin(m_abs * theta)
+            values.append(radial)
+        return values
+    return terms
+
+
+def fit_zernike(heights, terms=range(1, 5), mask=None):
+    """Fit Zernike polynomials to a height map.
+
+    The polynomials are not normalized: each coefficient is the amplitude
+    of its term at the edge of the aperture.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN marks pixels without data.
+    terms : iterable of int, optional
+        Noll indices of the terms to fit (the default is piston, tilts and
+        power).
+    mask : array_like of bool, optional
+        Pixels to fit (True); None for all pixels with data.
+
+    Returns
+    -------
+    FormFit
+        The coefficient of each term and the fitted form.
+    """
+    coefficients, form, _ = _fit(_as_heights(heights), mask,
+                                 _zernike_terms(list(terms)))
+    return FormFit(coefficients, form, None)
+
+
+def remove_zernike(heights, terms=range(1, 5), mask=None):
+    """Return a height map with the given Zernike terms removed.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN marks pixels without data.
+    terms : iterable of int, optional
+        Noll indices of the terms to remove.
+    mask : array_like of bool, optional
+        Pixels to fit (True); None for all pixels with data.
+
+    Returns
+    -------
+    numpy.ndarray
+        The residual heights.
+    """
+    heights = _as_heights(heights)
+    return heights - fit_zernike(heights, terms, mask).form
+
+
+# =============================================================================
+# ---Gaussian filter
+# =============================================================================
+def _fft_length(size):
+    """Return the smallest 5-smooth (fast FFT) length of at least `size`."""
+    best = 1 << max(0, (size - 1).bit_length())
+    power5 = 1
+    while power5 < best:
+        power35 = power5
+        while power35 < best:
+            length = power35
+            while length < size:
+                length *= 2
+            best = min(best, length)
+            power35 *= 3
+        power5 *= 5
+    return best
+
+
+def _convolve(arrays, kernel, axis):
+    """Convolve arrays with a symmetric kernel along an axis using FFTs.
+
+    Values beyond the edges count as zero.
+    """
+    size = arrays.shape[axis]
+    radius = len(kernel) // 2
+    length = _fft_length(size + 2 * radius)
+    spectrum = _np.fft.rfft(arrays, n=length, axis=axis)
+    kernel_shape = [1] * arrays.ndim
+    kernel_shape[axis] = -1
+    spectrum *= _np.fft.rfft(kernel, n=length).reshape(kernel_shape)
+    result = _np.fft.irfft(spectrum, n=length, axis=axis)
+    index = [slice(None)] * arrays.ndim
+    index[axis] = slice(radius, radius + size)
+    return result[tuple(index)]
+
+
+def gaussian_filter(heights, cutoff, pixel_size=1.0, high_pass=False):
+    """Filter a height map with the ISO 16610-61 areal Gaussian filter.
+
+    The filter is applied separably along rows and columns with FFT
+    convolutions. Pixels without data get no weight; near them and near the
+    edges the filter is normalized by the weight of the pixels with data.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN marks pixels without data.
+    cutoff : float
+        Nesting index (cutoff wavelength), in the unit of `pixel_size`; a
+        sine of this wavelength keeps 50% of its amplitude.
+    pixel_size : float, optional
+        Pixel size (the default is 1.0, giving the cutoff in pixels).
+    high_pass : bool, optional
+        False to return the low-pass (waviness) surface; True to return the
+        high-pass (roughness) surface, heights - low-pass.
+
+    Returns
+    -------
+    numpy.ndarray
+        The filtered heights.
+    """
+    heights = _as_heights(heights)
+    if cutoff <= 0 or pixel_size <= 0:
+        raise ValueError('`cutoff` and `pixel_size` must be positive.')
+    sigma = _ALPHA * cutoff / (_math.sqrt(2.0 * _math.pi) * pixel_size)
+    radius = max(1, int(_math.ceil(4.0 * sigma)))
+    offsets = _np.arange(-radius, radius + 1)
+    kernel = _np.exp(-0.5 * (offsets / sigma) ** 2)
+
+    valid = _np.isfinite(heights)
+    # Filter the heights and their weights together: (2, rows, columns)
+    stacked = _np.stack([_np.where(valid, heights, 0.0),
+                         valid.astype(_np.float64)])
+    for axis in (2, 1):
+        stacked = _convolve(stacked, kernel, axis)
+    weight = stacked[1]
+    with _np.errstate(invalid='ignore', divide='ignore'):
+        low_pass = stacked[0] / weight
+    low_pass[~valid | (weight < 1e-12)] = _np.nan
+    return heights - low_pass if high_pass else low_pass
+
+
+# =============================================================================
+# ---Pipeline
+# =============================================================================
+class RemovePlane(object):
+    """Pipeline stage that removes the best fit plane.
+
+    Parameters
+    ----------
+    mask : array_like of bool, optional
+        Pixels to fit; None for all pixels with data.
+    """
+
+    def __init__(self, mask=None):
+        """Initialize the stage.
+
+        Parameters
+        ----------
+        mask : array_like of bool, optional
+            Pixels to fit; None for all pixels with data.
+        """
+        self.mask = mask
+
+    def apply(self, heights, pixel_size=1.0):
+        """Return `heights` with the plane removed."""
+        return remove_plane(heights, self.mask)
+
+
+class RemoveSphere(RemovePlane):
+    """Pipeline stage that removes the best fit sphere (piston, tilt and
+    power).
+
+    Parameters
+    ----------
+    mask : array_like of bool, optional
+        Pixels to fit; None for all pixels with data.
+    """
+
+    def apply(self, heights, pixel_size=1.0):
+        """Return `heights` with the sphere removed."""
+        return remove_sphere(heights, self.mask)
+
+
+class RemoveZernike(object):
+    """Pipeline stage that removes Zernike terms.
+
+    Parameters
+    ----------
+    terms : iterable of int, optional
+        Noll indices of the terms to remove.
+    mask : array_like of bool, optional
+        Pixels to fit; None for all pixels with data.
+    """
+
+    def __init__(self, terms=range(1, 5), mask=None):
+        """Initialize the stage.
+
+        Parameters
+        ----------
+        terms : iterable of int, optional
+            Noll indices of the terms to remove.
+        mask : array_like of bool, optional
+            Pixels to fit; None for all pixels with data.
+        """
+        self.terms = list(terms)
+        self.mask = mask
+
+    def apply(self, heights, pixel_size=1.0):
+        """Return `heights` with the Zernike terms removed."""
+        return remove_zernike(heights, self.terms, self.mask)
+
+
+class GaussianFilter(object):
+    """Pipeline stage that applies the Gaussian filter.
+
+    Parameters
+    ----------
+    cutoff : float
+        Cutoff wavelength, in the unit of the pipeline's pixel size.
+    high_pass : bool, optional
+        True to keep the roughness instead of the waviness.
+    """
+
+    def __init__(self, cutoff, high_pass=False):
+        """Initialize the stage.
+
+        Parameters
+        ----------
+        cutoff : float
+            Cutoff wavelength, in the unit of the pipeline's pixel size.
+        high_pass : bool, optional
+            True to keep the roughness instead of the waviness.
+        """
+        self.cutoff = cutoff
+        self.high_pass = high_pass
+
+    def apply(self, heights, pixel_size=1.0):
+        """Return the filtered `heights`."""
+        return gaussian_filter(heights, self.cutoff, pixel_size,
+                               self.high_pass)
+
+
+class Pipeline(object):
+    """A chain of form removal and filter stages.
+
+    Stages are objects with an apply(heights, pixel_size) method returning
+    new heights, such as RemovePlane, RemoveSphere, RemoveZernike and
+    GaussianFilter; each stage gets the output of the previous one.
+
+    Parameters
+    ----------
+    stages : iterable, optional
+        The stages, in order.
+    """
+
+    def __init__(self, stages=()):
+        """Initialize the pipeline.
+
+        Parameters
+        ----------
+        stages : iterable, optional
+            The stages, in order.
+        """
+        self.stages = list(stages)
+
+    def then(self, stage):
+        """Return a new pipeline with `stage` appended.
+
+        Parameters
+        ----------
+        stage : object
+            The stage to append.
+
+        Returns
+        -------
+        Pipeline
+            The extended pipeline.
+        """
+        return Pipeline(self.stages + [stage])
+
+    def apply(self, heights, pixel_size=None):
+        """Run the stages over a height map.
+
+        Parameters
+        ----------
+        heights : array_like or datx.SurfaceData
+            The height map; NaN marks pixels without data.
+        pixel_size : float, optional
+            Pixel size in the unit of the filter cutoffs; None for the
+            lateral resolution of a datx.SurfaceData (in its lateral_unit),
+            or 1.0 (pixels) for arrays.
+
+        Returns
+        -------
+        numpy.ndarray
+            The processed heights.
+        """
+        if pixel_size is None:
+            pixel_size = getattr(heights, 'lateral_resolution', None) or 1.0
+        heights = _as_heights(heights)
+        for stage in self.stages:
+            heights = stage.apply(heights, pixel_size)
+        return heights
+
+    __call__ = apply
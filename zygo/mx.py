@@ -11,9 +11,16 @@
 """
 Support basic high-level Mx functionality.
 """
+from collections import namedtuple as _namedtuple
 from enum import IntEnum
+import threading as _threading
 
 from zygo.connectionmanager import send_request as _send_request
+from zygo.connectionmanager import send_request_stream as _send_request_stream
+from zygo.connectionmanager import receive_into as _receive_into
+from zygo.connectionmanager import _CHUNK_SIZE
+from zygo.connectionmanager import _request_hook
+from zygo.connectionmanager import get_state_generation as _get_state_generation
 from zygo.connectionmanager import get_send_request as _get_send_request
 from zygo.connectionmanager import get_uid as _get_uid
 from zygo.units import Units as _Units, _validate_unit
@@ -228,6 +235,170 @@ def _validate_load_settings_options(option):
         '`option` must be of type `SettingsOption` or a valid string value')
 
 
+# =============================================================================
+# ---Result Cache
+# =============================================================================
+ResultCacheStats = _namedtuple('ResultCacheStats',
+                               ['enabled', 'hits', 'misses', 'invalidations',
+                                'entries'])
+"""namedtuple: Statistics of the result cache.
+
+enabled : bool
+    True if the cache is enabled.
+hits : int
+    Number of reads answered from the cache.
+misses : int
+    Number of reads sent to Mx while the cache was enabled.
+invalidations : int
+    Number of times cached values were dropped because the Mx state changed.
+entries : int
+    Number of values currently cached.
+"""
+
+
+class _ResultCache(object):
+    """Read-through cache of result, attribute and control values.
+
+    Values are keyed by (method, path, unit) and belong to the Mx state
+    generation in which they were read (see
+    connectionmanager.get_state_generation); the cache is emptied as soon
+    as the generation moves on.
+    """
+
+    def __init__(self):
+        """Initialize the (disabled) cache."""
+        self._lock = _threading.Lock()
+        self._values = {}
+        self._generation = None
+        self.enabled = False
+        self.max_entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _sync(self, generation):
+        """Drop the values of an older generation; call with the lock held."""
+        if generation != self._generation:
+            if self._values:
+                self._values.clear()
+                self.invalidations += 1
+            self._generation = generation
+
+    def lookup(self, key):
+        """Return (True, value) for a cached key, else (False, generation)."""
+        generation = _get_state_generation()
+        with self._lock:
+            self._sync(generation)
+            if key in self._values:
+                self.hits += 1
+                return True, self._values[key]
+            self.misses += 1
+        return False, generation
+
+    def store(self, key, value, generation):
+        """Cache a value read from Mx in `generation`."""
+        with self._lock:
+            self._sync(_get_state_generation())
+            # A value read before the latest state change is already stale
+            if generation == self._generation and \
+                    len(self._values) < self.max_entries:
+                self._values[key] = value
+
+    def clear(self, reset_stats=False):
+        """Drop all cached values, and the statistics if requested."""
+        with self._lock:
+            self._values.clear()
+            if reset_stats:
+                self.hits = self.misses = self.invalidations = 0
+
+    def stats(self):
+        """Return the ResultCacheStats of the cache."""
+        with self._lock:
+            return ResultCacheStats(self.enabled, self.hits, self.misses,
+                                    self.invalidations, len(self._values))
+
+
+_cache = _ResultCache()
+"""_ResultCache: The result cache of this module."""
+
+
+def enable_result_cache(enabled=True, max_entries=4096):
+    """Enable or disable caching of result, attribute and control values.
+
+    While enabled, the get_result_*, get_attribute_* and get_control_*
+    methods return the value read earlier for the same path and unit
+    instead of asking Mx again. All cached values are dropped after any
+    request that may change the Mx state: a measurement or acquisition,
+    analyze, load_data and the other data methods, any set_* call, a
+    completion check that reports a finished task, and so on. Requests made
+    through zygo.aio never use the cache. Changes made outside this client (for example a measurement started
+    from the Mx user interface) are not seen, so only enable the cache while
+    the script is the one driving Mx.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        True to enable the cache; False to disable and empty it.
+    max_entries : int, optional
+        Maximum number of cached values per state generation.
+    """
+    _cache.enabled = enabled
+    _cache.max_entries = max_entries
+    if not enabled:
+        _cache.clear()
+
+
+def clear_result_cache(reset_stats=False):
+    """Drop all cached values.
+
+    Parameters
+    ----------
+    reset_stats : bool, optional
+        True to reset the hit, miss and invalidation counters as well.
+    """
+    _cache.clear(reset_stats)
+
+
+def get_result_cache_stats():
+    """Get the statistics of the result cache.
+
+    Returns
+    -------
+    ResultCacheStats
+        The cache statistics.
+    """
+    return _cache.stats()
+
+
+def _cached_get_send_request(method, params):
+    """Send a getter request, answering from the result cache when enabled.
+
+    Parameters
+    ----------
+    method : str
+        Method name to invoke.
+    params : dict
+        Request parameters; 'path' and the optional 'units' make the key.
+
+    Returns
+    -------
+    object
+        The value.
+    """
+    # Requests recorded or replayed through a hook (zygo.aio) must reach it
+    # in order, so they are never answered from the cache
+    if not _cache.enabled or _request_hook.get() is not None:
+        return _get_send_request(_SERVICE, method, params)
+    key = (method, tuple(params['path']), params.get('units'))
+    found, value = _cache.lookup(key)
+    if found:
+        return value
+    generation = value
+    value = _get_send_request(_SERVICE, method, params)
+    _cache.store(key, value, generation)
+    return value
+
+
 # =============================================================================
 # ---Application Methods
 # =============================================================================
@@ -632,7 +803,7 @@ def get_attribute_bool(path):
         The attribute value.
     """
     params = {'path': path, 'uid': _get_uid()}
-    return _get_send_request(_SERVICE, 'GetAttributeBool', params)
+    return _cached_get_send_request('GetAttributeBool', params)
 
 
 def get_attribute_number(path, unit=None):
@@ -654,7 +825,7 @@ def get_attribute_number(path, unit=None):
     """
     unit_str = _validate_unit(unit)
     params = {'path': path, 'units': unit_str, 'uid': _get_uid()}
-    return _get_send_request(_SERVICE, 'GetAttributeNumber', params)
+    return _cached_get_send_request('GetAttributeNumber', params)
 
 
 def get_attribute_string(path):
@@ -671,7 +842,7 @@ def get_attribute_string(path):
         The attribute value.
     """
     params = {'path': path, 'uid': _get_uid()}
-    return _get_send_request(_SERVICE, 'GetAttributeString', params)
+    return _cached_get_send_request('GetAttributeString', params)
 
 
 def get_control_bool(path):
@@ -688,7 +859,7 @@ def get_control_bool(path):
         The control value.
     """
     params = {'path': path}
-    return _get_send_request(_SERVICE, 'GetControlBool', params)
+    return _cached_get_send_request('GetControlBool', params)
 
 
 def get_control_number(path, unit=None):
@@ -710,7 +881,7 @@ def get_control_number(path, unit=None):
     """
     unit_str = _validate_unit(unit)
     params = {'path': path, 'units': unit_str}
-    return _get_send_request(_SERVICE, 'GetControlNumber', params)
+    return _cached_get_send_request('GetControlNumber', params)
 
 
 def get_control_string(path):
@@ -727,7 +898,7 @@ def get_control_string(path):
         The control value.
     """
     params = {'path': path}
-    return _get_send_request(_SERVICE, 'GetControlString', params)
+    return _cached_get_send_request('GetControlString', params)
 
 
 def get_result_bool(path):
@@ -744,7 +915,7 @@ def get_result_bool(path):
         The result value.
     """
     params = {'path': path}
-    return _get_send_request(_SERVICE, 'GetResultBool', params)
+    return _cached_get_send_request('GetResultBool', params)
 
 
 def get_result_number(path, unit=None):
@@ -766,7 +937,7 @@ def get_result_number(path, unit=None):
     """
     unit_str = _validate_unit(unit)
     params = {'path': path, 'units': unit_str, 'uid': _get_uid()}
-    return _get_send_request(_SERVICE, 'GetResultNumber', params)
+    return _cached_get_send_request('GetResultNumber', params)
 
 
 def get_result_string(path):
@@ -783,7 +954,7 @@ def get_result_string(path):
         The result value.
     """
     params = {'path': path, 'uid': _get_uid()}
-    return _get_send_request(_SERVICE, 'GetResultString', params)
+    return _cached_get_send_request('GetResultString', params)
 
 
 # =============================================================================
@@ -1467,6 +1638,60 @@ def _get_native_image_stream(control, sub_sample=1):
                          decode=False)
 
 
+def _iter_native_image_stream(control, sub_sample=1, chunk_size=_CHUNK_SIZE):
+    """Get the full-resolution plot image, in PNG format, in chunks.
+
+    Parameters
+    ----------
+    control : tuple of str
+        The plot control to save from.
+    sub_sample : int
+        The subsample value.
+    chunk_size : int, optional
+        Maximum chunk size in bytes.
+
+    Returns
+    -------
+    iterator of bytes
+        Consecutive chunks of the full-resolution plot control image.
+    """
+    if not isinstance(sub_sample, int):
+        raise TypeError('sub_sample must be an integer.')
+    params = {'controlId': control._id, 'subSample': sub_sample}
+    # Copy each chunk, the stream reuses its buffer
+    return (bytes(chunk) for chunk in _send_request_stream(
+        _SERVICE, 'GetNativeImageStream', params, chunk_size=chunk_size))
+
+
+def _get_native_image_stream_into(control, target, sub_sample=1,
+                                  chunk_size=_CHUNK_SIZE):
+    """Write the full-resolution plot image, in PNG format, into a file
+    object or buffer.
+
+    Parameters
+    ----------
+    control : tuple of str
+        The plot control to save from.
+    target : file-like object or writable buffer
+        A binary file (anything with a write method), or a writable
+        bytes-like object large enough for the image.
+    sub_sample : int
+        The subsample value.
+    chunk_size : int, optional
+        Size of the read buffer in bytes.
+
+    Returns
+    -------
+    int
+        The number of bytes written.
+    """
+    if not isinstance(sub_sample, int):
+        raise TypeError('sub_sample must be an integer.')
+    params = {'controlId': control._id, 'subSample': sub_sample}
+    return _receive_into(target, _SERVICE, 'GetNativeImageStream', params,
+                         chunk_size=chunk_size)
+
+
 def _get_configured_plot_output_strings(control):
     """Get the list of configured result, attribute, and annotation output
     strings as displayed on the plot.
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+# ****************************************************************************
+# THIS PROGRAM IS AN UNPUBLISHED WORK FULLY PROTECTED BY THE UNITED
+# STATES COPYRIGHT LAWS AND IS CONSIDERED A TRADE SECRET BELONGING TO
+# THE COPYRIGHT HOLDER. IT IS COVERED BY THE ZYGO SOFTWARE LICENSE AGREEMENT.
+# COPYRIGHT (c) ZYGO CORPORATION.
+#
+# ****************************************************************************
+
+"""
+Pipelined multi-site scans.
+
+A serial scan moves the stage, measures and then reads results, so the stage
+is idle while results are read and the host is idle while the stage moves.
+ScanEngine overlaps the two: as soon as the acquisition at a site has
+finished, the move to the next site is started, and the analysis results and
+image streams of the current site are read while the stage travels::
+
+    engine = ScanEngine([(pv_path, Units.MicroMeters)], Units.MilliMeters,
+                        image_controls={'surface': ui.get_control(path)})
+    for record in engine.scan([Site(0, 0), Site(5, 0), Site(5, 5)]):
+        print(record.site, record.results, record.error)
+"""
+from collections import namedtuple as _namedtuple
+import time as _time
+
+from zygo import instrument as _instrument
+from zygo import motion as _motion
+from zygo import mx as _mx
+from zygo.core import ZygoError as _ZygoError
+from zygo.units import Units as _Units
+
+
+# =============================================================================
+# ---Sites and records
+# =============================================================================
+class Site(object):
+    """Represents a stage location to measure.
+
+    Parameters
+    ----------
+    x : float
+        X position.
+    y : float
+        Y position.
+    z : float or None, optional
+        Z position; None to leave the z axis where it is.
+    name : str or None, optional
+        Name reported with the site's record.
+    turret : int or None, optional
+        Turret position to measure with; None to keep the current one.
+    zoom : float or None, optional
+        Zoom value to measure with; None to keep the current one.
+    """
+
+    def __init__(self, x, y, z=None, name=None, turret=None, zoom=None):
+        """Initialize the site.
+
+        Parameters
+        ----------
+        x : float
+            X position.
+        y : float
+            Y position.
+        z : float or None, optional
+            Z position; None to leave the z axis where it is.
+        name : str or None, optional
+            Name reported with the site's record.
+        turret : int or None, optional
+            Turret position to measure with; None to keep the current one.
+        zoom : float or None, optional
+            Zoom value to measure with; None to keep the current one.
+        """
+        self.x = float(x)
+        self.y = float(y)
+        self.z = None if z is None else float(z)
+        self.name = name
+        self.turret = turret
+        self.zoom = zoom
+
+    def _axes(self, stage):
+        """Return the {AxisType: position} move dictionary for `stage`."""
+        stage2 = stage == _motion.StageType.stage2
+        axes = {_motion.AxisType.x2 if stage2 else _motion.AxisType.x: self.x,
+                _motion.AxisType.y2 if stage2 else _motion.AxisType.y: self.y}
+        if self.z is not None:
+            axes[_motion.AxisType.z2 if stage2 else _motion.AxisType.z] = self.z
+        return axes
+
+    def __repr__(self):
+        """Return a string representation of this object."""
+        return ('zygo.scan.Site({0.x!r}, {0.y!r}, {0.z!r}, {0.name!r}, '
+                '{0.turret!r}, {0.zoom!r})'.format(self))
+
+
+ScanRecord = _namedtuple('ScanRecord',
+                         ['index', 'site', 'results', 'images', 'data',
+                          'error', 'timings'])
+"""namedtuple: The outcome of one site.
+
+index : int
+    Position of the site in the scan.
+site : Site
+    The measured site.
+results : dict
+    Result values keyed by result path (floats for results read with a unit;
+    NaN where Mx returned no number, e.g. "No Data").
+images : dict
+    PNG image bytes keyed by the names given in `image_controls`.
+data : dict
+    Data bytes keyed by the names given in `data_controls`.
+error : ZygoError or None
+    The error that prevented the site from being measured or read.
+timings : dict
+    Seconds spent in 'move' (waiting for the stage), 'acquire', 'analyze'
+    and 'read' at this site.
+"""
+
+
+def _to_float(value):
+    """Convert a result value to float; NaN if it is not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+# =============================================================================
+# ---Scan engine
+# =============================================================================
+class ScanEngine(object):
+    """Measures a sequence of sites with stage moves overlapped.
+
+    Parameters
+    ----------
+    result_paths : list of tuple
+        Results to read at each site as (path, unit) tuples; use None as the
+        unit for results that are not unit numbers. All results are read in
+        one bulk request.
+    unit : units.Units
+        Unit of the site positions.
+    image_controls : dict, optional
+        Plot controls (ui.Control) whose full-resolution PNG image is read
+        at each site, keyed by name.
+    data_controls : dict, optional
+        (ui.Control, file extension) tuples whose data is read at each site
+        with Control.save_data_to_stream, keyed by name.
+    stage : motion.StageType, optional
+        The stage to move.
+    image_sub_sample : int, optional
+        Subsample value for the image streams.
+    """
+
+    def __init__(self, result_paths, unit=_Units.MilliMeters, image_controls=None,
+                 data_controls=None, stage=_motion.StageType.stage1,
+                 image_sub_sample=1):
+        """Initialize the engine.
+
+        Parameters
+        ----------
+        result_paths : list of tuple
+            Results to read at each site as (path, unit) tuples.
+        unit : units.Units
+            Unit of the site positions.
+        image_controls : dict, optional
+            Plot controls whose PNG image is read at each site, keyed by name.
+        data_controls : dict, optional
+            (ui.Control, file extension) tuples read at each site, keyed by
+            name.
+        stage : motion.StageType, optional
+            The stage to move.
+        image_sub_sample : int, optional
+            Subsample value for the image streams.
+        """
+        self.result_paths = [(tuple(path), unit_) for path, unit_ in result_paths]
+        self.unit = unit
+        self.image_controls = dict(image_controls or {})
+        self.data_controls = dict(data_controls or {})
+        self.stage = stage
+        self.image_sub_sample = image_sub_sample
+
+    def _move(self, site):
+        """Start the move to `site` and return its task."""
+        return _motion.move_absolute(site._axes(self.stage), self.unit, wait=False)
+
+    def _configure(self, site, current):
+        """Move the turret and zoom for `site` where they differ from `current`.
+
+        Returns the (turret, zoom) configuration now set.
+        """
+        turret, zoom = current
+        if site.turret is not None and site.turret != turret:
+            _instrument.move_turret(site.turret)
+            turret = site.turret
+        if site.zoom is not None and site.zoom != zoom:
+            _instrument.set_zoom(site.zoom)
+            zoom = site.zoom
+        return turret, zoom
+
+    def _read(self):
+        """Read the results, images and data of the current analysis."""
+        results = {}
+        if self.result_paths:
+            values = _mx.get_bulk_result_values(self.result_paths)
+            for (path, unit), value in zip(self.result_paths, values):
+                results[path] = _to_float(value) if unit is not None else value
+        images = dict(
+            (name, _mx._get_native_image_stream(control, self.image_sub_sample))
+            for name, control in self.image_controls.items())
+        data = dict((name, control.save_data_to_stream(extension))
+                    for name, (control, extension) in self.data_controls.items())
+        return results, images, data
+
+    def scan(self, sites):
+        """Measure each site in order, yielding one ScanRecord per site.
+
+        For each site the engine waits for the stage, moves the turret or
+        zoom if the site asks for a different one, starts a measurement
+        and, once the acquisition has finished, starts the move to the next
+        site before waiting for the analysis and reading the results. The
+        record is yielded while the stage is still moving, so processing it
+        overlaps the move as well.
+
+        A measurement or read error is reported in the site's record and the
+        scan continues; a stage error ends the scan.
+
+        Parameters
+        ----------
+        sites : iterable of Site
+            The sites to measure, in order (see sitescheduler.SiteScheduler
+            to order them for the shortest travel time).
+
+        Yields
+        ------
+        ScanRecord
+            The record of each site, in order.
+        """
+        sites = list(sites)
+        if not sites:
+            return
+        move = self._move(sites[0])
+        configuration = (None, None)
+        for index, site in enumerate(sites):
+            timings = {}
+            start = _time.perf_counter()
+            move.wait()
+            timings['move'] = _time.perf_counter() - start
+
+            error = None
+            task = None
+            start = _time.perf_counter()
+            try:
+                configuration = self._configure(site, configuration)
+                task = _instrument.measure(wait=False)
+                task.acquire_task.wait()
+            except _ZygoError as ze:
+                error = ze
+            timings['acquire'] = _time.perf_counter() - start
+
+            # The stage is free once the frames are captured
+            move = self._move(sites[index + 1]) if index + 1 < len(sites) else None
+
+            results, images, data = {}, {}, {}
+            if error is None:
+                try:
+                    start = _time.perf_counter()
+                    task.measure_task.wait()
+                    timings['analyze'] = _time.perf_counter() - start
+                    start = _time.perf_counter()
+                    results, images, data = self._read()
+                    timings['read'] = _time.perf_counter() - start
+                except _ZygoError as ze:
+                    error = ze
+            yield ScanRecord(index, site, results, images, data, error, timings)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+
+# ****************************************************************************
+# THIS PROGRAM IS AN UNPUBLISHED WORK FULLY PROTECTED BY THE UNITED
+# STATES COPYRIGHT LAWS AND IS CONSIDERED A TRADE SECRET BELONGING TO
+# THE COPYRIGHT HOLDER. IT IS COVERED BY THE ZYGO SOFTWARE LICENSE AGREEMENT.
+# COPYRIGHT (c) ZYGO CORPORATION.
+#
+# ****************************************************************************
+
+"""
+Orders scan sites for the shortest estimated stage travel time.
+
+Sites are grouped by turret and zoom so each configuration change happens
+once, and the sites of each group are ordered with a nearest-neighbour tour
+improved by 2-opt, or in serpentine (boustrophedon) order for grid layouts,
+whichever is faster::
+
+    scheduler = SiteScheduler(velocity=(20.0, 10.0))
+    schedule = scheduler.schedule(sites, start=(0.0, 0.0))
+    print('saves {:.1f} s'.format(schedule.time_saved))
+    for record in ScanEngine(paths).scan(schedule.sites):
+        ...
+"""
+from collections import namedtuple as _namedtuple
+from enum import IntEnum as _IntEnum
+
+
+# =============================================================================
+# ---Enumerations
+# =============================================================================
+class ScheduleMethod(_IntEnum):
+    """Site ordering methods."""
+    auto = 0
+    nearest_neighbor = 1
+    serpentine = 2
+    keep = 3
+
+
+def _validate_schedule_method(method):
+    """Validate input as a valid schedule method value.
+
+    Parameters
+    ----------
+    method : ScheduleMethod or str
+        Schedule method to validate.
+
+    Returns
+    -------
+    ScheduleMethod
+        The specified schedule method.
+
+    Raises
+    ------
+    TypeError
+        If the input is not a ScheduleMethod or str type.
+    ValueError
+        If the input string is not convertable to a ScheduleMethod member.
+    """
+    if isinstance(method, ScheduleMethod):
+        return method
+    if isinstance(method, str):
+        for name, member in ScheduleMethod.__members__.items():
+            if method.lower() == name.lower():
+                return member
+        raise ValueError(
+            '`method` string not a valid `ScheduleMethod` member.')
+    raise TypeError(
+        '`method` must be of type `ScheduleMethod` or a valid string value.')
+
+
+Schedule = _namedtuple('Schedule',
+                       ['sites', 'method', 'original_time', 'scheduled_time',
+                        'time_saved', 'configuration_changes'])
+"""namedtuple: The result of SiteScheduler.schedule.
+
+sites : list of scan.Site
+    The sites in visiting order.
+method : ScheduleMethod
+    The ordering method used (auto resolves to the faster method).
+original_time : float
+    Estimated seconds to visit the sites in the given order.
+scheduled_time : float
+    Estimated seconds to visit the sites in the scheduled order.
+time_saved : float
+    original_time - scheduled_time.
+configuration_changes : int
+    Number of turret/zoom changes in the scheduled order.
+"""
+
+
+# =============================================================================
+# ---Scheduler
+# =============================================================================
+class SiteScheduler(object):
+    """Orders scan sites to minimize the estimated total travel time.
+
+    Travel time between two sites is the time of the slowest axis, as the
+    stage moves all axes together: max(|dx| / vx, |dy| / vy, |dz| / vz).
+    Every change of turret or zoom between consecutive sites adds the
+    corresponding change time.
+
+    Parameters
+    ----------
+    velocity : tuple of float, optional
+        (vx, vy) or (vx, vy, vz) axis velocities in site units per second.
+    turret_change_time : float, optional
+        Seconds to move the turret.
+    zoom_change_time : float, optional
+        Seconds to change the zoom.
+    group_configurations : bool, optional
+        True to visit all sites of one turret/zoom configuration before the
+        next; False to let configuration changes compete with travel.
+    row_tolerance : float, optional
+        Maximum y difference of sites in the same grid row.
+    """
+
+    TWO_OPT_MAX_SITES = 500
+    """int: Largest group improved with 2-opt (the search is quadratic)."""
+    TWO_OPT_MAX_PASSES = 50
+    """int: Maximum number of 2-opt improvement passes."""
+
+    def __init__(self, velocity=(1.0, 1.0), turret_change_time=0.0,
+                 zoom_change_time=0.0, group_configurations=True,
+                 row_tolerance=1e-6):
+        """Initialize the scheduler.
+
+        Parameters
+        ----------
+        velocity : tuple of float, optional
+            (vx, vy) or (vx, vy, vz) axis velocities in site units per second.
+        turret_change_time : float, optional
+            Seconds to move the turret.
+        zoom_change_time : float, optional
+            Seconds to change the zoom.
+        group_configurations : bool, optional
+            True to visit all sites of one turret/zoom configuration before
+            the next.
+        row_tolerance : float, optional
+            Maximum y difference of sites in the same grid row.
+        """
+        if len(velocity) not in (2, 3) or min(velocity) <= 0:
+            raise ValueError('`velocity` must be 2 or 3 positive values.')
+        self.velocity = tuple(float(v) for v in velocity)
+        self.turret_change_time = float(turret_change_time)
+        self.zoom_change_time = float(zoom_change_time)
+        self.group_configurations = group_configurations
+        self.row_tolerance = row_tolerance
+
+    # ---Cost model
+    def travel_time(self, a, b):
+        """Estimated seconds to move from site (or point) `a` to `b`.
+
+        Parameters
+        ----------
+        a, b : scan.Site or tuple of float
+            Sites, or (x, y) / (x, y, z) positions.
+
+        Returns
+        -------
+        float
+            The travel time, including configuration changes.
+        """
+        ax, ay, az = self._position(a)
+        bx, by, bz = self._position(b)
+        time = max(abs(ax - bx) / self.velocity[0], abs(ay - by) / self.velocity[1])
+        if len(self.velocity) == 3 and az is not None and bz is not None:
+            time = max(time, abs(az - bz) / self.velocity[2])
+        return time + self._change_time(a, b)
+
+    @staticmethod
+    def _position(site):
+        """Return the (x, y, z) of a site or position tuple."""
+        if isinstance(site, tuple):
+            return (site[0], site[1], site[2] if len(site) > 2 else None)
+        return site.x, site.y, site.z
+
+    def _change_time(self, a, b):
+        """Turret and zoom change time between two sites."""
+        time = 0.0
+        a_turret, b_turret = getattr(a, 'turret', None), getattr(b, 'turret', None)
+        if b_turret is not None and a_turret != b_turret:
+            time += self.turret_change_time
+        a_zoom, b_zoom = getattr(a, 'zoom', None), getattr(b, 'zoom', None)
+        if b_zoom is not None and a_zoom != b_zoom:
+            time += self.zoom_change_time
+        return time
+
+    def path_time(self, sites, start=None):
+        """Estimated seconds to visit `sites` in order, from `start` if given.
+
+        Parameters
+        ----------
+        sites : list of scan.Site
+            The sites in visiting order.
+        start : tuple of float or None, optional
+            Initial stage position; None to start at the first site.
+
+        Returns
+        -------
+        float
+            The total travel time.
+        """
+        path = ([start] if start is not None else []) + list(sites)
+        return sum(self.travel_time(a, b) for a, b in zip(path, path[1:]))
+
+    @staticmethod
+    def _changes(sites):
+        """Count the turret/zoom configuration changes along `sites`."""
+        return sum(1 for a, b in zip(sites, sites[1:])
+                   if (a.turret, a.zoom) != (b.turret, b.zoom))
+
+    # ---Orderings
+    def _nearest_neighbor(self, sites, start):
+        """Greedy tour: always travel to the closest remaining site."""
+        remaining = list(sites)
+        path = []
+        current = start
+        if current is None:
+            current = remaining.pop(0)
+            path.append(current)
+        while remaining:
+            index = min(range(len(remaining)),
+                        key=lambda i: self.travel_time(current, remaining[i]))
+            current = remaining.pop(index)
+            path.append(current)
+        return path
+
+    def _two_opt(self, sites, start):
+        """Improve an open path by reversing segments while that shortens it.
+
+        The first site is kept first when there is no `start` position.
+        """
+        if len(sites) < 3 or len(sites) > self.TWO_OPT_MAX_SITES:
+            return sites
+        nodes = ([start] if start is not None else []) + list(sites)
+        cost = [[self.travel_time(a, b) for b in nodes] for a in nodes]
+        path = list(range(len(nodes)))
+        for _ in range(self.TWO_OPT_MAX_PASSES):
+            improved = False
+            for i in range(1, len(path) - 1):
+                for j in range(i + 1, len(path)):
+                    # Reverse path[i..j]: edges (i-1, i) and (j, j+1) change
+                    a, b, c = path[i - 1], path[i], path[j]
+                    before = cost[a][b]
+                    after = cost[a][c]
+                    if j + 1 < len(path):
+                        d = path[j + 1]
+                        before += cost[c][d]
+                        after += cost[b][d]
+                    if after < before - 1e-12:
+                        path[i:j + 1] = path[i:j + 1][::-1]
+                        improved = True
+            if not improved:
+                break
+        ordered = [nodes[k] for k in path]
+        return ordered[1:] if start is not None else ordered
+
+    def _rows(self, sites):
+        """Group sites into rows of equal y (within row_tolerance)."""
+        rows = []
+        for site in sorted(sites, key=lambda s: (s.y, s.x)):
+            if rows and abs(site.y - rows[-1][0].y) <= self.row_tolerance:
+                rows[-1].append(site)
+            else:
+                rows.append([site])
+        return rows
+
+    def _serpentine(self, sites, start):
+        """Visit rows in y order, alternating the x direction of each row."""
+        rows = self._rows(sites)
+        candidates = []
+        for rows_ in (rows, rows[::-1]):
+            for first_reversed in (False, True):
+                path = []
+                for i, row in enumerate(rows_):
+                    forward = (i % 2 == 0) != first_reversed
+                    path.extend(row if forward else row[::-1])
+                candidates.append(path)
+        return min(candidates, key=lambda path: self.path_time(path, start))
+
+    def _order(self, sites, start, method):
+        """Order one group of sites; return (sites, method used)."""
+        if method == ScheduleMethod.keep or len(sites) < 2:
+            return list(sites), method
+        orders = {}
+        # On a tie the serpentine order wins; it is the more predictable path
+        if method in (ScheduleMethod.auto, ScheduleMethod.serpentine):
+            orders[ScheduleMethod.serpentine] = self._serpentine(sites, start)
+        if method in (ScheduleMethod.auto, ScheduleMethod.nearest_neighbor):
+            orders[ScheduleMethod.nearest_neighbor] = self._two_opt(
+                self._nearest_neighbor(sites, start), start)
+        best = min(orders, key=lambda m: self.path_time(orders[m], start))
+        return orders[best], best
+
+    def _groups(self, sites):
+        """Split sites by (turret, zoom), in order of first appearance."""
+        groups = {}
+        for site in sites:
+            groups.setdefault((site.turret, site.zoom), []).append(site)
+        return list(groups.values())
+
+    def schedule(self, sites, start=None, method=ScheduleMethod.auto):
+        """Order `sites` for the shortest estimated travel time.
+
+        Parameters
+        ----------
+        sites : iterable of scan.Site
+            The sites to visit.
+        start : tuple of float or None, optional
+            Current stage (x, y) position; None to start at the first site.
+        method : ScheduleMethod or str, optional
+            Ordering method; auto picks the faster of nearest_neighbor
+            (with 2-opt) and serpentine.
+
+        Returns
+        -------
+        Schedule
+            The ordered sites and the time estimates.
+        """
+        method = _validate_schedule_method(method)
+        sites = list(sites)
+        groups = self._groups(sites) if self.group_configurations else [sites]
+        ordered = []
+        used = set()
+        position = start
+        for group in groups:
+            group_order, group_method = self._order(group, position, method)
+            ordered.extend(group_order)
+            used.add(group_method)
+            if ordered:
+                position = ordered[-1]
+        used_method = used.pop() if len(used) == 1 else method
+
+        original = self.path_time(sites, start)
+        scheduled = self.path_time(ordered, start)
+        if scheduled > original:
+            # The heuristics never do worse than the given order
+            ordered, scheduled, used_method = sites, original, ScheduleMethod.keep
+        return Schedule(ordered, used_method, original, scheduled,
+                        original - scheduled, self._changes(ordered))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# ****************************************************************************
+# THIS PROGRAM IS AN UNPUBLISHED WORK FULLY PROTECTED BY THE UNITED
+# STATES COPYRIGHT LAWS AND IS CONSIDERED A TRADE SECRET BELONGING TO
+# THE COPYRIGHT HOLDER. IT IS COVERED BY THE ZYGO SOFTWARE LICENSE AGREEMENT.
+# COPYRIGHT (c) ZYGO CORPORATION.
+#
+# ****************************************************************************
+
+"""
+Computes ISO 25178 height parameters from height maps locally.
+
+Height maps loaded with zygo.datx are evaluated without asking Mx for each
+result; pixels without data (NaN or infinite) are ignored, and any number of
+masked regions can be evaluated on the same map::
+
+    data = datx.load(control.save_data_to_stream('.datx'))
+    params = surface.parameters(data.heights(Units.NanoMeters))
+    print(params.Sa, params.Sq, params.PV)
+    regions = surface.region_parameters(data, {'center': center_mask})
+
+All parameters are computed on the heights as given, about their mean
+height; remove tilt and form from the map first where needed (see
+zygo.form).
+
+This module requires numpy.
+"""
+from collections import namedtuple as _namedtuple
+
+import numpy as _np
+
+
+SurfaceParameters = _namedtuple('SurfaceParameters',
+                                ['PV', 'RMS', 'Sa', 'Sq', 'Ssk', 'Sku', 'Sp',
+                                 'Sv', 'Sz', 'points'])
+"""namedtuple: Height parameters of a surface or region.
+
+PV : float
+    Peak to valley, max - min.
+RMS : float
+    Root mean square deviation from the mean; the same as Sq.
+Sa : float
+    Arithmetical mean height, mean(|z - mean|).
+Sq : float
+    Root mean square height, sqrt(mean((z - mean)**2)).
+Ssk : float
+    Skewness, mean((z - mean)**3) / Sq**3; NaN for a flat surface.
+Sku : float
+    Kurtosis, mean((z - mean)**4) / Sq**4; NaN for a flat surface.
+Sp : float
+    Maximum peak height above the mean.
+Sv : float
+    Maximum pit depth below the mean (a positive value).
+Sz : float
+    Maximum height, Sp + Sv (ISO 25178-2); equal to PV.
+points : int
+    Number of valid pixels evaluated; all values are NaN when it is 0.
+
+Values are in the unit of the heights (Ssk and Sku are unitless).
+"""
+
+
+def _heights(heights):
+    """Return the height array of an array or datx.SurfaceData."""
+    if hasattr(heights, 'heights') and callable(heights.heights):
+        return heights.heights()
+    return _np.asarray(heights)
+
+
+def parameters(heights, mask=None):
+    """Compute the height parameters of a height map.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN or infinite values mark pixels without data.
+    mask : array_like of bool, optional
+        Pixels to evaluate (True); None for all pixels with data.
+
+    Returns
+    -------
+    SurfaceParameters
+        The parameters, in the unit of the heights.
+
+    Raises
+    ------
+    ValueError
+        If `mask` does not have the shape of `heights`.
+    """
+    heights = _heights(heights)
+    valid = _np.isfinite(heights)
+    if mask is not None:
+        mask = _np.asarray(mask, dtype=bool)
+        if mask.shape != heights.shape:
+            raise ValueError('`mask` must have the shape of `heights`.')
+        valid &= mask
+    return _parameters(heights[valid])
+
+
+def region_parameters(heights, masks):
+    """Compute the height parameters of several regions of a height map.
+
+    Parameters
+    ----------
+    heights : array_like or datx.SurfaceData
+        The height map; NaN or infinite values mark pixels without data.
+    masks : dict or sequence of array_like of bool
+        Region masks (True inside), keyed by region name, or in a sequence.
+
+    Returns
+    -------
+    dict or list of SurfaceParameters
+        The parameters of each region, keyed or ordered as `masks`.
+    """
+    heights = _heights(heights)
+    if isinstance(masks, dict):
+        return dict((name, parameters(heights, mask))
+                    for name, mask in masks.items())
+    return [parameters(heights, mask) for mask in masks]
+
+
+def _parameters(values):
+    """Compute the parameters of a 1-D array of valid heights."""
+    count = values.size
+    if count == 0:
+        nan = float('nan')
+        return SurfaceParameters(nan, nan, nan, nan, nan, nan, nan, nan, nan,
+                                 0)
+    values = values.astype(_np.float64, copy=False)
+    mean = values.mean()
+    deviation = values - mean
+    square = deviation * deviation
+    sq = float(_np.sqrt(square.mean()))
+    sa = float(_np.abs(deviation).mean())
+    sp = float(deviation.max())
+    sv = float(-deviation.min())
+    if sq > 0.0:
+        ssk = float(_np.dot(square, deviation) / count) / sq ** 3
+        sku = float(_np.dot(square, square) / count) / sq ** 4
+    else:
+        ssk = sku = float('nan')
+    return SurfaceParameters(sp + sv, sq, sa, sq, ssk, sku, sp, sv, sp + sv,
+                             int(count))
@@ -14,10 +14,16 @@ Supports Mx user interface functionality.
 from abc import ABCMeta as _ABCMeta, abstractmethod as _abstractmethod
 from enum import IntEnum as _IntEnum
 from datetime import datetime as _datetime
+import threading as _threading
 import warnings as _warnings
 
 from zygo.connectionmanager import send_request as _send_request
 from zygo.connectionmanager import get_send_request as _get_send_request
+from zygo.connectionmanager import send_request_stream as _send_request_stream
+from zygo.connectionmanager import receive_into as _receive_into
+from zygo.connectionmanager import _CHUNK_SIZE
+from zygo.connectionmanager import get_application_generation as \
+    _get_application_generation
 from zygo.systemcommands import _validate_file_type
 from zygo.units import _validate_unit, Units as _Units
 from zygo import _charts as charts
@@ -1324,6 +1330,87 @@ class Control(object):
         bytes
             The control's data, of the requested type, as a bytes object.
         """
+        params = self._save_data_to_stream_params(file_extension,
+                                                  optional_params)
+        return _send_request(_SERVICE,
+                             'SaveDataToStream',
+                             params,
+                             decode=False)
+
+    def iter_data_stream(self, file_extension, optional_params=None,
+                         chunk_size=_CHUNK_SIZE):
+        """Get the control's data as a sequence of chunks.
+
+        Same as save_data_to_stream, but the data is read from Mx in chunks
+        of at most `chunk_size` bytes instead of as one bytes object, so the
+        whole data set never has to fit in memory.
+
+        Parameters
+        ----------
+        file_extension : str
+            The file type of the data to save (as an extension, e.g., '.datx'
+            or '.csv').
+        optional_params : IOptionalParams, optional
+            The optional process stats, CodeV, or Sdf parameters used for
+            saving data.
+        chunk_size : int, optional
+            Maximum chunk size in bytes.
+
+        Raises
+        ------
+        TypeError
+            If `optional_params` is not an IOptionalParams type or None.
+
+        Returns
+        -------
+        iterator of bytes
+            Consecutive chunks of the control's data.
+        """
+        params = self._save_data_to_stream_params(file_extension,
+                                                  optional_params)
+        # Copy each chunk, the stream reuses its buffer
+        return (bytes(chunk) for chunk in _send_request_stream(
+            _SERVICE, 'SaveDataToStream', params, chunk_size=chunk_size))
+
+    def save_data_into(self, target, file_extension, optional_params=None,
+                       chunk_size=_CHUNK_SIZE):
+        """Write the control's data into a file object or buffer.
+
+        Same as save_data_to_stream, but the data is copied from the socket
+        straight into `target` through a buffer of `chunk_size` bytes.
+
+        Parameters
+        ----------
+        target : file-like object or writable buffer
+            A binary file (anything with a write method), or a writable
+            bytes-like object (bytearray, memoryview, ...) large enough for
+            the data, which is filled from its start.
+        file_extension : str
+            The file type of the data to save (as an extension, e.g., '.datx'
+            or '.csv').
+        optional_params : IOptionalParams, optional
+            The optional process stats, CodeV, or Sdf parameters used for
+            saving data.
+        chunk_size : int, optional
+            Size of the read buffer in bytes.
+
+        Raises
+        ------
+        TypeError
+            If `optional_params` is not an IOptionalParams type or None.
+
+        Returns
+        -------
+        int
+            The number of bytes written.
+        """
+        params = self._save_data_to_stream_params(file_extension,
+                                                  optional_params)
+        return _receive_into(target, _SERVICE, 'SaveDataToStream', params,
+                             chunk_size=chunk_size)
+
+    def _save_data_to_stream_params(self, file_extension, optional_params):
+        """Build the parameters of a SaveDataToStream request."""
         opt_args = []
         if optional_params is not None:
             if isinstance(optional_params, Control.IOptionalParams):
@@ -1332,13 +1419,9 @@ class Control(object):
                 raise TypeError(
                     '`optional_params` must be of type `IOptionalParams`.')
 
-        params = {'controlId': self._id,
-                  'fileExtension': file_extension,
-                  'optArgs': opt_args}
-        return _send_request(_SERVICE,
-                             'SaveDataToStream',
-                             params,
-                             decode=False)
+        return {'controlId': self._id,
+                'fileExtension': file_extension,
+                'optArgs': opt_args}
 
     def save_image(self, file_path):
         """Save the control's image to file.
@@ -1894,6 +1977,238 @@ class Group(object):
                            format(container_name))
 
 
+# =============================================================================
+# ---Control Tree Index
+# =============================================================================
+class ControlTree(object):
+    """Memoized index of the Mx user interface tree.
+
+    Walking the tree through Tab.groups, Group.containers,
+    Container.controls and Control.controls sends one request per node on
+    every visit. The index asks Mx for the children of each node only once
+    and keeps every control it has seen by path and by name, so repeated
+    lookups cost no requests::
+
+        tree = ui.get_control_tree()
+        surface = tree.get_control(('Surface Data',))
+        plots = tree.find_controls('Surface Map')
+
+    The index is emptied automatically after an application is opened or
+    closed through this client; call invalidate() after changing the user
+    interface any other way.
+    """
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._lock = _threading.Lock()
+        self._generation = None
+        self._children = {}
+        self._by_path = {}
+        self._by_name = {}
+        self._complete = False
+
+    def invalidate(self):
+        """Forget everything read from Mx so far."""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        """Empty the index; call with the lock held."""
+        self._children.clear()
+        self._by_path.clear()
+        self._by_name.clear()
+        self._complete = False
+
+    def _sync(self):
+        """Empty the index if an application was opened or closed since it
+        was filled; call with the lock held."""
+        generation = _get_application_generation()
+        if generation != self._generation:
+            self._reset()
+            self._generation = generation
+
+    def _add(self, control):
+        """Index a control; call with the lock held. Returns the indexed
+        control, which is the first one seen for its path."""
+        if control.path is None:
+            return control
+        known = self._by_path.get(control.path)
+        if known is not None:
+            return known
+        self._by_path[control.path] = control
+        self._by_name.setdefault(control.name.lower(), []).append(control)
+        return control
+
+    def children(self, node=None):
+        """Get the children of a node, asking Mx only the first time.
+
+        Parameters
+        ----------
+        node : Tab, Group, Container, ContainerWindow, Window, Control or None
+            The node; None for the root, whose children are the tabs.
+
+        Returns
+        -------
+        tuple
+            The groups of a tab, the containers of a group, the controls of
+            a container, window or control, or the tabs.
+        """
+        if node is None:
+            key = None
+        else:
+            key = (type(node).__name__, getattr(node, '_id', node.name))
+        with self._lock:
+            self._sync()
+            generation = self._generation
+            if key in self._children:
+                return self._children[key]
+        if node is None:
+            children = get_tabs()
+        elif isinstance(node, Tab):
+            children = node.groups
+        elif isinstance(node, Group):
+            children = node.containers
+        else:
+            children = node.controls
+        children = tuple(children)
+        with self._lock:
+            self._sync()
+            # Do not keep children read from a replaced user interface
+            if generation == self._generation:
+                if isinstance(node, (Container, ContainerWindow, Window,
+                                     Control)):
+                    children = tuple(self._add(child) for child in children)
+                children = self._children.setdefault(key, children)
+        return children
+
+    def walk(self, node=None):
+        """Iterate over a node and all of its descendants, depth first.
+
+        Parameters
+        ----------
+        node : Tab, Group, Container, ContainerWindow, Window, Control or None
+            The node to start from; None for the whole tree.
+
+        Yields
+        ------
+        object
+            The nodes, starting with `node` itself (unless it is None).
+        """
+        if node is not None:
+            yield node
+        seen = set()
+        stack = list(reversed(self.children(node)))
+        while stack:
+            child = stack.pop()
+            path = getattr(child, 'path', None)
+            if path is not None:
+                # A control may be listed by its container and its parent
+                if path in seen:
+                    continue
+                seen.add(path)
+            yield child
+            stack.extend(reversed(self.children(child)))
+
+    def build(self):
+        """Read the whole tree of tabs, groups, containers and controls.
+
+        Lookups by name need the complete tree and call this method the
+        first time; lookups by path do not.
+        """
+        with self._lock:
+            self._sync()
+            if self._complete:
+                return
+            generation = self._generation
+        for _ in self.walk():
+            pass
+        with self._lock:
+            self._sync()
+            if generation == self._generation:
+                self._complete = True
+
+    def get_control(self, path):
+        """Get the control identified by the given path.
+
+        Controls already seen in the tree are returned without a request;
+        other paths are resolved with ui.get_control once and remembered.
+
+        Parameters
+        ----------
+        path : tuple of str
+            Path to the control.
+
+        Returns
+        -------
+        Control
+            A control object representing the Mx GUI control.
+        """
+        path = tuple(path)
+        with self._lock:
+            self._sync()
+            generation = self._generation
+            if path in self._by_path:
+                return self._by_path[path]
+        control = get_control(path)
+        with self._lock:
+            self._sync()
+            if generation == self._generation:
+                control = self._add(control)
+                # Remember the requested path too, in case Mx normalizes it
+                self._by_path.setdefault(path, control)
+        return control
+
+    def find_controls(self, name):
+        """Get all controls with the given name (case insensitive).
+
+        Parameters
+        ----------
+        name : str
+            The control name.
+
+        Returns
+        -------
+        tuple of Control
+            The matching controls in tree order; empty if there are none.
+        """
+        self.build()
+        with self._lock:
+            return tuple(self._by_name.get(name.lower(), ()))
+
+    def find_control(self, name):
+        """Get the first control with the given name (case insensitive).
+
+        Parameters
+        ----------
+        name : str
+            The control name.
+
+        Returns
+        -------
+        Control
+            The first matching control in tree order.
+        """
+        controls = self.find_controls(name)
+        if not controls:
+            raise RuntimeError('Could not find control "{0}"'.format(name))
+        return controls[0]
+
+
+_control_tree = ControlTree()
+"""ControlTree: The shared control tree index."""
+
+
+def get_control_tree():
+    """Get the shared, memoized index of the Mx user interface tree.
+
+    Returns
+    -------
+    ControlTree
+        The control tree index.
+    """
+    return _control_tree
+
+
 # =============================================================================
 # ---Deprecated Methods
 # =============================================================================